@@ -9,6 +9,9 @@ import sqlite3
 from datetime import datetime
 import random
 
+# 価格設定（店舗特徴を反映）
+from price_model import get_price_range
+
 # データベース接続
 conn = sqlite3.connect('../data/supermarket_prices.db')
 cursor = conn.cursor()
@@ -130,69 +133,14 @@ for supermarket in supermarkets:
     cursor.execute('''
     INSERT INTO supermarkets (name, address, latitude, longitude, phone, created_at)
     VALUES (?, ?, ?, ?, ?, ?)
-    ''', supermarket + (datetime.now().isoformat(),))
+    ''', supermarket + (datetime.now().isoformat(" "),))
 
 # 商品挿入
 for product in products:
     cursor.execute('''
     INSERT INTO products (name, category, brand, created_at)
     VALUES (?, ?, ?, ?)
-    ''', product + (datetime.now().isoformat(),))
-
-# 価格設定（店舗特徴を反映）
-def get_price_range(supermarket_name, product_name):
-    """店舗と商品の特徴に基づいて価格範囲を返す"""
-    
-    # 基本価格設定（円）
-    base_prices = {
-        "卵": 200,
-        "牛乳": 180,
-        "食パン": 150,
-        "米": 400,  # 1kg当たり
-        "鶏肉": 300,  # 100g当たり
-        "豚肉": 350,  # 100g当たり
-        "玉ねぎ": 250,  # 1袋
-        "じゃがいも": 300,  # 1袋
-        "バナナ": 150,
-        "キャベツ": 200,
-        "人参": 180,
-        "りんご": 400
-    }
-    
-    base_price = base_prices.get(product_name, 200)
-    
-    # 店舗別価格調整係数
-    if "業務スーパー" in supermarket_name:
-        # 業務スーパー：安め、大容量
-        min_factor, max_factor = 0.7, 0.9
-    elif "ビッグ・エー" in supermarket_name:
-        # ビッグエー：安め、ディスカウント
-        min_factor, max_factor = 0.75, 0.92
-    elif "ドンキホーテ" in supermarket_name:
-        # ドンキ：商品によってバラつき
-        if product_name in ["卵", "牛乳", "食パン"]:
-            min_factor, max_factor = 0.8, 1.1  # 日用品は普通
-        else:
-            min_factor, max_factor = 0.85, 1.3  # その他はバラつき大
-    elif "イオン" in supermarket_name:
-        # イオン：中程度、PB商品あり
-        min_factor, max_factor = 0.85, 1.05
-    elif "西友" in supermarket_name:
-        # 西友：安め〜中程度
-        min_factor, max_factor = 0.8, 1.0
-    elif "ライフ" in supermarket_name:
-        # ライフ：中程度、品質重視
-        min_factor, max_factor = 0.9, 1.15
-    elif "まいばすけっと" in supermarket_name:
-        # まいばすけっと：中程度、便利性重視
-        min_factor, max_factor = 0.88, 1.08
-    else:
-        min_factor, max_factor = 0.9, 1.1
-    
-    min_price = int(base_price * min_factor)
-    max_price = int(base_price * max_factor)
-    
-    return min_price, max_price
+    ''', product + (datetime.now().isoformat(" "),))
 
 # 価格データ生成と挿入
 cursor.execute('SELECT id, name FROM supermarkets')
@@ -215,7 +163,7 @@ for supermarket_id, supermarket_name in supermarket_data:
             cursor.execute('''
             INSERT INTO prices (product_id, supermarket_id, price, unit, recorded_by, recorded_at)
             VALUES (?, ?, ?, ?, ?, ?)
-            ''', (product_id, supermarket_id, price, "個", recorded_by, datetime.now().isoformat()))
+            ''', (product_id, supermarket_id, price, "個", recorded_by, datetime.now().isoformat(" ")))
 
 # コミットして接続を閉じる
 conn.commit()
@@ -224,4 +172,12 @@ conn.close()
 print("ダミーデータの投入が完了しました！")
 print(f"スーパーマーケット: {len(supermarkets)}店舗")
 print(f"商品: {len(products)}種類")
-print("各店舗×商品の組み合わせで2-3個の価格データを生成")
\ No newline at end of file
+print("各店舗×商品の組み合わせで2-3個の価格データを生成")
+
+# 価格を直接投入したので基準単位あたりの価格を埋め、導出テーブル（最新価格・価格履歴の集計・
+# 地域の価格分布・全文検索の索引）を manage.py rebuild と同じ処理で作り直す
+import backfill_unit_prices  # noqa: E402
+import manage  # noqa: E402
+
+backfill_unit_prices.main([])
+manage.main(["rebuild"])
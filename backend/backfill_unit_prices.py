@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基準単位あたりの価格（price_per_base_unit, base_unit）が空の価格を埋めるスクリプト
+
+列を追加する前に登録された価格や、pricesへ直接投入した価格に対して実行する。
+単位の文字列ごとに換算してIDの範囲ごとにUPDATEし、範囲ごとにコミットするので、
+途中で止めても次回は残りから続けられる。最後に最新価格テーブルの分も埋める。
+
+使い方（backendディレクトリで実行）:
+    python backfill_unit_prices.py
+    python backfill_unit_prices.py --chunk-size 200000
+"""
+
+import argparse
+import time
+
+from sqlalchemy import func, select, update
+
+import database
+import models
+import units
+
+price_table = models.Price.__table__
+latest_table = models.LatestPrice.__table__
+
+
+def backfill_prices(db, chunk_size):
+    """price_per_base_unit が空の価格を埋め、更新した件数を返す"""
+    min_id, max_id = db.execute(
+        select(func.min(price_table.c.id), func.max(price_table.c.id))
+        .where(price_table.c.price_per_base_unit.is_(None))
+    ).one()
+    if min_id is None:
+        return 0
+
+    unit_list = [row[0] for row in db.execute(
+        select(price_table.c.unit).where(price_table.c.price_per_base_unit.is_(None)).distinct()
+    )]
+    updated = 0
+    started = time.perf_counter()
+    for start in range(min_id, max_id + 1, chunk_size):
+        in_chunk = price_table.c.id.between(start, start + chunk_size - 1) & price_table.c.price_per_base_unit.is_(None)
+        for unit in unit_list:
+            quantity, base_unit = units.parse_unit(unit)
+            same_unit = price_table.c.unit.is_(None) if unit is None else price_table.c.unit == unit
+            # units.normalize と同じく、数量が0以下の単位（"0g" など）は価格のままにする
+            per_base_unit = price_table.c.price / quantity if quantity > 0 else price_table.c.price
+            updated += db.execute(
+                update(price_table)
+                .where(in_chunk & same_unit)
+                .values(price_per_base_unit=per_base_unit, base_unit=base_unit)
+            ).rowcount
+        db.commit()
+        done = min(start + chunk_size - 1, max_id)
+        print(f"  価格: ID {done:,}/{max_id:,}まで {updated:,}件 ({updated / (time.perf_counter() - started):,.0f}件/秒)")
+    return updated
+
+
+def backfill_latest_prices(db):
+    """最新価格テーブルの空の行を、元の価格の値で埋める"""
+    source = select(price_table.c.price_per_base_unit, price_table.c.base_unit).where(
+        price_table.c.id == latest_table.c.price_id
+    )
+    updated = db.execute(
+        update(latest_table)
+        .where(latest_table.c.price_per_base_unit.is_(None))
+        .values(
+            price_per_base_unit=source.with_only_columns(price_table.c.price_per_base_unit).scalar_subquery(),
+            base_unit=source.with_only_columns(price_table.c.base_unit).scalar_subquery(),
+        )
+    ).rowcount
+    db.commit()
+    return updated
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="基準単位あたりの価格の埋め戻し")
+    parser.add_argument("--chunk-size", type=int, default=500000, help="1トランザクションで処理するIDの範囲")
+    args = parser.parse_args(argv)
+
+    models.create_schema(database.engine)
+    db = database.SessionLocal()
+    try:
+        prices = backfill_prices(db, args.chunk_size)
+        latest = backfill_latest_prices(db)
+    finally:
+        db.close()
+
+    print("基準単位あたりの価格の埋め戻しが完了しました！")
+    print(f"価格: {prices:,}件 / 最新価格: {latest:,}件")
+
+
+if __name__ == "__main__":
+    main()
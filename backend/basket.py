@@ -0,0 +1,159 @@
+"""
+買い物リストの最適化
+
+指定した地点の周辺店舗の中から、リストの商品を最も安く揃えられる
+1店舗と、2店舗の組み合わせを求める。店舗までの距離（km）には
+1kmあたりの金額のペナルティをかけて合計額に加える。
+
+商品×店舗の価格行列は、商品ごとの最新価格ベクトル（店舗IDの昇順配列と価格配列）
+をキャッシュしたものから組み立てるため、リクエストごとに商品数分のクエリは発行しない。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import cache
+import models
+
+# キャッシュする商品ベクトルの上限数と有効期間（他のワーカーの書き込みはTTLで反映）
+# 複数ワーカーで起動したとき（PROCESS_CACHE=0）はキャッシュしない
+VECTOR_CACHE_SIZE = 20000 if cache.PROCESS_CACHE else 0
+VECTOR_TTL_SECONDS = cache.CACHE_TTL_SECONDS
+
+# 2店舗の組み合わせを計算するときに一度に処理する店舗数
+_PAIR_BLOCK = 32
+
+_ID_CHUNK_SIZE = 500
+
+
+class PriceVectors:
+    """商品ごとの最新価格ベクトルのキャッシュ（スレッドセーフ）"""
+
+    def __init__(self, max_products=VECTOR_CACHE_SIZE, ttl=VECTOR_TTL_SECONDS):
+        self.max_products = max_products
+        self.ttl = ttl
+        self._vectors = OrderedDict()   # product_id -> (期限, 店舗ID配列, 価格配列)
+        self._versions = {}             # product_id -> 破棄された回数
+        self._lock = threading.Lock()
+
+    def get_many(self, db, product_ids):
+        """商品ID -> (店舗ID配列, 価格配列) の辞書を返す。未キャッシュの分はまとめて読む"""
+        now = time.monotonic()
+        vectors = {}
+        missing = []
+        with self._lock:
+            for product_id in product_ids:
+                item = self._vectors.get(product_id)
+                if item is not None and item[0] >= now:
+                    self._vectors.move_to_end(product_id)
+                    vectors[product_id] = item[1:]
+                else:
+                    missing.append(product_id)
+            versions = [self._versions.get(product_id, 0) for product_id in missing]
+
+        if missing:
+            loaded = self._load(db, missing)
+            with self._lock:
+                for product_id, version in zip(missing, versions):
+                    vector = loaded.get(product_id, (np.empty(0, dtype=np.int64), np.empty(0)))
+                    vectors[product_id] = vector
+                    if self._versions.get(product_id, 0) != version:
+                        # 読み込み中に破棄された（古い価格を読んだ可能性がある）ので保存しない
+                        continue
+                    self._vectors[product_id] = (now + self.ttl,) + vector
+                while len(self._vectors) > self.max_products:
+                    self._vectors.popitem(last=False)
+        return vectors
+
+    def invalidate(self, product_ids):
+        with self._lock:
+            for product_id in product_ids:
+                self._versions[product_id] = self._versions.get(product_id, 0) + 1
+                self._vectors.pop(product_id, None)
+
+    @staticmethod
+    def _load(db, product_ids):
+        rows = []
+        for i in range(0, len(product_ids), _ID_CHUNK_SIZE):
+            chunk = product_ids[i:i + _ID_CHUNK_SIZE]
+            rows.extend(
+                db.query(
+                    models.LatestPrice.product_id,
+                    models.LatestPrice.supermarket_id,
+                    models.LatestPrice.price,
+                )
+                .filter(models.LatestPrice.product_id.in_(chunk))
+                .order_by(models.LatestPrice.product_id, models.LatestPrice.supermarket_id)
+                .all()
+            )
+        if not rows:
+            return {}
+        data = np.array(rows, dtype=np.float64)
+        product_column = data[:, 0].astype(np.int64)
+        boundaries = np.flatnonzero(np.diff(product_column)) + 1
+        vectors = {}
+        for block in np.split(np.arange(len(rows)), boundaries):
+            vectors[int(product_column[block[0]])] = (
+                data[block, 1].astype(np.int64),
+                np.ascontiguousarray(data[block, 2]),
+            )
+        return vectors
+
+
+price_vectors = PriceVectors()
+
+
+def _on_invalidate(tags):
+    # 価格の登録で "compare:<商品ID>" が破棄されたら該当商品のベクトルも捨てる
+    price_vectors.invalidate([int(tag.split(":", 1)[1]) for tag in tags if tag.startswith("compare:")])
+
+
+cache.add_invalidation_listener(_on_invalidate)
+
+
+def price_matrix(vectors, product_ids, store_ids):
+    """(商品数, 店舗数) の価格行列を作る。取り扱いのない組み合わせは inf"""
+    matrix = np.full((len(product_ids), len(store_ids)), np.inf)
+    for row, product_id in enumerate(product_ids):
+        vector_stores, vector_prices = vectors[product_id]
+        if not len(vector_stores):
+            continue
+        positions = np.searchsorted(vector_stores, store_ids)
+        positions = np.minimum(positions, len(vector_stores) - 1)
+        found = vector_stores[positions] == store_ids
+        matrix[row, found] = vector_prices[positions[found]]
+    return matrix
+
+
+def best_single_store(matrix, penalties):
+    """すべての商品を扱う店舗のうち、合計額＋距離ペナルティが最小の店舗の列番号を返す"""
+    costs = matrix.sum(axis=0) + penalties
+    if not len(costs) or not np.isfinite(costs.min()):
+        return None
+    return int(np.argmin(costs))
+
+
+def best_store_pair(matrix, penalties):
+    """
+    2店舗で買い分けたときの合計額＋距離ペナルティが最小の組み合わせの列番号(i, j)を返す
+
+    商品ごとに2店舗の安い方で買うものとして、全ての組み合わせをブロック単位で計算する。
+    """
+    store_count = matrix.shape[1]
+    best = (np.inf, None)
+    for start in range(0, store_count - 1, _PAIR_BLOCK):
+        stop = min(start + _PAIR_BLOCK, store_count - 1)
+        # block[a, i, j] = min(matrix[a, start + i], matrix[a, j])
+        block = np.minimum(matrix[:, start:stop, np.newaxis], matrix[:, np.newaxis, :])
+        costs = block.sum(axis=0) + penalties[start:stop, np.newaxis] + penalties[np.newaxis, :]
+        # 同じ店舗同士と、重複する (j, i) の組み合わせは除く
+        rows = np.arange(start, stop)[:, np.newaxis]
+        costs[np.arange(store_count)[np.newaxis, :] <= rows] = np.inf
+        position = int(np.argmin(costs))
+        i, j = divmod(position, store_count)
+        if costs[i, j] < best[0]:
+            best = (costs[i, j], (start + i, j))
+    return best[1]
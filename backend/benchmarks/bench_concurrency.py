@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+同時接続ベンチマーク
+
+一時データベースにデータを投入してuvicornを起動し、並列クライアント数を
+変えながら /supermarkets-nearby と /prices/compare/{id} のスループットを測る。
+DB処理がイベントループをブロックしていると、並列数を増やしても req/s が伸びない。
+
+使い方（backendディレクトリで実行、httpxが必要: pip install -r requirements-dev.txt）:
+    python benchmarks/bench_concurrency.py
+    python benchmarks/bench_concurrency.py --clients 1 4 16 --duration 5
+    python benchmarks/bench_concurrency.py --url http://localhost:8000  # 起動済みのサーバーを測る
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def seed_database(url, stores, products, prices_per_pair, seed):
+    """ベンチマーク用のデータを投入する（東京周辺に店舗を配置）"""
+    os.environ["DATABASE_URL"] = url
+    sys.path.insert(0, BACKEND_DIR)
+    import database
+    import latest_prices
+    import models
+
+    rng = random.Random(seed)
+    models.create_schema(database.engine)
+    db = database.SessionLocal()
+    try:
+        db.execute(models.Supermarket.__table__.insert(), [
+            {"name": f"店舗{i}", "address": "東京都", "latitude": 35.68 + rng.gauss(0, 0.05),
+             "longitude": 139.76 + rng.gauss(0, 0.05)}
+            for i in range(stores)
+        ])
+        db.execute(models.Product.__table__.insert(), [
+            {"name": f"商品{i}", "category": "食品"} for i in range(products)
+        ])
+        db.execute(models.Price.__table__.insert(), [
+            {"product_id": p + 1, "supermarket_id": s + 1, "price": rng.randint(100, 500),
+             "unit": "個", "recorded_by": "bench"}
+            for p in range(products) for s in range(stores) for _ in range(prices_per_pair)
+        ])
+        latest_prices.rebuild(db)
+        db.commit()
+    finally:
+        db.close()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(database_url, port):
+    env = dict(os.environ, DATABASE_URL=database_url)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            httpx.get(base_url + "/", timeout=1)
+            return process, base_url
+        except httpx.TransportError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("サーバーが起動しませんでした")
+
+
+async def run_clients(base_url, make_path, clients, duration):
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def client(client_id):
+        nonlocal errors
+        rng = random.Random(client_id)
+        async with httpx.AsyncClient(base_url=base_url, timeout=30) as http:
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                response = await http.get(make_path(rng))
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(clients)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000 if latencies else 0,
+        "p95_ms": latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0,
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="同時接続ベンチマーク")
+    parser.add_argument("--url", help="起動済みサーバーのURL（指定時はデータ投入と起動を行わない）")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--duration", type=float, default=3.0, help="並列数ごとの計測秒数")
+    parser.add_argument("--stores", type=int, default=2000)
+    parser.add_argument("--products", type=int, default=50)
+    parser.add_argument("--prices-per-pair", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    process = None
+    if args.url:
+        base_url = args.url.rstrip("/")
+    else:
+        tmpdir = tempfile.mkdtemp()
+        database_url = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+        print("データを投入しています...")
+        seed_database(database_url, args.stores, args.products, args.prices_per_pair, args.seed)
+        process, base_url = start_server(database_url, free_port())
+
+    endpoints = {
+        "/supermarkets-nearby": lambda rng: (
+            f"/supermarkets-nearby?latitude={35.68 + rng.uniform(-0.05, 0.05):.4f}"
+            f"&longitude={139.76 + rng.uniform(-0.05, 0.05):.4f}&radius=3"
+        ),
+        "/prices/compare/{id}": lambda rng: f"/prices/compare/{rng.randint(1, args.products)}",
+    }
+
+    try:
+        for name, make_path in endpoints.items():
+            print(f"\n{name}")
+            print(f"{'並列数':>6} | {'req/s':>8} | {'p50(ms)':>8} | {'p95(ms)':>8} | {'エラー':>4}")
+            print("-" * 50)
+            for clients in args.clients:
+                result = asyncio.run(run_clients(base_url, make_path, clients, args.duration))
+                print(f"{clients:>6} | {result['rps']:>8.1f} | {result['p50_ms']:>8.2f} | "
+                      f"{result['p95_ms']:>8.2f} | {result['errors']:>4}")
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
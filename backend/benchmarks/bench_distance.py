@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+距離計算ベンチマーク
+
+従来の1店舗ずつのハバーサイン計算ループと、geo.StoreIndex による
+NumPyのまとめ計算を 1千 / 1万 / 10万店舗で比較する。
+
+使い方（backendディレクトリで実行）:
+    python benchmarks/bench_distance.py
+    python benchmarks/bench_distance.py --sizes 1000 10000 --repeat 10
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import geo  # noqa: E402
+
+# 東京駅周辺を検索の中心にする
+ORIGIN = (35.6812, 139.7671)
+
+
+def legacy_calculate_distance(lat1, lon1, lat2, lon2):
+    """変更前の main.calculate_distance と同じ実装（呼び出し毎に math を import）"""
+    import math
+
+    R = 6371
+
+    lat1_rad = math.radians(lat1)
+    lon1_rad = math.radians(lon1)
+    lat2_rad = math.radians(lat2)
+    lon2_rad = math.radians(lon2)
+
+    dlat = lat2_rad - lat1_rad
+    dlon = lon2_rad - lon1_rad
+
+    a = math.sin(dlat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon/2)**2
+    c = 2 * math.asin(math.sqrt(a))
+
+    return R * c
+
+
+def legacy_nearby(stores, latitude, longitude, radius):
+    nearby = []
+    for store_id, lat, lon in stores:
+        distance = legacy_calculate_distance(latitude, longitude, lat, lon)
+        if distance <= radius:
+            nearby.append((store_id, distance))
+    nearby.sort(key=lambda x: x[1])
+    return nearby
+
+
+def generate_stores(count, seed):
+    """日本列島（おおよそ北緯31〜43度、東経130〜145度）に店舗をばらまく"""
+    rng = random.Random(seed)
+    return [
+        (i + 1, rng.uniform(31.0, 43.0), rng.uniform(130.0, 145.0))
+        for i in range(count)
+    ]
+
+
+def best_of(repeat, func):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="距離計算ベンチマーク")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--radius", type=float, default=5.0, help="検索半径（km）")
+    parser.add_argument("--top-k", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'店舗数':>8} | {'従来ループ':>10} | {'全件距離':>10} | {'半径内':>10} | {'上位k件':>10}  (ms, best of {args.repeat})")
+    print("-" * 72)
+    for size in args.sizes:
+        stores = generate_stores(size, args.seed)
+        ids, latitudes, longitudes = zip(*stores)
+        index = geo.StoreIndex(ids, latitudes, longitudes)
+        lat, lon = ORIGIN
+
+        # 結果が従来実装と一致することを確認してから計測する
+        expected = [store_id for store_id, _ in legacy_nearby(stores, lat, lon, args.radius)]
+        got, _ = index.within_radius(lat, lon, args.radius)
+        assert sorted(expected) == sorted(got.tolist()), "半径内の店舗が従来実装と一致しません"
+
+        legacy = best_of(args.repeat, lambda: legacy_nearby(stores, lat, lon, args.radius))
+        full = best_of(args.repeat, lambda: index.distances(lat, lon))
+        radius = best_of(args.repeat, lambda: index.within_radius(lat, lon, args.radius))
+        top_k = best_of(args.repeat, lambda: index.nearest(lat, lon, args.top_k))
+        print(f"{size:>8} | {legacy:>10.3f} | {full:>10.3f} | {radius:>10.3f} | {top_k:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
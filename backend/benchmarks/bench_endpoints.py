@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+APIエンドポイントのベンチマーク
+
+generate_data.py で規模の異なるデータベースを作り、各エンドポイントを
+プロセス内（ASGIクライアントから直接 main.app を呼ぶ）と uvicorn（ワーカー数指定）の
+両方で叩いて、p50/p95/p99 レイテンシと req/s を測る。
+結果はJSONで保存し、--baseline に前回の結果を渡すと差分を表示する。
+
+キャッシュは既定で無効にして測る（--cache memory で有効）。
+データベースは --data-dir に規模ごとに作って次回以降も使い回す（POST /prices/ の分は増えていく）。
+
+使い方（backendディレクトリで実行、httpxが必要: pip install -r requirements-dev.txt）:
+    python benchmarks/bench_endpoints.py
+    python benchmarks/bench_endpoints.py --sizes small medium --modes inprocess uvicorn --workers 4
+    python benchmarks/bench_endpoints.py --output after.json --baseline before.json
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import httpx
+
+from bench_concurrency import free_port
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# データベースの規模（店舗数, 商品数, 価格の件数）
+SIZES = {
+    "small": (200, 500, 50000),
+    "medium": (2000, 5000, 1000000),
+    "large": (50000, 100000, 100000000),
+}
+
+# 店舗の中心に使う都市（generate_data.CITIES の一部）
+CENTERS = [(35.6812, 139.7671), (34.7025, 135.4959), (35.1709, 136.8815), (43.0687, 141.3508)]
+
+SEARCH_WORDS = ["牛乳", "卵", "米 徳用", "りんご", "豚肉 国産", "パン"]
+
+# 計測の最終日（データを作り直しても同じになるよう固定）
+DATA_END = "2025-01-31"
+
+
+def make_endpoints(stores, products):
+    """エンドポイント名 -> rng から (メソッド, パス, ボディ) を作る関数"""
+    return {
+        "GET /supermarkets-nearby": lambda rng: ("GET", (
+            "/supermarkets-nearby?latitude={:.4f}&longitude={:.4f}&radius=3".format(
+                *(c + rng.uniform(-0.05, 0.05) for c in rng.choice(CENTERS)))
+        ), None),
+        "GET /supermarkets/viewport": lambda rng: ("GET", (
+            "/supermarkets/viewport?bbox={1:.4f},{0:.4f},{3:.4f},{2:.4f}&zoom=12".format(
+                *(c + d for c, d in zip(rng.choice(CENTERS) * 2, (-0.05, -0.08, 0.05, 0.08))))
+        ), None),
+        "GET /products/{id}/stats": lambda rng: ("GET", (
+            # 計測データの最終日は固定なので、月数は全期間が入るよう長めにする
+            "/products/{}/stats?latitude={:.4f}&longitude={:.4f}&radius=10&months=120".format(
+                rng.randint(1, products), *(c + rng.uniform(-0.05, 0.05) for c in rng.choice(CENTERS)))
+        ), None),
+        "GET /products/search": lambda rng: ("GET", f"/products/search?q={rng.choice(SEARCH_WORDS)}", None),
+        "GET /prices/compare/{id}": lambda rng: ("GET", f"/prices/compare/{rng.randint(1, products)}", None),
+        "GET /prices/": lambda rng: ("GET", f"/prices/?product_id={rng.randint(1, products)}&limit=100", None),
+        "POST /prices/": lambda rng: ("POST", "/prices/", {
+            "product_id": rng.randint(1, products), "supermarket_id": rng.randint(1, stores),
+            "price": rng.randint(100, 500), "unit": "個", "recorded_by": "bench",
+        }),
+    }
+
+
+def build_database(data_dir, size, seed):
+    """規模ごとのデータベースを作る（既にあれば使い回す）"""
+    stores, products, prices = SIZES[size]
+    path = os.path.join(data_dir, f"{size}-seed{seed}.db")
+    url = f"sqlite:///{path}"
+    if not os.path.exists(path):
+        print(f"[{size}] データベースを作成しています...")
+        subprocess.run(
+            [sys.executable, "generate_data.py", "--reset", "--stores", str(stores), "--products", str(products),
+             "--prices", str(prices), "--seed", str(seed), "--end", DATA_END],
+            cwd=BACKEND_DIR, env=dict(os.environ, DATABASE_URL=url), check=True, stdout=subprocess.DEVNULL,
+        )
+    return url
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0
+
+
+async def run_load(client, make_request, concurrency, duration, warmup):
+    """concurrency 個のクライアントで duration 秒間リクエストし続ける（最初の warmup 秒は集計しない）"""
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    measure_from = started + warmup
+    deadline = measure_from + duration
+
+    async def worker(worker_id):
+        nonlocal errors
+        rng = random.Random(worker_id)
+        while True:
+            start = time.perf_counter()
+            if start >= deadline:
+                break
+            method, path, body = make_request(rng)
+            response = await client.request(method, path, json=body)
+            end = time.perf_counter()
+            if start >= measure_from:
+                latencies.append(end - start)
+                if response.status_code >= 400:
+                    errors += 1
+
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - measure_from
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "errors": errors,
+    }
+
+
+async def run_endpoints(client, endpoints, args):
+    results = []
+    for name, make_request in endpoints.items():
+        for concurrency in args.concurrency:
+            result = await run_load(client, make_request, concurrency, args.duration, args.warmup)
+            results.append(dict({"endpoint": name, "concurrency": concurrency}, **result))
+            print(f"  {name:<26} 並列{concurrency:>3}: {result['rps']:>8.1f} req/s  "
+                  f"p50 {result['p50_ms']:>7.2f}ms  p95 {result['p95_ms']:>7.2f}ms  "
+                  f"p99 {result['p99_ms']:>7.2f}ms  エラー {result['errors']}")
+    return results
+
+
+def run_inprocess(database_url, cache_url, size, args):
+    """別プロセスで main を読み込み、ASGIクライアントから直接呼ぶ（DATABASE_URLは読み込み時に決まるため）"""
+    os.environ["DATABASE_URL"] = database_url
+    os.environ["CACHE_URL"] = cache_url
+    sys.path.insert(0, BACKEND_DIR)
+    import main
+
+    async def run():
+        async with main.app.router.lifespan_context(main.app):
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+                return await run_endpoints(client, make_endpoints(*SIZES[size][:2]), args)
+
+    return asyncio.run(run())
+
+
+def start_server(database_url, cache_url, port, workers):
+    env = dict(os.environ, DATABASE_URL=database_url, CACHE_URL=cache_url)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", str(workers),
+         "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            httpx.get(base_url + "/", timeout=1)
+            return process, base_url
+        except httpx.TransportError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("サーバーが起動しませんでした")
+
+
+def run_uvicorn(database_url, cache_url, size, args):
+    process, base_url = start_server(database_url, cache_url, free_port(), args.workers)
+    try:
+        async def run():
+            limits = httpx.Limits(max_connections=max(args.concurrency))
+            async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+                return await run_endpoints(client, make_endpoints(*SIZES[size][:2]), args)
+
+        return asyncio.run(run())
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_comparison(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {
+            (r["size"], r["mode"], r["endpoint"], r["concurrency"]): r for r in json.load(f)["results"]
+        }
+    print(f"\n前回（{baseline_path}）との比較（p95は小さいほど、req/sは大きいほど良い）")
+    for result in results:
+        before = baseline.get((result["size"], result["mode"], result["endpoint"], result["concurrency"]))
+        if before is None:
+            continue
+        p95 = _change(before["p95_ms"], result["p95_ms"])
+        rps = _change(before["rps"], result["rps"])
+        print(f"  [{result['size']}/{result['mode']}] {result['endpoint']:<26} 並列{result['concurrency']:>3}: "
+              f"p95 {before['p95_ms']:.2f} -> {result['p95_ms']:.2f}ms ({p95})  "
+              f"req/s {before['rps']:.1f} -> {result['rps']:.1f} ({rps})")
+
+
+def _change(before, after):
+    return f"{(after - before) / before * 100:+.1f}%" if before else "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="APIエンドポイントのベンチマーク")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=["small"])
+    parser.add_argument("--modes", nargs="+", choices=["inprocess", "uvicorn"], default=["inprocess", "uvicorn"])
+    parser.add_argument("--workers", type=int, default=2, help="uvicornのワーカー数")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8], help="並列クライアント数")
+    parser.add_argument("--duration", type=float, default=3.0, help="エンドポイント・並列数ごとの計測秒数")
+    parser.add_argument("--warmup", type=float, default=0.5, help="計測前に捨てる秒数")
+    parser.add_argument("--cache", default="none", help="サーバーのCACHE_URL（既定はキャッシュなし）")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "supermarket-bench"),
+                        help="ベンチマーク用データベースの保存先")
+    parser.add_argument("--output", default="bench_results.json", help="結果のJSONの保存先")
+    parser.add_argument("--baseline", help="比較する前回の結果のJSON")
+    args = parser.parse_args()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    results = []
+    for size in args.sizes:
+        database_url = build_database(args.data_dir, size, args.seed)
+        for mode in args.modes:
+            print(f"\n[{size}] {mode}" + (f"（ワーカー{args.workers}）" if mode == "uvicorn" else ""))
+            if mode == "inprocess":
+                # main はDATABASE_URLを読み込み時に使うので、規模ごとに新しいプロセスで動かす
+                with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                    mode_results = executor.submit(run_inprocess, database_url, args.cache, size, args).result()
+            else:
+                mode_results = run_uvicorn(database_url, args.cache, size, args)
+            results.extend(dict({"size": size, "mode": mode}, **result) for result in mode_results)
+
+    report = {
+        "commit": git_commit(),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {
+            "sizes": {size: dict(zip(["stores", "products", "prices"], SIZES[size])) for size in args.sizes},
+            "workers": args.workers,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "cache": args.cache,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n結果を {args.output} に保存しました")
+
+    if args.baseline:
+        print_comparison(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
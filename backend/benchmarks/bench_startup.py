@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+起動時間のベンチマーク
+
+サーバーを起動してから、最初のリクエスト（DBと店舗のインデックスを使う /supermarkets-nearby）に
+応答するまでの時間を外側から測る。あわせて応答したワーカーの GET /system/startup
+（起動からウォームアップ完了・最初の応答までの時間）を表示する。
+
+    dev  : uvicorn main:app（1プロセス、読み込み時にスキーマを作成）
+    prod : manage.py serve（--workers のワーカー、スキーマの作成なし・ウォームアップあり）
+
+使い方（backendディレクトリで実行、httpxが必要: pip install -r requirements-dev.txt）:
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --size medium --workers 4 --runs 5
+    python benchmarks/bench_startup.py --database-url sqlite:////path/to/supermarket_prices.db
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from bench_concurrency import free_port
+from bench_endpoints import BACKEND_DIR, CENTERS, build_database
+
+FIRST_PATH = "/supermarkets-nearby?latitude={:.4f}&longitude={:.4f}&radius=3".format(*CENTERS[0])
+
+
+def launch(mode, database_url, port, workers):
+    env = dict(os.environ, DATABASE_URL=database_url)
+    if mode == "dev":
+        command = [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"]
+    else:
+        command = [sys.executable, "manage.py", "serve", "--port", str(port), "--workers", str(workers),
+                   "--log-level", "warning"]
+    return subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL)
+
+
+def measure(mode, database_url, workers):
+    """(起動から最初の応答までの秒数, 最初のリクエストの応答時間, ワーカーの起動時間) を返す"""
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    process = launch(mode, database_url, port, workers)
+    try:
+        deadline = started + 60
+        while time.perf_counter() < deadline:
+            request_started = time.perf_counter()
+            try:
+                response = httpx.get(base_url + FIRST_PATH, timeout=10)
+            except httpx.TransportError:
+                time.sleep(0.01)
+                continue
+            response.raise_for_status()
+            first_response = time.perf_counter()
+            timings = httpx.get(base_url + "/system/startup", timeout=10).json()
+            return first_response - started, first_response - request_started, timings
+        raise RuntimeError("サーバーが起動しませんでした")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="起動時間のベンチマーク")
+    parser.add_argument("--size", default="small", choices=["small", "medium", "large"])
+    parser.add_argument("--modes", nargs="+", choices=["dev", "prod"], default=["dev", "prod"])
+    parser.add_argument("--workers", type=int, default=2, help="prodのワーカー数")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "supermarket-bench"))
+    parser.add_argument("--database-url", help="既存のデータベースで測る（--size は使わない）")
+    args = parser.parse_args()
+
+    if args.database_url:
+        database_url = args.database_url
+    else:
+        os.makedirs(args.data_dir, exist_ok=True)
+        database_url = build_database(args.data_dir, args.size, args.seed)
+    # prodはスキーマを作成しないので、先に一度だけ作っておく
+    subprocess.run([sys.executable, "manage.py", "migrate"], cwd=BACKEND_DIR,
+                   env=dict(os.environ, DATABASE_URL=database_url), check=True, stdout=subprocess.DEVNULL)
+
+    for mode in args.modes:
+        results = [measure(mode, database_url, args.workers) for _ in range(args.runs)]
+        to_first = [total for total, _, _ in results]
+        first_latency = [latency for _, latency, _ in results]
+        label = mode + (f"（ワーカー{args.workers}）" if mode == "prod" else "")
+        print(f"\n[{args.database_url or args.size}] {label}")
+        print(f"  起動→最初の応答: 中央値 {statistics.median(to_first):.2f}秒 "
+              f"（{', '.join(f'{value:.2f}' for value in to_first)}）")
+        print(f"  最初のリクエストの応答時間: 中央値 {statistics.median(first_latency) * 1000:.1f}ms")
+        print(f"  ワーカーの記録（最後の回）: {results[-1][2]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+読み取り系エンドポイントのレスポンスキャッシュ
+
+レスポンスのJSONをバイト列のままETag付きで保存し、If-None-Match が一致すれば 304 を返す。
+各エントリにはタグ（"products", "compare:7" など）を付け、登録系のエンドポイントが
+コミットしたときに該当タグのエントリだけを破棄する。
+
+保存先は CACHE_URL で切り替える。
+    memory（既定）   : プロセス内のLRU（件数上限＋TTL）
+    redis://...      : Redis（複数ワーカーでキャッシュと破棄を共有する。redis パッケージが必要）
+    none             : キャッシュしない
+プロセス内キャッシュは他のワーカーの書き込みでは破棄されないため、TTLで鮮度を保つ。
+複数ワーカーでは他のワーカーの書き込みがTTLの間反映されないので、manage.py serve は
+PROCESS_CACHE=0 にしてプロセス内のキャッシュ（memory と basket の価格ベクトル）を使わない。
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from urllib.parse import urlencode
+
+from fastapi import Request, Response
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+CACHE_URL = os.getenv("CACHE_URL", "memory")
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "300"))
+# プロセス内にキャッシュを持つか（0 なら memory はキャッシュしない）
+PROCESS_CACHE = os.getenv("PROCESS_CACHE", "1") == "1"
+
+CacheEntry = namedtuple("CacheEntry", ["body", "etag", "headers"])
+
+
+class MemoryCache:
+    """件数上限付きのLRU＋TTLキャッシュ（スレッドセーフ）"""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()   # key -> (期限, entry, tags)
+        self._tags = {}                 # tag -> keyの集合
+        self._versions = {}             # tag -> 破棄された回数
+        self._lock = threading.Lock()
+
+    def versions(self, tags):
+        with self._lock:
+            return [self._versions.get(tag, 0) for tag in tags]
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, entry, _ = item
+            if expires_at < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry, tags, versions):
+        with self._lock:
+            if [self._versions.get(tag, 0) for tag in tags] != versions:
+                # 作成中に破棄された（古いデータで作った可能性がある）ので保存しない
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, entry, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, tags):
+        with self._lock:
+            for tag in tags:
+                self._versions[tag] = self._versions.get(tag, 0) + 1
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._versions.clear()
+
+    def _remove(self, key):
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class RedisCache:
+    """Redisに保存するキャッシュ（タグはRedisのセットで管理する）"""
+
+    def __init__(self, url, ttl=CACHE_TTL_SECONDS, prefix="supermarket-api:"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_URLにRedisを指定するには redis パッケージが必要です（pip install redis）")
+        self.client = redis.Redis.from_url(url)
+        self.ttl = int(ttl)
+        self.prefix = prefix
+
+    def get(self, key):
+        data = self.client.hgetall(self.prefix + "entry:" + key)
+        if not data:
+            return None
+        return CacheEntry(data[b"body"], data[b"etag"].decode(), json.loads(data[b"headers"]))
+
+    def versions(self, tags):
+        if not tags:
+            return []
+        return [int(v or 0) for v in self.client.mget([self.prefix + "ver:" + tag for tag in tags])]
+
+    def set(self, key, entry, tags, versions):
+        if self.versions(tags) != versions:
+            return
+        entry_key = self.prefix + "entry:" + key
+        pipe = self.client.pipeline()
+        pipe.hset(entry_key, mapping={
+            "body": entry.body, "etag": entry.etag, "headers": json.dumps(entry.headers),
+        })
+        pipe.expire(entry_key, self.ttl)
+        for tag in tags:
+            pipe.sadd(self.prefix + "tag:" + tag, key)
+            pipe.expire(self.prefix + "tag:" + tag, self.ttl)
+        pipe.execute()
+
+    def invalidate(self, tags):
+        for tag in tags:
+            tag_key = self.prefix + "tag:" + tag
+            keys = self.client.smembers(tag_key)
+            pipe = self.client.pipeline()
+            pipe.incr(self.prefix + "ver:" + tag)
+            for key in keys:
+                pipe.delete(self.prefix + "entry:" + key.decode())
+            pipe.delete(tag_key)
+            pipe.execute()
+
+    def clear(self):
+        keys = list(self.client.scan_iter(self.prefix + "*"))
+        if keys:
+            self.client.delete(*keys)
+
+
+class NullCache:
+    """キャッシュしない"""
+
+    def get(self, key):
+        return None
+
+    def versions(self, tags):
+        return []
+
+    def set(self, key, entry, tags, versions):
+        pass
+
+    def invalidate(self, tags):
+        pass
+
+    def clear(self):
+        pass
+
+
+def create_backend(url=CACHE_URL):
+    if url == "memory":
+        return MemoryCache() if PROCESS_CACHE else NullCache()
+    if url == "none":
+        return NullCache()
+    if url.startswith("redis://") or url.startswith("rediss://"):
+        return RedisCache(url)
+    raise ValueError(f"未対応のCACHE_URLです: {url}")
+
+
+backend = create_backend()
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def cache_key(request: Request) -> str:
+    # 値に "&" や "=" を含むクエリが別のクエリと同じキーにならないよう、エンコードしてつなぐ
+    query = sorted(request.query_params.multi_items())
+    return request.url.path + "?" + urlencode(query)
+
+
+def cached_response(request: Request, tags, render) -> Response:
+    """
+    キャッシュ済みならそれを、なければ render() でJSONのバイト列を作って返す
+
+    render は (body, headers) を返す関数。If-None-Match がETagと一致すれば 304 を返す。
+    """
+    key = cache_key(request)
+    entry = backend.get(key)
+    if entry is None:
+        versions = backend.versions(tags)
+        body, headers = render()
+        entry = CacheEntry(body, make_etag(body), headers or {})
+        backend.set(key, entry, tags, versions)
+
+    response_headers = dict(entry.headers)
+    response_headers["ETag"] = entry.etag
+    response_headers["Cache-Control"] = "no-cache"
+    if_none_match = _parse_if_none_match(request.headers.get("if-none-match"))
+    if "*" in if_none_match or entry.etag in if_none_match:
+        return Response(status_code=304, headers=response_headers)
+    return Response(content=entry.body, media_type="application/json", headers=response_headers)
+
+
+def _parse_if_none_match(value):
+    if not value:
+        return set()
+    if value.strip() == "*":
+        return {"*"}
+    return {tag.strip().removeprefix("W/") for tag in value.split(",")}
+
+
+# タグの破棄を知らせる先（プロセス内で別途キャッシュを持つモジュールが登録する）
+_listeners = []
+
+
+def add_invalidation_listener(listener):
+    """コミットでタグが破棄されたときに listener(tags) を呼ぶよう登録する"""
+    _listeners.append(listener)
+
+
+def invalidate_on_commit(db: Session, tags):
+    """セッションがコミットされたときに破棄するタグを登録する（ロールバック時は破棄しない）"""
+    db.info.setdefault("cache_tags", set()).update(tags)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    tags = session.info.pop("cache_tags", None)
+    if tags:
+        backend.invalidate(tags)
+        for listener in _listeners:
+            listener(tags)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session):
+    session.info.pop("cache_tags", None)
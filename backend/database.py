@@ -1,15 +1,104 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 import os
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///../data/supermarket_prices.db")
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
-)
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+IS_SQLITE_MEMORY = IS_SQLITE and (":memory:" in DATABASE_URL or DATABASE_URL in ("sqlite://", "sqlite:///"))
+
+# SQLiteの接続ごとに設定するPRAGMA（SQLITE_PROFILEで選択）
+SQLITE_PROFILES = {
+    # 同時アクセス向けの設定
+    "production": {
+        "journal_mode": "WAL",          # 読み取りが書き込みを待たない
+        "synchronous": "NORMAL",        # WALではNORMALでもクラッシュ時に壊れない
+        "busy_timeout": 5000,           # ロック中は最大5秒待つ（"database is locked"を避ける）
+        "cache_size": -64000,           # ページキャッシュ 約64MB（負の値はKB単位）
+        "mmap_size": 268435456,         # 256MBまでメモリマップで読む
+        "temp_store": "MEMORY",         # 一時テーブル・ソートをメモリ上で行う
+    },
+    # SQLiteの既定値のまま
+    "default": {},
+}
+
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "production")
+
+
+def _sqlite_pragmas():
+    pragmas = dict(SQLITE_PROFILES[SQLITE_PROFILE])
+    # 個別の上書き（例: SQLITE_PRAGMAS="busy_timeout=10000,cache_size=-20000"）
+    for item in os.getenv("SQLITE_PRAGMAS", "").split(","):
+        if "=" in item:
+            name, value = item.split("=", 1)
+            pragmas[name.strip()] = value.strip()
+    if IS_SQLITE_MEMORY:
+        # インメモリDBではWALは使えない
+        pragmas.pop("journal_mode", None)
+    return pragmas
+
+
+SQLITE_PRAGMAS = _sqlite_pragmas() if IS_SQLITE else {}
+
+# 接続プールの大きさ。DB処理用のスレッド数（main.DB_THREAD_POOL_SIZE）の既定値にも使う
+if IS_SQLITE:
+    # SQLiteの接続は軽いので常に保持し、溢れた分を作っては捨てることはしない
+    POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "15"))
+    MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "0"))
+else:
+    POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+    MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+POOL_CAPACITY = POOL_SIZE + MAX_OVERFLOW
+
+if IS_SQLITE_MEMORY:
+    # インメモリDBは接続ごとに別の空のDBになる。SQLAlchemyの既定（SingletonThreadPool）ではスレッドごとに
+    # 接続を作るため、スレッドプールで動くエンドポイントがスレッドごとに別のDBを見てしまう。
+    # 1つの接続を全スレッドで共有する
+    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False}, poolclass=StaticPool)
+elif IS_SQLITE:
+    engine = create_engine(
+        DATABASE_URL,
+        connect_args={"check_same_thread": False},
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+    )
+else:
+    engine = create_engine(
+        DATABASE_URL,
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        pool_pre_ping=True,     # サーバー側で切られた接続を使わない
+        pool_recycle=1800,
+    )
+
+
+if SQLITE_PRAGMAS:
+    @event.listens_for(engine, "connect")
+    def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+def effective_settings():
+    """実際に接続に適用されている設定を返す（確認用）"""
+    settings = {
+        "dialect": engine.dialect.name,
+        "pool": engine.pool.status(),
+    }
+    if IS_SQLITE:
+        settings["profile"] = SQLITE_PROFILE
+        with engine.connect() as connection:
+            settings["pragmas"] = {
+                name: connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+                for name in ["journal_mode", "synchronous", "busy_timeout", "cache_size", "mmap_size", "temp_store"]
+            }
+    return settings
+
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = declarative_base()
\ No newline at end of file
+Base = declarative_base()
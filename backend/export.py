@@ -0,0 +1,110 @@
+"""
+価格・商品・店舗のエクスポート（NDJSON / CSV のストリーミング）
+
+行はサーバー側カーソルから yield_per 件ずつ読み、そのまま書き出して捨てるため、
+テーブルの大きさに関係なくメモリ使用量は一定になる。
+"""
+
+import csv
+import io
+import json
+from datetime import datetime
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+
+import database
+import models
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+# 一度に読んで書き出す行数
+BATCH_SIZE = 2000
+
+# エクスポートする列（並び順はCSVの列順）
+TABLES = {
+    "prices": (
+        models.Price,
+        ["id", "product_id", "supermarket_id", "price", "unit", "price_per_base_unit", "base_unit",
+         "recorded_by", "recorded_at"],
+        "recorded_at",
+    ),
+    "products": (
+        models.Product,
+        ["id", "name", "category", "brand", "created_at"],
+        "created_at",
+    ),
+    "supermarkets": (
+        models.Supermarket,
+        ["id", "name", "address", "latitude", "longitude", "phone", "created_at"],
+        "created_at",
+    ),
+}
+
+
+def export_response(table, format, since=None):
+    """
+    table の行を format で書き出すレスポンスを返す
+
+    since を指定すると、その日時より後に登録された行だけを返す（差分の取得用）。
+    pricesは登録日時の古い順、商品・店舗はIDの順に並べる。
+    """
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail="format は ndjson または csv を指定してください")
+    model, columns, time_column = TABLES[table]
+
+    query = select(*(getattr(model, name) for name in columns))
+    if since is not None:
+        query = query.where(getattr(model, time_column) > since)
+    if table == "prices":
+        query = query.order_by(model.recorded_at, model.id)
+    else:
+        query = query.order_by(model.id)
+
+    if format == "csv":
+        write, header = _csv_lines, _csv_lines([columns], columns)
+    else:
+        write, header = _ndjson_lines, b""
+    return StreamingResponse(
+        _stream(query, columns, write, header),
+        media_type=FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{table}.{format}"'},
+    )
+
+
+def _stream(query, columns, write, header):
+    # レスポンスを送り終えるまで使うので、リクエストのセッションとは別に開いて閉じる
+    db = database.SessionLocal()
+    try:
+        if header:
+            yield header
+        result = db.execute(query.execution_options(yield_per=BATCH_SIZE))
+        for rows in result.partitions():
+            yield write(rows, columns)
+    finally:
+        db.close()
+
+
+def _ndjson_lines(rows, columns):
+    return "".join(
+        json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=_isoformat) + "\n" for row in rows
+    ).encode()
+
+
+def _csv_lines(rows, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerows(
+        [value.isoformat() if isinstance(value, datetime) else value for value in row] for row in rows
+    )
+    return buffer.getvalue().encode()
+
+
+def _isoformat(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} はJSONにできません")
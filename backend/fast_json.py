@@ -0,0 +1,38 @@
+"""
+レスポンスのJSON化
+
+orjsonがあればそれで、なければ標準のjsonでFastAPIのJSONResponseと同じバイト列を作る。
+orjsonの出力は JSONResponse（json.dumps, ensure_ascii=False, 区切りは空白なし）と同じになる。
+ただし指数表記になる浮動小数点数（絶対値が1e-4未満か1e16以上）は表記が異なる（1e-05 と 1e-5）。
+"""
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    from fastapi.responses import ORJSONResponse as DefaultResponse
+    _OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+else:
+    DefaultResponse = JSONResponse
+
+
+def dumps(data) -> bytes:
+    """dict・list・日時・Pydanticのモデルなどを含むデータをJSONのバイト列にする"""
+    if orjson is not None:
+        return orjson.dumps(data, default=_default, option=_OPTIONS)
+    return JSONResponse(jsonable_encoder(data)).body
+
+
+def _default(value):
+    # Pydanticのモデルなど orjson が直接扱えない値は FastAPI と同じ変換にかける
+    return jsonable_encoder(value)
+
+
+def rows_to_dicts(rows, names):
+    """列のタプルの並びを、names をキーにした辞書のリストにする"""
+    return [dict(zip(names, row)) for row in rows]
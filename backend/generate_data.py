@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大規模なダミーデータの生成スクリプト
+
+add_dummy_data.py の価格モデル（price_model.py）を使い、全国の都市周辺に店舗を、
+基本商品の派生として商品を、過去days日に分散した価格を生成して投入する。
+同じ --seed と --end なら同じデータになる。既存のデータは消さずに追加する（--resetで全削除）。
+価格は既存の店舗・商品も含めた全体から選ぶので、店舗や商品を0件にして価格だけ追加することもできる。
+既存と同じ件数以上の価格を追加するときは、価格のインデックスを外して投入し最後に作り直す。
+投入後に最新価格・価格履歴の集計・商品検索の索引を作り直す。
+
+使い方（backendディレクトリで実行）:
+    python generate_data.py --stores 50000 --products 100000 --prices 100000000
+    python generate_data.py --stores 0 --products 0 --prices 1000000   # 価格だけ追加
+    DATABASE_URL=sqlite:///./bench.db python generate_data.py --reset
+"""
+
+import argparse
+import time
+from datetime import date, datetime
+
+import numpy as np
+from sqlalchemy import func, select
+
+import database
+import manage
+import models
+import price_model
+
+# 店舗を配置する都市 (名前, 緯度, 経度, 重み)
+CITIES = [
+    ("東京", 35.6812, 139.7671, 30),
+    ("横浜", 35.4437, 139.6380, 10),
+    ("大阪", 34.7025, 135.4959, 15),
+    ("名古屋", 35.1709, 136.8815, 9),
+    ("札幌", 43.0687, 141.3508, 5),
+    ("福岡", 33.5902, 130.4017, 5),
+    ("神戸", 34.6901, 135.1956, 4),
+    ("京都", 34.9858, 135.7588, 4),
+    ("川崎", 35.5308, 139.7029, 4),
+    ("さいたま", 35.8617, 139.6455, 4),
+    ("千葉", 35.6073, 140.1063, 3),
+    ("広島", 34.3976, 132.4753, 3),
+    ("仙台", 38.2601, 140.8824, 3),
+    ("北九州", 33.8864, 130.8826, 2),
+    ("新潟", 37.9120, 139.0618, 2),
+    ("静岡", 34.9719, 138.3890, 2),
+    ("岡山", 34.6664, 133.9177, 2),
+    ("熊本", 32.7898, 130.6886, 2),
+    ("鹿児島", 31.5838, 130.5413, 1),
+    ("那覇", 26.2124, 127.6792, 1),
+]
+
+# 店舗の散らばり（度、標準偏差）
+CITY_SPREAD_DEG = 0.08
+
+# チェーン（price_modelにないものは標準の係数）
+CHAINS = list(price_model.CHAIN_FACTORS) + ["マルエツ", "オーケー", "サミット"]
+
+# 商品の派生 (名前の接尾辞, 基本価格の倍率)
+VARIANTS = [("", 1.0), (" 徳用", 1.8), (" 小分け", 0.6), (" PB", 0.8), (" 国産", 1.3)]
+
+BRANDS = ["みなみ食品", "きた農園", "ひがし乳業", "にし製パン", "なかや", "まるや"]
+
+CATEGORIES = {
+    "卵": "畜産・卵", "牛乳": "乳製品", "食パン": "パン・米", "米": "パン・米",
+    "鶏肉": "肉類", "豚肉": "肉類", "玉ねぎ": "野菜", "じゃがいも": "野菜",
+    "バナナ": "果物", "キャベツ": "野菜", "人参": "野菜", "りんご": "果物",
+}
+
+RECORDED_USERS = ["user1", "user2", "admin", "tester", "shopper"]
+
+# 生成する行の列（generate_* はこの順のタプルを返す）
+STORE_COLUMNS = ("name", "address", "latitude", "longitude", "phone", "created_at")
+PRODUCT_COLUMNS = ("name", "category", "brand", "created_at")
+PRICE_COLUMNS = (
+    "product_id", "supermarket_id", "price", "unit", "price_per_base_unit", "base_unit", "recorded_by", "recorded_at",
+)
+
+# 価格を記録する時間帯（営業時間 9時〜22時）
+OPEN_SECONDS = 9 * 3600
+CLOSE_SECONDS = 22 * 3600
+
+
+def product_base_price(name):
+    """商品名（"基本商品[ 派生] ブランド-番号"）から基本価格を求める"""
+    head = name.rsplit(" ", 1)[0] if "-" in name else name
+    base_name = head.split(" ", 1)[0]
+    multiplier = 1.0
+    for suffix, variant_multiplier in VARIANTS[1:]:
+        if head.endswith(suffix):
+            multiplier = variant_multiplier
+            break
+    return price_model.BASE_PRICES.get(base_name, price_model.DEFAULT_BASE_PRICE) * multiplier
+
+
+def generate_stores(rng, count, start_number):
+    weights = np.array([city[3] for city in CITIES], dtype=float)
+    cities = rng.choice(len(CITIES), size=count, p=weights / weights.sum())
+    chains = rng.integers(0, len(CHAINS), size=count)
+    offsets = rng.normal(0, CITY_SPREAD_DEG, size=(count, 2))
+    created_at = _now()
+    return [
+        (
+            f"{CHAINS[chain]} {CITIES[city][0]}{start_number + i}号店",
+            f"{CITIES[city][0]}市",
+            round(CITIES[city][1] + lat_offset, 6),
+            round(CITIES[city][2] + lon_offset, 6),
+            None,
+            created_at,
+        )
+        for i, (city, chain, (lat_offset, lon_offset)) in enumerate(zip(cities.tolist(), chains.tolist(), offsets.tolist()))
+    ]
+
+
+def generate_products(rng, count, start_number):
+    base_names = list(price_model.BASE_PRICES)
+    bases = rng.integers(0, len(base_names), size=count)
+    variants = rng.integers(0, len(VARIANTS), size=count)
+    brands = rng.integers(0, len(BRANDS), size=count)
+    created_at = _now()
+    return [
+        (
+            f"{base_names[base]}{VARIANTS[variant][0]} {BRANDS[brand]}-{start_number + i}",
+            CATEGORIES[base_names[base]],
+            BRANDS[brand],
+            created_at,
+        )
+        for i, (base, variant, brand) in enumerate(zip(bases.tolist(), variants.tolist(), brands.tolist()))
+    ]
+
+
+def load_price_model(connection):
+    """全店舗・全商品のIDと、価格を計算するための配列を読み込む"""
+    stores = connection.execute(
+        select(models.Supermarket.id, models.Supermarket.name).order_by(models.Supermarket.id)
+    ).all()
+    products = connection.execute(
+        select(models.Product.id, models.Product.name).order_by(models.Product.id)
+    ).all()
+
+    store_ids = np.array([row.id for row in stores], dtype=np.int64)
+    # 店舗ごとの係数 [日用品の最小, 日用品の最大, その他の最小, その他の最大]
+    store_factors = np.array([
+        price_model.price_factors(row.name, price_model.DAILY_GOODS[0])
+        + price_model.price_factors(row.name, "")
+        for row in stores
+    ], dtype=float).reshape(-1, 4)
+    product_ids = np.array([row.id for row in products], dtype=np.int64)
+    product_base = np.array([product_base_price(row.name) for row in products], dtype=float)
+    product_daily = np.array([row.name.split(" ", 1)[0] in price_model.DAILY_GOODS for row in products], dtype=bool)
+    return store_ids, store_factors, product_ids, product_base, product_daily
+
+
+def generate_prices(rng, count, model, end, days):
+    """end（最終日の0時）までのdays日間の営業時間内に登録された価格を生成する"""
+    store_ids, store_factors, product_ids, product_base, product_daily = model
+    stores = rng.integers(0, len(store_ids), size=count)
+    products = rng.integers(0, len(product_ids), size=count)
+    # インデックスへの書き込みが局所的になるよう商品・店舗の順に並べて投入する
+    order = np.lexsort((stores, products))
+    stores, products = stores[order], products[order]
+
+    # get_price_range と同じく 基本価格×係数 を切り捨てた範囲から選ぶ
+    column = np.where(product_daily[products], 0, 2)
+    factors = store_factors[stores]
+    base = product_base[products]
+    low = np.floor(base * factors[np.arange(count), column]).astype(np.int64)
+    high = np.floor(base * factors[np.arange(count), column + 1]).astype(np.int64)
+    prices = rng.integers(low, high + 1)
+
+    day_offsets = rng.integers(0, days, size=count)
+    seconds = rng.integers(OPEN_SECONDS, CLOSE_SECONDS, size=count)
+    recorded_at = (
+        np.datetime64(end, "s")
+        - day_offsets.astype("timedelta64[D]")
+        + seconds.astype("timedelta64[s]")
+    )
+    users = rng.integers(0, len(RECORDED_USERS), size=count)
+
+    return [
+        (product_id, supermarket_id, price, "個", price, "個", RECORDED_USERS[user], timestamp)
+        for product_id, supermarket_id, price, user, timestamp in zip(
+            product_ids[products].tolist(), store_ids[stores].tolist(), prices.astype(np.float64).tolist(),
+            users.tolist(), _format_timestamps(recorded_at).tolist(),
+        )
+    ]
+
+
+def _now():
+    return _format_timestamps(np.array([datetime.utcnow()], dtype="datetime64[us]"))[0]
+
+
+def _format_timestamps(values):
+    # SQLAlchemyがSQLiteに保存する形式（"YYYY-MM-DD HH:MM:SS.ffffff"）の文字列にする
+    return np.char.replace(np.datetime_as_string(values.astype("datetime64[us]"), unit="us"), "T", " ")
+
+
+def insert_rows(connection, table, columns, rows):
+    """タプルの行をexecutemanyで投入する"""
+    if connection.dialect.name == "sqlite":
+        # 型変換を通さずにドライバへ渡す（件数が多いとSQLAlchemy側の変換が目立つため）
+        connection.exec_driver_sql(
+            f"INSERT INTO {table.name} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", rows
+        )
+    else:
+        connection.execute(table.insert(), [dict(zip(columns, row)) for row in rows])
+
+
+def reset(connection):
+    for table in ["price_alerts", "regional_price_stats", "unit_price_rollups", "latest_prices", "favorites", "prices", "products", "supermarkets"]:
+        connection.execute(models.Base.metadata.tables[table].delete())
+
+
+def insert_in_batches(make_rows, total, batch_size, commit_every, table, columns, label):
+    """make_rows(件数, 投入済みの件数) で作った行を batch_size 件ずつ、commit_every 件ごとのトランザクションで投入する"""
+    started = time.perf_counter()
+    done = 0
+    while done < total:
+        with database.engine.begin() as connection:
+            in_transaction = 0
+            while done < total and in_transaction < commit_every:
+                count = min(batch_size, total - done, commit_every - in_transaction)
+                insert_rows(connection, table, columns, make_rows(count, done))
+                done += count
+                in_transaction += count
+        elapsed = time.perf_counter() - started
+        print(f"  {label}: {done:,}/{total:,}件 ({done / elapsed:,.0f}件/秒)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="大規模なダミーデータの生成")
+    parser.add_argument("--stores", type=int, default=1000, help="追加する店舗数")
+    parser.add_argument("--products", type=int, default=1000, help="追加する商品数")
+    parser.add_argument("--prices", type=int, default=100000, help="追加する価格の件数")
+    parser.add_argument("--days", type=int, default=365, help="価格の登録日時を分散させる日数")
+    parser.add_argument("--end", type=date.fromisoformat, default=date.today(),
+                        help="価格の登録日時の最終日（YYYY-MM-DD、既定は今日）")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=50000, help="1回のexecutemanyで投入する件数")
+    parser.add_argument("--commit-every", type=int, default=1000000, help="1トランザクションで投入する件数")
+    parser.add_argument("--keep-indexes", action="store_true",
+                        help="大量に投入するときも価格のインデックスを外さない（使用中のデータベースに追加する場合）")
+    parser.add_argument("--reset", action="store_true", help="既存のデータを削除してから投入する")
+    parser.add_argument("--no-rebuild", action="store_true", help="最新価格・集計・索引の再構築を行わない")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    models.create_schema(database.engine)
+    if args.reset:
+        with database.engine.begin() as connection:
+            reset(connection)
+
+    # 店舗名・商品名の通し番号は既存の件数の続きから振る
+    with database.engine.connect() as connection:
+        store_number = connection.execute(select(func.count(models.Supermarket.id))).scalar() + 1
+        product_number = connection.execute(select(func.count(models.Product.id))).scalar() + 1
+
+    print("データを生成しています...")
+    insert_in_batches(
+        lambda count, done: generate_stores(rng, count, store_number + done),
+        args.stores, args.batch_size, args.commit_every, models.Supermarket.__table__, STORE_COLUMNS, "店舗",
+    )
+    insert_in_batches(
+        lambda count, done: generate_products(rng, count, product_number + done),
+        args.products, args.batch_size, args.commit_every, models.Product.__table__, PRODUCT_COLUMNS, "商品",
+    )
+
+    if args.prices:
+        with database.engine.connect() as connection:
+            model = load_price_model(connection)
+            existing_prices = connection.execute(select(func.count(models.Price.id))).scalar()
+        if not len(model[0]) or not len(model[2]):
+            parser.error("価格を生成するには店舗と商品が必要です")
+        # 既存と同じ件数以上を追加するときは、インデックスを外して投入し最後に作り直す方が速い
+        drop_indexes = args.prices >= existing_prices and not args.keep_indexes
+        if drop_indexes:
+            for index in models.Price.__table__.indexes:
+                index.drop(bind=database.engine, checkfirst=True)
+        end = datetime.combine(args.end, datetime.min.time())
+        insert_in_batches(
+            lambda count, done: generate_prices(rng, count, model, end, args.days),
+            args.prices, args.batch_size, args.commit_every, models.Price.__table__, PRICE_COLUMNS, "価格",
+        )
+        if drop_indexes:
+            print("価格のインデックスを作成しています...")
+            models.create_schema(database.engine)
+
+    if not args.no_rebuild:
+        # manage.py rebuild と同じ処理で作り直す
+        print("最新価格・価格履歴の集計・地域の価格分布・商品検索の索引を作り直しています...")
+        manage.rebuild()
+
+    print("ダミーデータの生成が完了しました！")
+    print(f"店舗: {args.stores:,}件 / 商品: {args.products:,}件 / 価格: {args.prices:,}件を追加")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+位置情報まわりの計算ユーティリティ
+"""
+
+import math
+import threading
+
+import numpy as np
+from sqlalchemy import func
+
+import models
+
+# 地球の半径（km）
+EARTH_RADIUS_KM = 6371
+
+# 浮動小数点の丸め誤差で境界上の店舗を取りこぼさないための余裕（度）
+_BBOX_MARGIN_DEG = 1e-7
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    ハバーサイン距離（km）をNumPyでまとめて計算する
+
+    引数はラジアン。スカラーと配列を混在させてもブロードキャストされる。
+    """
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return EARTH_RADIUS_KM * (2 * np.arcsin(np.sqrt(a)))
+
+
+def bounding_boxes(latitude: float, longitude: float, radius_km: float):
+    """
+    中心点から半径radius_km以内の点を必ず含む緯度経度の矩形を返す
+
+    戻り値は (lat_min, lat_max, lon_min, lon_max) のリスト。
+    日付変更線をまたぐ場合は2つの矩形に分割する。
+    極を含む場合は経度方向の絞り込みを行わない（lon_min, lon_maxがNone）。
+    半径が負の場合は空リストを返す。
+    """
+    if radius_km < 0:
+        return []
+
+    angular = radius_km / EARTH_RADIUS_KM
+    lat_rad = math.radians(latitude)
+    lat_min = lat_rad - angular
+    lat_max = lat_rad + angular
+
+    if lat_min <= -math.pi / 2 or lat_max >= math.pi / 2 or angular >= math.pi / 2:
+        # 極を含むので全経度が対象
+        return [(
+            max(math.degrees(lat_min), -90.0) - _BBOX_MARGIN_DEG,
+            min(math.degrees(lat_max), 90.0) + _BBOX_MARGIN_DEG,
+            None,
+            None,
+        )]
+
+    delta_lon = math.degrees(math.asin(math.sin(angular) / math.cos(lat_rad)))
+    lat_min_deg = math.degrees(lat_min) - _BBOX_MARGIN_DEG
+    lat_max_deg = math.degrees(lat_max) + _BBOX_MARGIN_DEG
+    lon_min = longitude - delta_lon - _BBOX_MARGIN_DEG
+    lon_max = longitude + delta_lon + _BBOX_MARGIN_DEG
+
+    # 日付変更線をまたぐ場合は分割
+    if lon_min < -180.0:
+        return [
+            (lat_min_deg, lat_max_deg, lon_min + 360.0, 180.0),
+            (lat_min_deg, lat_max_deg, -180.0, lon_max),
+        ]
+    if lon_max > 180.0:
+        return [
+            (lat_min_deg, lat_max_deg, lon_min, 180.0),
+            (lat_min_deg, lat_max_deg, -180.0, lon_max - 360.0),
+        ]
+    return [(lat_min_deg, lat_max_deg, lon_min, lon_max)]
+
+
+class StoreIndex:
+    """
+    店舗座標を緯度順に並べた連続したfloat64配列で保持する距離計算用インデックス
+
+    インスタンスは不変で、店舗の追加時は extend で新しいインデックスを作る。
+    """
+
+    def __init__(self, ids=(), latitudes=(), longitudes=()):
+        ids = np.asarray(ids, dtype=np.int64)
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+
+        # 緯度でソートしておき、矩形の絞り込みを二分探索で行う
+        order = np.lexsort((ids, latitudes))
+        self.ids = np.ascontiguousarray(ids[order])
+        self.latitudes = np.ascontiguousarray(latitudes[order])
+        self.longitudes = np.ascontiguousarray(longitudes[order])
+        self.lat_rad = np.radians(self.latitudes)
+        self.lon_rad = np.radians(self.longitudes)
+        self.max_id = int(self.ids.max()) if len(self.ids) else 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def extend(self, ids, latitudes, longitudes):
+        """店舗を追加した新しいインデックスを返す"""
+        return StoreIndex(
+            np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)]),
+            np.concatenate([self.latitudes, np.asarray(latitudes, dtype=np.float64)]),
+            np.concatenate([self.longitudes, np.asarray(longitudes, dtype=np.float64)]),
+        )
+
+    def distances(self, latitude: float, longitude: float):
+        """全店舗までの距離（km）を self.ids と同じ並びで返す"""
+        return haversine_km(math.radians(latitude), math.radians(longitude), self.lat_rad, self.lon_rad)
+
+    def candidates(self, latitude: float, longitude: float, radius_km: float):
+        """半径を含む矩形内にある店舗の位置（配列の添字）を返す"""
+        positions = []
+        for lat_min, lat_max, lon_min, lon_max in bounding_boxes(latitude, longitude, radius_km):
+            start = np.searchsorted(self.latitudes, lat_min, side="left")
+            stop = np.searchsorted(self.latitudes, lat_max, side="right")
+            block = np.arange(start, stop)
+            if lon_min is not None:
+                lons = self.longitudes[start:stop]
+                block = block[(lons >= lon_min) & (lons <= lon_max)]
+            positions.append(block)
+        if not positions:
+            return np.empty(0, dtype=np.intp)
+        return np.unique(np.concatenate(positions))
+
+    def within_radius(self, latitude: float, longitude: float, radius_km: float, limit=None):
+        """
+        半径radius_km以内の店舗を近い順に返す
+
+        戻り値は (店舗IDの配列, 距離の配列)。limitを指定すると近い方からlimit件だけ返す。
+        """
+        positions = self.candidates(latitude, longitude, radius_km)
+        distances = haversine_km(
+            math.radians(latitude), math.radians(longitude),
+            self.lat_rad[positions], self.lon_rad[positions],
+        )
+        inside = distances <= radius_km
+        return self._closest(self.ids[positions[inside]], distances[inside], limit)
+
+    def nearest(self, latitude: float, longitude: float, k: int):
+        """距離に関係なく近い順にk件の店舗を返す"""
+        return self._closest(self.ids, self.distances(latitude, longitude), k)
+
+    @staticmethod
+    def _closest(ids, distances, limit):
+        if limit is not None and 0 <= limit < len(ids):
+            # 上位limit件だけを部分ソートで取り出す
+            top = np.argpartition(distances, limit - 1)[:limit] if limit > 0 else np.empty(0, dtype=np.intp)
+            ids = ids[top]
+            distances = distances[top]
+        order = np.lexsort((ids, distances))
+        return ids[order], distances[order]
+
+
+_store_index = StoreIndex()
+_store_index_lock = threading.Lock()
+
+
+def get_store_index(db) -> StoreIndex:
+    """
+    店舗テーブルと同期したStoreIndexを返す
+
+    店舗は追加のみなので、最大IDが進んでいれば差分だけ読み込んで拡張する。
+    他のワーカープロセスで追加された店舗もここで取り込まれる。
+    """
+    global _store_index
+    latest_id = db.query(func.max(models.Supermarket.id)).scalar() or 0
+    with _store_index_lock:
+        index = _store_index
+        if latest_id == index.max_id:
+            return index
+
+        query = db.query(
+            models.Supermarket.id, models.Supermarket.latitude, models.Supermarket.longitude
+        )
+        if latest_id > index.max_id:
+            rows = query.filter(models.Supermarket.id > index.max_id).all()
+            index = index.extend(*_columns(rows))
+        else:
+            # 店舗が削除された（DBが作り直された）場合は全件から作り直す
+            index = StoreIndex(*_columns(query.all()))
+        _store_index = index
+        return index
+
+
+def _columns(rows):
+    if not rows:
+        return (), (), ()
+    ids, latitudes, longitudes = zip(*rows)
+    return ids, latitudes, longitudes
@@ -0,0 +1,130 @@
+"""
+最新価格テーブル（models.LatestPrice）の更新と再構築
+"""
+
+from functools import lru_cache
+
+from sqlalchemy import bindparam, delete, func, or_, select, tuple_
+
+import models
+import units
+
+# IN句に渡すキー数の上限（SQLiteのパラメータ数上限対策）
+_CHUNK_SIZE = 400
+
+
+@lru_cache(maxsize=None)
+def keys_condition(columns, size):
+    """
+    columns の値の組が size 個のキーのどれかに一致する条件（パラメータは keys_params で作る）
+
+    (a, b) IN (VALUES ...) はSQLiteでは主キーを使わず全体を走査するので、等号のORにする。
+    条件の組み立てとSQLのコンパイルが毎回かからないよう、キーの数ごとに使い回す。
+    """
+    return or_(*(
+        tuple_(*columns) == tuple_(*(bindparam(f"k{i}_{j}") for j in range(len(columns))))
+        for i in range(size)
+    ))
+
+
+def keys_params(keys):
+    return {f"k{i}_{j}": value for i, key in enumerate(keys) for j, value in enumerate(key)}
+
+
+def apply_prices(db, prices):
+    """
+    新しく登録した価格で最新価格テーブルを更新する
+
+    pricesは id, product_id, supermarket_id, price, unit, price_per_base_unit, base_unit, recorded_at を持つ
+    オブジェクト（Priceや結果行）の並び。登録と同じトランザクションで呼び、
+    コミットは呼び出し側で行う。
+
+    最新価格が置き換わった商品×店舗について (新しい価格, 置き換わる前の LatestPrice の
+    (price_per_base_unit, base_unit)) のリストを返す（値下がりの検出用）。
+    """
+    newest = {}
+    for price in prices:
+        key = (price.product_id, price.supermarket_id)
+        if key not in newest or _sort_key(price) > _sort_key(newest[key]):
+            newest[key] = price
+    if not newest:
+        return []
+
+    keys = list(newest)
+    existing = {}
+    for i in range(0, len(keys), _CHUNK_SIZE):
+        chunk = keys[i:i + _CHUNK_SIZE]
+        condition = keys_condition((models.LatestPrice.product_id, models.LatestPrice.supermarket_id), len(chunk))
+        rows = db.execute(select(models.LatestPrice).where(condition), keys_params(chunk)).scalars()
+        for row in rows:
+            existing[(row.product_id, row.supermarket_id)] = row
+
+    replaced = []
+    for key, price in newest.items():
+        latest = existing.get(key)
+        if latest is None:
+            db.add(models.LatestPrice(
+                product_id=price.product_id,
+                supermarket_id=price.supermarket_id,
+                price_id=price.id,
+                price=price.price,
+                unit=price.unit,
+                price_per_base_unit=price.price_per_base_unit,
+                base_unit=price.base_unit,
+                recorded_at=price.recorded_at,
+            ))
+        elif _sort_key(price) >= (latest.recorded_at, latest.price_id):
+            previous = (latest.price_per_base_unit, latest.base_unit)
+            if previous[0] is None:
+                # 基準単位あたりの価格を埋める前の行は、ここで換算する
+                previous = units.normalize(latest.price, latest.unit)
+            replaced.append((price, previous))
+            latest.price_id = price.id
+            latest.price = price.price
+            latest.unit = price.unit
+            latest.price_per_base_unit = price.price_per_base_unit
+            latest.base_unit = price.base_unit
+            latest.recorded_at = price.recorded_at
+    return replaced
+
+
+def rebuild(db):
+    """pricesの全履歴から最新価格テーブルを作り直す（コミットは呼び出し側）"""
+    ranked = select(
+        models.Price.id,
+        models.Price.product_id,
+        models.Price.supermarket_id,
+        models.Price.price,
+        models.Price.unit,
+        models.Price.price_per_base_unit,
+        models.Price.base_unit,
+        models.Price.recorded_at,
+        func.row_number().over(
+            partition_by=(models.Price.product_id, models.Price.supermarket_id),
+            order_by=(models.Price.recorded_at.desc(), models.Price.id.desc()),
+        ).label("rank"),
+    ).subquery()
+
+    latest = select(
+        ranked.c.product_id,
+        ranked.c.supermarket_id,
+        ranked.c.id,
+        ranked.c.price,
+        ranked.c.unit,
+        ranked.c.price_per_base_unit,
+        ranked.c.base_unit,
+        ranked.c.recorded_at,
+    ).where(ranked.c.rank == 1)
+
+    db.execute(delete(models.LatestPrice))
+    db.execute(
+        models.LatestPrice.__table__.insert().from_select(
+            ["product_id", "supermarket_id", "price_id", "price", "unit", "price_per_base_unit", "base_unit",
+             "recorded_at"],
+            latest,
+        )
+    )
+
+
+def _sort_key(price):
+    return (price.recorded_at, price.id)
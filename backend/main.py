@@ -1,13 +1,60 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request, Response
+from fastapi.exceptions import RequestValidationError
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+from contextlib import asynccontextmanager
+import anyio
+import math
+import os
+from sqlalchemy import tuple_
 from sqlalchemy.orm import Session
 from typing import List, Optional
 import models
 import database
-from pydantic import BaseModel
-from datetime import datetime
+import geo
+import metrics
+import basket
+import cache
+import export
+import fast_json
+import pagination
+import price_compare
+import price_history
+import price_ingest
+import price_stats
+import search_index
+import startup
+import viewport
+import write_queue
+from pydantic import BaseModel, Field
+from datetime import date, datetime
+import json
+import numpy as np
 
-app = FastAPI(title="スーパーマーケット価格比較API", version="1.0.0")
+# DB処理を行うスレッドプールの上限（DBの接続プール数を超えると接続待ちになるだけなので合わせる）
+DB_THREAD_POOL_SIZE = int(os.getenv("DB_THREAD_POOL_SIZE", str(database.POOL_CAPACITY)))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # DBを使うエンドポイントは def で定義し、イベントループをブロックしないよう
+    # FastAPIのスレッドプールで実行させる。ここでそのスレッド数を制限する
+    anyio.to_thread.current_default_thread_limiter().total_tokens = DB_THREAD_POOL_SIZE
+    # メモリ上のインデックスを読み込んでから受け付ける（最初のリクエストで読み込まない）
+    await run_in_threadpool(startup.warm_up)
+    if write_queue.WRITE_BEHIND:
+        write_queue.write_queue.start()
+    yield
+    if write_queue.WRITE_BEHIND:
+        # キューに残っている価格を書き出してから終了する
+        await run_in_threadpool(write_queue.write_queue.stop)
+
+app = FastAPI(
+    title="スーパーマーケット価格比較API",
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=fast_json.DefaultResponse,
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,7 +65,23 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
-models.Base.metadata.create_all(bind=database.engine)
+@app.exception_handler(RequestValidationError)
+async def validation_error_handler(request: Request, exc: RequestValidationError):
+    # 既定のハンドラは入力値をそのまま返すので、1e400 や NaN を送られるとJSONにできず500になる。
+    # 有限でない入力値はnullにして返す
+    errors = [
+        dict(error, input=None) if isinstance(error.get("input"), float) and not math.isfinite(error["input"])
+        else error
+        for error in exc.errors()
+    ]
+    return json_response({"detail": errors}, status_code=422)
+
+metrics.install(app, database.engine, models.Base)
+app.add_middleware(startup.FirstRequestTimer)
+
+if startup.AUTO_MIGRATE:
+    # 開発時の既定。本番の起動（manage.py serve）では manage.py migrate で事前に作成する
+    startup.migrate(database.engine)
 
 def get_db():
     db = database.SessionLocal()
@@ -64,16 +127,27 @@ class ProductResponse(BaseModel):
 class PriceCreate(BaseModel):
     product_id: int
     supermarket_id: int
-    price: float
+    # 一括登録の各行もこのモデルで検証する。inf・NaNや0以下の価格は集計やスケッチに入れられない
+    price: float = Field(gt=0, allow_inf_nan=False)
     unit: str = "個"
     recorded_by: str
 
+class AcceptedPriceStatus(BaseModel):
+    accepted_id: str
+    status: str                     # queued / stored / failed
+    price_id: Optional[int] = None  # 登録された価格ID（stored のとき）
+
+class AcceptedPriceResponse(AcceptedPriceStatus):
+    coalesced: bool                 # 同じ登録とまとめられた
+
 class PriceResponse(BaseModel):
     id: int
     product_id: int
     supermarket_id: int
     price: float
     unit: str
+    price_per_base_unit: Optional[float] = None
+    base_unit: Optional[str] = None
     recorded_by: str
     recorded_at: Optional[datetime] = None
     product: ProductResponse
@@ -82,79 +156,300 @@ class PriceResponse(BaseModel):
     class Config:
         from_attributes = True
 
+# 一覧ではORMオブジェクトやレスポンスモデルを作らず、レスポンスのフィールド順に列を読んでそのままJSONにする
+SUPERMARKET_FIELDS = list(SupermarketResponse.model_fields)
+PRODUCT_FIELDS = list(ProductResponse.model_fields)
+PRICE_FIELDS = [name for name in PriceResponse.model_fields if name not in ("product", "supermarket")]
+SUPERMARKET_COLUMNS = [getattr(models.Supermarket, name) for name in SUPERMARKET_FIELDS]
+PRODUCT_COLUMNS = [getattr(models.Product, name) for name in PRODUCT_FIELDS]
+PRICE_COLUMNS = [getattr(models.Price, name) for name in PRICE_FIELDS]
+
+class UserCreate(BaseModel):
+    username: str
+    email: str
+
+class UserResponse(BaseModel):
+    id: int
+    username: str
+    email: str
+    created_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class FavoriteCreate(BaseModel):
+    product_id: Optional[int] = None
+    supermarket_id: Optional[int] = None
+
+class FavoriteResponse(BaseModel):
+    id: int
+    user_id: int
+    product_id: Optional[int]
+    supermarket_id: Optional[int]
+    created_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+# 買い物リストの最適化の上限（2店舗の組み合わせは 店舗数の2乗×商品数 の計算になる）
+MAX_BASKET_ITEMS = 200
+MAX_BASKET_STORES = 500
+MAX_BASKET_RADIUS_KM = 50.0
+
+class BasketRequest(BaseModel):
+    product_ids: List[int] = Field(max_length=MAX_BASKET_ITEMS)
+    latitude: float = Field(ge=-90, le=90)
+    longitude: float = Field(ge=-180, le=180)
+    radius: float = Field(5.0, gt=0, le=MAX_BASKET_RADIUS_KM)
+    # 店舗までの距離1kmあたりに加算する金額（円）。負の値では遠い店舗ほど有利になる
+    distance_penalty: float = Field(20.0, ge=0, allow_inf_nan=False)
+    # 近い順に何店舗まで候補にするか
+    max_stores: int = Field(MAX_BASKET_STORES, ge=1, le=MAX_BASKET_STORES)
+
 @app.get("/")
 async def root():
     return {"message": "スーパーマーケット価格比較API"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """ルートごとのレイテンシ・SQL・シリアライズ時間（Prometheusのテキスト形式）"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/system/database")
+def get_database_settings():
+    """接続プールと、実際に適用されているSQLiteのPRAGMAを返す"""
+    return database.effective_settings()
+
+@app.get("/system/startup")
+def get_startup_timings():
+    """このワーカーの起動時間（起動からウォームアップ完了・最初のリクエストへの応答まで）"""
+    return startup.timings.as_dict()
+
 @app.post("/supermarkets/", response_model=SupermarketResponse)
-async def create_supermarket(supermarket: SupermarketCreate, db: Session = Depends(get_db)):
+def create_supermarket(supermarket: SupermarketCreate, db: Session = Depends(get_db)):
     db_supermarket = models.Supermarket(**supermarket.dict())
     db.add(db_supermarket)
+    cache.invalidate_on_commit(db, ["supermarkets"])
     db.commit()
     db.refresh(db_supermarket)
+    # 地図のクラスタに追加した店舗を反映しておく
+    viewport.get_cluster_index(db)
     return db_supermarket
 
 @app.get("/supermarkets/", response_model=List[SupermarketResponse])
-async def get_supermarkets(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    supermarkets = db.query(models.Supermarket).offset(skip).limit(limit).all()
-    return supermarkets
+def get_supermarkets(
+    request: Request,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """cursorを指定するとその続きから返す（次のページのカーソルはX-Next-Cursorヘッダー）"""
+    def render():
+        query = db.query(*SUPERMARKET_COLUMNS).order_by(models.Supermarket.id)
+        if cursor:
+            last_id, = pagination.decode_cursor(cursor, int)
+            query = query.filter(models.Supermarket.id > last_id)
+        else:
+            query = query.offset(skip)
+        supermarkets = fast_json.rows_to_dicts(query.limit(limit), SUPERMARKET_FIELDS)
+        headers = pagination.next_cursor_headers(supermarkets, limit, lambda s: (s["id"],))
+        return render_json(supermarkets), headers
+    return cache.cached_response(request, ["supermarkets"], render)
 
 @app.get("/supermarkets-nearby")
-async def get_nearby_supermarkets(
+def get_nearby_supermarkets(
     latitude: float, 
     longitude: float, 
     radius: float = 5.0,
+    limit: Optional[int] = None,
     db: Session = Depends(get_db)
 ):
-    supermarkets = db.query(models.Supermarket).all()
+    # 距離計算はメモリ上の座標配列でまとめて行い、該当店舗だけDBから読む
+    store_ids, distances = geo.get_store_index(db).within_radius(latitude, longitude, radius, limit)
+    columns = (
+        models.Supermarket.id,
+        models.Supermarket.name,
+        models.Supermarket.address,
+        models.Supermarket.latitude,
+        models.Supermarket.longitude,
+        models.Supermarket.phone,
+    )
+    supermarkets = {row[0]: row for row in load_supermarkets(db, store_ids.tolist(), columns)}
     nearby_supermarkets = []
     
-    for supermarket in supermarkets:
-        distance = calculate_distance(latitude, longitude, supermarket.latitude, supermarket.longitude)
-        if distance <= radius:
-            nearby_supermarkets.append({
-                "id": supermarket.id,
-                "name": supermarket.name,
-                "address": supermarket.address,
-                "latitude": supermarket.latitude,
-                "longitude": supermarket.longitude,
-                "phone": supermarket.phone,
-                "distance_km": round(distance, 2)
-            })
+    for supermarket_id, distance in zip(store_ids.tolist(), distances.tolist()):
+        supermarket_id, name, address, latitude, longitude, phone = supermarkets[supermarket_id]
+        nearby_supermarkets.append({
+            "id": supermarket_id,
+            "name": name,
+            "address": address,
+            "latitude": latitude,
+            "longitude": longitude,
+            "phone": phone,
+            "distance_km": round(distance, 2)
+        })
     
-    nearby_supermarkets.sort(key=lambda x: x["distance_km"])
-    return nearby_supermarkets
+    nearby_supermarkets.sort(key=lambda x: (x["distance_km"], x["id"]))
+    return json_response(nearby_supermarkets)
+
+@app.get("/supermarkets/viewport")
+def get_viewport_supermarkets(bbox: str, zoom: int, db: Session = Depends(get_db)):
+    """
+    地図の表示範囲の店舗を返す
+
+    bbox は "西端の経度,南端の緯度,東端の経度,北端の緯度"。ズームが小さいときは
+    近くの店舗をまとめたクラスタ（店舗数・重心）を clusters に、
+    1店舗だけのセルとズームが大きいときの店舗を supermarkets に入れて返す。
+    幅か高さがそのズームのタイル viewport.MAX_VIEWPORT_TILES 枚を超える範囲は400を返す。
+    """
+    try:
+        lon_min, lat_min, lon_max, lat_max = (float(value) for value in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox は 西経度,南緯度,東経度,北緯度 の4つの数値で指定してください")
+    if not (-90 <= lat_min <= lat_max <= 90 and -180 <= lon_min <= 180 and -180 <= lon_max <= 180):
+        raise HTTPException(status_code=400, detail="bbox の範囲が正しくありません")
+    if not 0 <= zoom <= 22:
+        raise HTTPException(status_code=400, detail="zoom は0〜22で指定してください")
+    if max(viewport.tile_span(lon_min, lat_min, lon_max, lat_max, zoom)) > viewport.MAX_VIEWPORT_TILES:
+        raise HTTPException(status_code=400, detail="bbox がこのズームでは広すぎます。ズームを小さくしてください")
+
+    clusters, supermarkets = viewport.get_cluster_index(db).query(lon_min, lat_min, lon_max, lat_max, zoom)
+    return json_response({"zoom": zoom, "clusters": clusters, "supermarkets": supermarkets})
 
 @app.get("/supermarkets/{supermarket_id}", response_model=SupermarketResponse)
-async def get_supermarket(supermarket_id: int, db: Session = Depends(get_db)):
-    supermarket = db.query(models.Supermarket).filter(models.Supermarket.id == supermarket_id).first()
-    if supermarket is None:
-        raise HTTPException(status_code=404, detail="スーパーマーケットが見つかりません")
-    return supermarket
+def get_supermarket(request: Request, supermarket_id: int, db: Session = Depends(get_db)):
+    def render():
+        supermarket = db.query(models.Supermarket).filter(models.Supermarket.id == supermarket_id).first()
+        if supermarket is None:
+            raise HTTPException(status_code=404, detail="スーパーマーケットが見つかりません")
+        return render_json(SupermarketResponse.model_validate(supermarket)), None
+    return cache.cached_response(request, [f"supermarket:{supermarket_id}"], render)
 
 @app.post("/products/", response_model=ProductResponse)
-async def create_product(product: ProductCreate, db: Session = Depends(get_db)):
+def create_product(product: ProductCreate, db: Session = Depends(get_db)):
     db_product = models.Product(**product.dict())
     db.add(db_product)
+    db.flush()
+    search_index.add_products(db, [db_product])
+    cache.invalidate_on_commit(db, ["products"])
     db.commit()
     db.refresh(db_product)
     return db_product
 
 @app.get("/products/", response_model=List[ProductResponse])
-async def get_products(skip: int = 0, limit: int = 100, category: Optional[str] = None, db: Session = Depends(get_db)):
-    query = db.query(models.Product)
-    if category:
-        query = query.filter(models.Product.category == category)
-    products = query.offset(skip).limit(limit).all()
-    return products
-
-@app.get("/products/search")
-async def search_products(q: str, db: Session = Depends(get_db)):
-    products = db.query(models.Product).filter(models.Product.name.contains(q)).all()
-    return products
-
-@app.post("/prices/", response_model=PriceResponse)
-async def create_price(price: PriceCreate, db: Session = Depends(get_db)):
+def get_products(
+    request: Request,
+    skip: int = 0,
+    limit: int = 100,
+    category: Optional[str] = None,
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """cursorを指定するとその続きから返す（次のページのカーソルはX-Next-Cursorヘッダー）"""
+    def render():
+        query = db.query(*PRODUCT_COLUMNS).order_by(models.Product.id)
+        if category:
+            query = query.filter(models.Product.category == category)
+        if cursor:
+            last_id, = pagination.decode_cursor(cursor, int)
+            query = query.filter(models.Product.id > last_id)
+        else:
+            query = query.offset(skip)
+        products = fast_json.rows_to_dicts(query.limit(limit), PRODUCT_FIELDS)
+        headers = pagination.next_cursor_headers(products, limit, lambda p: (p["id"],))
+        return render_json(products), headers
+    return cache.cached_response(request, ["products"], render)
+
+@app.get("/products/search", response_model=List[ProductResponse])
+def search_products(q: str, limit: int = 100, offset: int = 0, db: Session = Depends(get_db)):
+    if search_index.is_available(db):
+        product_ids = search_index.search(db, q, limit, offset)
+        if product_ids is not None:
+            rows = db.query(*PRODUCT_COLUMNS).filter(models.Product.id.in_(product_ids))
+            products = {product["id"]: product for product in fast_json.rows_to_dicts(rows, PRODUCT_FIELDS)}
+            return json_response([products[product_id] for product_id in product_ids if product_id in products])
+
+    # 全文検索が使えない場合（SQLite以外）や空の検索語は部分一致で検索する
+    query = db.query(*PRODUCT_COLUMNS).filter(models.Product.name.contains(q)).order_by(models.Product.id)
+    return json_response(fast_json.rows_to_dicts(query.offset(offset).limit(limit), PRODUCT_FIELDS))
+
+@app.get("/products/{product_id}/history")
+def get_product_history(
+    request: Request,
+    product_id: int,
+    bucket: str = "day",
+    supermarket_id: Optional[int] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    商品の価格推移を基準単位ごと・期間（day / week / month）ごとの最安・平均・最高・件数で返す
+    （価格は基準単位あたり。単位の違う価格は混ぜない）
+
+    supermarket_id を指定するとその店舗だけの推移を返す。集計テーブルから読むので
+    期間が長くても価格の履歴全体は読まない。
+    """
+    if bucket not in price_history.BUCKETS:
+        raise HTTPException(status_code=400, detail="bucket は day, week, month のいずれかを指定してください")
+
+    def render():
+        product = db.query(models.Product).filter(models.Product.id == product_id).first()
+        if not product:
+            raise HTTPException(status_code=404, detail="商品が見つかりません")
+        return render_json({
+            "product_id": product_id,
+            "product": product.name,
+            "bucket": bucket,
+            "supermarket_id": supermarket_id,
+            "history": price_history.get_history(db, product_id, bucket, supermarket_id, start, end),
+        }), None
+
+    return cache.cached_response(request, [f"history:{product_id}"], render)
+
+@app.get("/products/{product_id}/stats")
+def get_product_stats(
+    product_id: int,
+    latitude: float,
+    longitude: float,
+    radius: float = 5.0,
+    months: int = 3,
+    db: Session = Depends(get_db)
+):
+    """
+    地点の周り（半径radius km にかかるセル）の直近months か月の価格の分布を返す
+
+    基準単位あたりの価格の最安・25%点・中央値・75%点・最高・件数を基準単位ごとに返す。
+    地域ごとのスケッチを足し合わせるので価格の履歴は読まない（分位点は誤差0.5%以内の近似値）。
+    """
+    if not 1 <= months <= 120:
+        raise HTTPException(status_code=400, detail="months は1〜120で指定してください")
+    if radius < 0 or radius > 100:
+        raise HTTPException(status_code=400, detail="radius は0〜100kmで指定してください")
+    product = db.query(models.Product.name).filter(models.Product.id == product_id).first()
+    if not product:
+        raise HTTPException(status_code=404, detail="商品が見つかりません")
+    stats = price_stats.get_stats(db, product_id, latitude, longitude, radius, months)
+    return json_response(dict(
+        {"product_id": product_id, "product": product.name, "radius_km": radius, "months": months}, **stats
+    ))
+
+@app.post(
+    "/prices/",
+    response_model=PriceResponse,
+    responses={202: {"model": AcceptedPriceResponse, "description": "WRITE_BEHIND=1 のときキューで受け付けた"}},
+)
+def create_price(price: PriceCreate, db: Session = Depends(get_db)):
+    """
+    価格を登録する
+
+    WRITE_BEHIND=1 のときはキューに入れて 202 と受付ID（accepted_id）を返し、
+    登録はバックグラウンドでまとめて行う。状態は GET /prices/accepted/{accepted_id} で確認できる。
+    """
+    if write_queue.WRITE_BEHIND:
+        return enqueue_price(price, db)
+
     product = db.query(models.Product).filter(models.Product.id == price.product_id).first()
     if not product:
         raise HTTPException(status_code=404, detail="商品が見つかりません")
@@ -165,66 +460,437 @@ async def create_price(price: PriceCreate, db: Session = Depends(get_db)):
     
     db_price = models.Price(**price.dict())
     db.add(db_price)
+    db.flush()
+    # 価格から導出するテーブルも同じトランザクションで更新する
+    price_ingest.on_prices_inserted(db, [db_price])
     db.commit()
     db.refresh(db_price)
     return db_price
 
+def enqueue_price(price: PriceCreate, db: Session):
+    queue = write_queue.write_queue
+    if not queue.product_ids.contains(db, price.product_id):
+        raise HTTPException(status_code=404, detail="商品が見つかりません")
+    if not queue.supermarket_ids.contains(db, price.supermarket_id):
+        raise HTTPException(status_code=404, detail="スーパーマーケットが見つかりません")
+    try:
+        accepted_id, coalesced = queue.submit(price.dict())
+    except write_queue.QueueFull:
+        raise HTTPException(
+            status_code=503, detail="登録が混み合っています。しばらくしてから再度お試しください",
+            headers={"Retry-After": "1"},
+        )
+    return json_response(dict(queue.status(accepted_id), coalesced=coalesced), status_code=202)
+
+@app.get("/prices/accepted/{accepted_id}", response_model=AcceptedPriceStatus)
+def get_accepted_price(accepted_id: str):
+    """キューで受け付けた価格の状態（queued / stored / failed）を返す"""
+    status = write_queue.write_queue.status(accepted_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="受付IDが見つかりません")
+    return json_response(status)
+
+@app.post("/prices/bulk")
+async def create_prices_bulk(request: Request, db: Session = Depends(get_db)):
+    """
+    価格をまとめて登録する
+
+    JSON配列、またはContent-Typeが application/x-ndjson の場合は1行1件のNDJSONを受け付ける。
+    不正な行はエラーとして返し、残りの行は登録する。
+    """
+    ingest = price_ingest.BulkIngest(db, PriceCreate)
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        # 受信しながら処理し、全体をメモリに載せない。改行は受け取ったチャンクの中だけを探し、
+        # 行の途中までを毎回探し直さない（長い行がチャンクに分かれて届いても受信量に比例する）
+        buffer = bytearray()
+        async for chunk in request.stream():
+            start = 0
+            while (end := chunk.find(b"\n", start)) != -1:
+                buffer += chunk[start:end]
+                add_ndjson_line(ingest, buffer)
+                buffer.clear()
+                start = end + 1
+                if ingest.ready:
+                    await run_in_threadpool(ingest.flush)
+            buffer += chunk[start:]
+        add_ndjson_line(ingest, buffer)
+    else:
+        try:
+            items = json.loads(await request.body())
+        except ValueError:
+            raise HTTPException(status_code=400, detail="JSONとして解釈できません")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="価格の配列を送信してください")
+        for item in items:
+            ingest.add(item)
+            if ingest.ready:
+                await run_in_threadpool(ingest.flush)
+    await run_in_threadpool(ingest.flush)
+    return ingest.result()
+
 @app.get("/prices/", response_model=List[PriceResponse])
-async def get_prices(
+def get_prices(
     skip: int = 0, 
     limit: int = 100, 
     product_id: Optional[int] = None,
     supermarket_id: Optional[int] = None,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
-    query = db.query(models.Price)
+    """
+    価格を登録日時の古い順に返す
+
+    cursorを指定するとその続きから返す（次のページのカーソルはX-Next-Cursorヘッダー）。
+    """
+    # 商品・店舗は行ごとの遅延読み込みにせずJOINで一緒に取得する
+    query = (
+        db.query(*PRICE_COLUMNS, *PRODUCT_COLUMNS, *SUPERMARKET_COLUMNS)
+        .select_from(models.Price)
+        .join(models.Price.product)
+        .join(models.Price.supermarket)
+        .order_by(models.Price.recorded_at, models.Price.id)
+    )
     if product_id:
         query = query.filter(models.Price.product_id == product_id)
     if supermarket_id:
         query = query.filter(models.Price.supermarket_id == supermarket_id)
+    if cursor:
+        recorded_at, last_id = pagination.decode_cursor(cursor, datetime, int)
+        query = query.filter(tuple_(models.Price.recorded_at, models.Price.id) > tuple_(recorded_at, last_id))
+    else:
+        query = query.offset(skip)
     
-    prices = query.offset(skip).limit(limit).all()
-    return prices
+    product_end = len(PRICE_FIELDS) + len(PRODUCT_FIELDS)
+    prices = []
+    for row in query.limit(limit):
+        price = dict(zip(PRICE_FIELDS, row))
+        price["product"] = dict(zip(PRODUCT_FIELDS, row[len(PRICE_FIELDS):product_end]))
+        price["supermarket"] = dict(zip(SUPERMARKET_FIELDS, row[product_end:]))
+        prices.append(price)
+    headers = pagination.next_cursor_headers(prices, limit, lambda p: (p["recorded_at"], p["id"]))
+    return json_response(prices, headers)
+
+@app.get("/prices/compare")
+def compare_prices_batch(
+    request: Request,
+    product_ids: str,
+    latitude: Optional[float] = None,
+    longitude: Optional[float] = None,
+    radius: float = 5.0,
+    db: Session = Depends(get_db)
+):
+    """
+    複数商品の価格比較をまとめて返す（product_ids はカンマ区切り、500件まで）
+
+    各商品の結果は /prices/compare/{product_id} と同じ内容に、基準単位ごとの最安・中央値・最高値と最安店舗を加えたもの。
+    latitude/longitude を指定すると、半径radius km以内の近い順1000店舗の価格だけで比較する。
+    """
+    try:
+        ids = list(dict.fromkeys(int(value) for value in product_ids.split(",") if value.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="product_ids はカンマ区切りの商品IDで指定してください")
+    if not ids:
+        raise HTTPException(status_code=400, detail="商品を指定してください")
+    if len(ids) > 500:
+        raise HTTPException(status_code=400, detail="商品は500件までです")
+    if (latitude is None) != (longitude is None):
+        raise HTTPException(status_code=400, detail="latitude と longitude は両方指定してください")
+
+    tags = [f"compare:{product_id}" for product_id in ids]
+    if latitude is not None:
+        tags.append("supermarkets")
+
+    def render():
+        supermarket_ids = None
+        if latitude is not None:
+            store_ids, _ = geo.get_store_index(db).within_radius(latitude, longitude, radius, 1000)
+            supermarket_ids = store_ids.tolist()
+        results = price_compare.compare_many(db, ids, supermarket_ids)
+        return render_json({
+            "results": [results[product_id] for product_id in ids if product_id in results],
+            "not_found": [product_id for product_id in ids if product_id not in results],
+        }), None
+
+    return cache.cached_response(request, tags, render)
 
 @app.get("/prices/compare/{product_id}")
-async def compare_prices(product_id: int, db: Session = Depends(get_db)):
-    prices = db.query(models.Price).filter(models.Price.product_id == product_id).all()
-    if not prices:
+def compare_prices(request: Request, product_id: int, db: Session = Depends(get_db)):
+    return cache.cached_response(
+        request, [f"compare:{product_id}"], lambda: (render_json(build_price_comparison(db, product_id)), None)
+    )
+
+def build_price_comparison(db: Session, product_id: int):
+    # 店舗ごとの最新価格だけを (product_id, base_unit, price_per_base_unit) のインデックス順に読む
+    # （単位の異なる価格も比べられるよう基準単位あたりの価格の安い順。基準単位が違う価格は混ぜずに基準単位ごとに並べる）
+    rows = (
+        db.query(
+            models.Product.name,
+            models.Supermarket.name,
+            models.Supermarket.address,
+            models.LatestPrice.price,
+            models.LatestPrice.unit,
+            models.LatestPrice.price_per_base_unit,
+            models.LatestPrice.base_unit,
+            models.LatestPrice.recorded_at,
+        )
+        .select_from(models.LatestPrice)
+        .join(models.LatestPrice.product)
+        .join(models.LatestPrice.supermarket)
+        .filter(models.LatestPrice.product_id == product_id)
+        .order_by(
+            models.LatestPrice.base_unit, models.LatestPrice.price_per_base_unit, models.LatestPrice.supermarket_id
+        )
+        .all()
+    )
+    if not rows:
         raise HTTPException(status_code=404, detail="価格情報が見つかりません")
     
     price_comparison = []
-    for price in prices:
+    for product_name, supermarket_name, address, price, unit, price_per_base_unit, base_unit, recorded_at in rows:
         price_comparison.append({
-            "supermarket": price.supermarket.name,
-            "address": price.supermarket.address,
-            "price": price.price,
-            "unit": price.unit,
-            "recorded_at": price.recorded_at
+            "supermarket": supermarket_name,
+            "address": address,
+            "price": price,
+            "unit": unit,
+            "price_per_base_unit": price_per_base_unit,
+            "base_unit": base_unit,
+            "recorded_at": recorded_at
         })
     
-    price_comparison.sort(key=lambda x: x["price"])
     return {
-        "product": prices[0].product.name,
+        "product": rows[0][0],
         "prices": price_comparison
     }
 
-def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    import math
-    
-    R = 6371
-    
-    lat1_rad = math.radians(lat1)
-    lon1_rad = math.radians(lon1)
-    lat2_rad = math.radians(lat2)
-    lon2_rad = math.radians(lon2)
-    
-    dlat = lat2_rad - lat1_rad
-    dlon = lon2_rad - lon1_rad
-    
-    a = math.sin(dlat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon/2)**2
-    c = 2 * math.asin(math.sqrt(a))
-    
-    return R * c
+@app.get("/export/prices")
+def export_prices(format: str = "ndjson", since: Optional[datetime] = None):
+    """価格を登録日時の古い順にNDJSONまたはCSVで書き出す（sinceより後に登録された分だけも可）"""
+    return export.export_response("prices", format, since)
+
+@app.get("/export/products")
+def export_products(format: str = "ndjson", since: Optional[datetime] = None):
+    return export.export_response("products", format, since)
+
+@app.get("/export/supermarkets")
+def export_supermarkets(format: str = "ndjson", since: Optional[datetime] = None):
+    return export.export_response("supermarkets", format, since)
+
+def render_json(data) -> bytes:
+    """FastAPIが返すのと同じJSONのバイト列を作る"""
+    with metrics.serialize_timer():
+        return fast_json.dumps(data)
+
+def json_response(data, headers=None, status_code=200) -> Response:
+    """レスポンスモデルでの検証を通さずにJSONを返す"""
+    return Response(
+        content=render_json(data), status_code=status_code, media_type="application/json", headers=headers
+    )
+
+@app.post("/basket/optimize")
+def optimize_basket(shopping_list: BasketRequest, db: Session = Depends(get_db)):
+    """買い物リストを最も安く揃えられる1店舗と、2店舗の組み合わせを返す"""
+    product_ids = list(dict.fromkeys(shopping_list.product_ids))
+    if not product_ids:
+        raise HTTPException(status_code=400, detail="商品を指定してください")
+
+    store_ids, distances = geo.get_store_index(db).within_radius(
+        shopping_list.latitude, shopping_list.longitude, shopping_list.radius, shopping_list.max_stores
+    )
+    vectors = basket.price_vectors.get_many(db, product_ids)
+    matrix = basket.price_matrix(vectors, product_ids, store_ids)
+
+    # 周辺のどの店舗にも価格がない商品は最適化の対象から外す
+    available = np.isfinite(matrix).any(axis=1)
+    items = [product_id for product_id, ok in zip(product_ids, available) if ok]
+    matrix = matrix[available]
+    penalties = distances * shopping_list.distance_penalty
+
+    single = basket.best_single_store(matrix, penalties) if items else None
+    pair = basket.best_store_pair(matrix, penalties) if items else None
+
+    columns = ([single] if single is not None else []) + (list(pair) if pair is not None else [])
+    supermarkets = {s.id: s for s in load_supermarkets(db, [int(store_ids[c]) for c in columns])}
+
+    def store_summary(column):
+        supermarket = supermarkets[int(store_ids[column])]
+        return {
+            "id": supermarket.id,
+            "name": supermarket.name,
+            "address": supermarket.address,
+            "distance_km": round(float(distances[column]), 2),
+        }
+
+    single_store = None
+    if single is not None:
+        total = float(matrix[:, single].sum())
+        single_store = {
+            "supermarket": store_summary(single),
+            "total_price": total,
+            "distance_penalty": round(float(penalties[single]), 2),
+            "cost": round(total + float(penalties[single]), 2),
+            "items": [
+                {"product_id": product_id, "price": float(price)}
+                for product_id, price in zip(items, matrix[:, single])
+            ],
+        }
+
+    two_stores = None
+    if pair is not None:
+        first, second = pair
+        choice = np.where(matrix[:, first] <= matrix[:, second], first, second)
+        prices = matrix[np.arange(len(items)), choice]
+        total = float(prices.sum())
+        penalty = float(penalties[first] + penalties[second])
+        two_stores = {
+            "supermarkets": [store_summary(first), store_summary(second)],
+            "total_price": total,
+            "distance_penalty": round(penalty, 2),
+            "cost": round(total + penalty, 2),
+            "items": [
+                {"product_id": product_id, "supermarket_id": int(store_ids[column]), "price": float(price)}
+                for product_id, column, price in zip(items, choice, prices)
+            ],
+        }
+
+    return {
+        "candidate_stores": len(store_ids),
+        "unavailable_product_ids": [product_id for product_id, ok in zip(product_ids, available) if not ok],
+        "single_store": single_store,
+        "two_stores": two_stores,
+    }
+
+@app.post("/users/", response_model=UserResponse)
+def create_user(user: UserCreate, db: Session = Depends(get_db)):
+    exists = db.query(models.User.id).filter(
+        (models.User.username == user.username) | (models.User.email == user.email)
+    ).first()
+    if exists:
+        raise HTTPException(status_code=400, detail="ユーザー名またはメールアドレスは既に登録されています")
+    db_user = models.User(**user.dict())
+    db.add(db_user)
+    db.commit()
+    db.refresh(db_user)
+    return db_user
+
+@app.post("/users/{user_id}/favorites", response_model=FavoriteResponse)
+def create_favorite(user_id: int, favorite: FavoriteCreate, db: Session = Depends(get_db)):
+    """
+    お気に入りを登録する
+
+    商品と店舗の組、商品だけ（どの店舗でも）、店舗だけ（どの商品でも）のいずれか。
+    登録した商品・店舗の値下がりは GET /users/{user_id}/alerts で受け取れる。
+    """
+    if favorite.product_id is None and favorite.supermarket_id is None:
+        raise HTTPException(status_code=400, detail="product_id か supermarket_id を指定してください")
+    if not db.query(models.User.id).filter(models.User.id == user_id).first():
+        raise HTTPException(status_code=404, detail="ユーザーが見つかりません")
+    if favorite.product_id is not None and not db.query(models.Product.id).filter(
+        models.Product.id == favorite.product_id
+    ).first():
+        raise HTTPException(status_code=404, detail="商品が見つかりません")
+    if favorite.supermarket_id is not None and not db.query(models.Supermarket.id).filter(
+        models.Supermarket.id == favorite.supermarket_id
+    ).first():
+        raise HTTPException(status_code=404, detail="スーパーマーケットが見つかりません")
+
+    db_favorite = (
+        db.query(models.Favorite)
+        .filter(
+            models.Favorite.user_id == user_id,
+            models.Favorite.product_id.is_not_distinct_from(favorite.product_id),
+            models.Favorite.supermarket_id.is_not_distinct_from(favorite.supermarket_id),
+        )
+        .first()
+    )
+    if db_favorite is None:
+        db_favorite = models.Favorite(user_id=user_id, **favorite.dict())
+        db.add(db_favorite)
+        db.commit()
+        db.refresh(db_favorite)
+    return db_favorite
+
+@app.get("/users/{user_id}/favorites", response_model=List[FavoriteResponse])
+def get_favorites(user_id: int, db: Session = Depends(get_db)):
+    return db.query(models.Favorite).filter(models.Favorite.user_id == user_id).order_by(models.Favorite.id).all()
+
+@app.get("/users/{user_id}/alerts")
+def get_alerts(
+    user_id: int,
+    since: Optional[datetime] = None,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    お気に入りの値下がり通知を古い順に返す
+
+    since を指定するとその日時より後の通知だけを返す。cursorを指定するとその続きから返す
+    （次のページのカーソルはX-Next-Cursorヘッダー）。通知は価格の登録時に作られるので、
+    ここではユーザーと日時のインデックスを読むだけ。
+    """
+    if not db.query(models.User.id).filter(models.User.id == user_id).first():
+        raise HTTPException(status_code=404, detail="ユーザーが見つかりません")
+
+    alert = models.PriceAlert
+    query = (
+        db.query(
+            alert.id,
+            alert.created_at,
+            alert.product_id,
+            models.Product.name,
+            alert.supermarket_id,
+            models.Supermarket.name,
+            alert.price_id,
+            alert.price,
+            alert.unit,
+            alert.price_per_base_unit,
+            alert.previous_price_per_base_unit,
+            alert.base_unit,
+        )
+        .join(models.Product, models.Product.id == alert.product_id)
+        .join(models.Supermarket, models.Supermarket.id == alert.supermarket_id)
+        .filter(alert.user_id == user_id)
+        .order_by(alert.created_at, alert.id)
+    )
+    if since is not None:
+        query = query.filter(alert.created_at > since)
+    if cursor:
+        last_created_at, last_id = pagination.decode_cursor(cursor, datetime, int)
+        query = query.filter(tuple_(alert.created_at, alert.id) > tuple_(last_created_at, last_id))
+
+    alerts = fast_json.rows_to_dicts(query.limit(limit), [
+        "id", "created_at", "product_id", "product", "supermarket_id", "supermarket", "price_id", "price", "unit",
+        "price_per_base_unit", "previous_price_per_base_unit", "base_unit",
+    ])
+    headers = pagination.next_cursor_headers(alerts, limit, lambda a: (a["created_at"], a["id"]))
+    return json_response(alerts, headers)
+
+def add_ndjson_line(ingest: price_ingest.BulkIngest, line: bytearray):
+    line = line.strip()
+    if not line:
+        return
+    try:
+        item = json.loads(line)
+    except ValueError:
+        ingest.add_error("JSONとして解釈できません")
+        return
+    ingest.add(item)
+
+def load_supermarkets(db: Session, supermarket_ids: List[int], columns=None):
+    """
+    ID一覧の店舗をまとめて読み込む（SQLのパラメータ数上限を超えないよう分割）
+
+    columns を指定するとORMオブジェクトではなくその列のタプルを返す。
+    """
+    entities = columns or [models.Supermarket]
+    supermarkets = []
+    for i in range(0, len(supermarket_ids), 500):
+        chunk = supermarket_ids[i:i + 500]
+        supermarkets.extend(
+            db.query(*entities).filter(models.Supermarket.id.in_(chunk)).all()
+        )
+    return supermarkets
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+運用コマンド（スキーマの作成・導出テーブルの再構築・本番用のサーバー起動）
+
+    migrate : テーブル・不足している列とインデックス・全文検索の索引を作成する。
+              デプロイ時やアップデート後に、サーバーを起動する前に一度だけ実行する
+    rebuild : 最新価格・価格履歴の集計・地域の価格分布・全文検索の索引を価格履歴から作り直す
+    serve   : 複数ワーカーのuvicornで起動する（自動リロードなし）。ワーカーはスキーマを作成・確認せず
+              （AUTO_MIGRATE=0）、店舗・商品のインデックスを読み込んでから受け付ける。
+              ワーカー数の既定は WEB_CONCURRENCY、なければ使えるCPU数。
+              ワーカーが2つ以上のときは、他のワーカーの書き込みで破棄されないプロセス内のキャッシュ
+              （CACHE_URL=memory と買い物リストの価格ベクトル）を使わない（PROCESS_CACHE=0）。
+              レスポンスをキャッシュするには CACHE_URL=redis://... を指定する
+
+使い方（backendディレクトリで実行）:
+    python manage.py migrate
+    python manage.py rebuild
+    python manage.py serve --port 8000
+    python manage.py serve --workers 4
+"""
+
+import argparse
+import copy
+import os
+import sys
+import time
+
+
+def default_workers():
+    if os.getenv("WEB_CONCURRENCY"):
+        return int(os.environ["WEB_CONCURRENCY"])
+    if hasattr(os, "sched_getaffinity"):
+        # コンテナなどで使えるCPUが制限されている場合はその数
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def migrate(args):
+    import database
+    import startup
+
+    started = time.perf_counter()
+    startup.migrate(database.engine)
+    print(f"スキーマの作成が完了しました（{time.perf_counter() - started:.2f}秒）")
+
+
+def rebuild(args=None):
+    import database
+    import latest_prices
+    import models
+    import price_history
+    import price_stats
+    import search_index
+
+    models.create_schema(database.engine)
+    search_index.create(database.engine)
+    db = database.SessionLocal()
+    try:
+        for label, rebuild_table in [
+            ("最新価格", latest_prices.rebuild),
+            ("価格履歴の集計", price_history.rebuild),
+            ("地域の価格分布", price_stats.rebuild),
+            ("全文検索の索引", search_index.rebuild if search_index.is_available(db) else None),
+        ]:
+            if rebuild_table is None:
+                continue
+            started = time.perf_counter()
+            rebuild_table(db)
+            db.commit()
+            print(f"  {label}: {time.perf_counter() - started:.1f}秒")
+    finally:
+        db.close()
+    print("導出テーブルの再構築が完了しました！")
+
+
+def serve(args):
+    import uvicorn
+    from uvicorn.config import LOGGING_CONFIG
+
+    # ワーカーはこの環境変数を引き継いで起動する
+    os.environ["AUTO_MIGRATE"] = "0"
+    os.environ["SERVER_LAUNCHED_AT"] = repr(time.time())
+    workers = args.workers or default_workers()
+    if workers > 1:
+        # プロセス内のキャッシュは他のワーカーの書き込みで破棄されず、古い価格を返してしまう
+        os.environ["PROCESS_CACHE"] = "0"
+        if os.getenv("CACHE_URL", "memory") == "memory":
+            print("CACHE_URL=memory は複数ワーカーで共有できないため、レスポンスをキャッシュしません"
+                  "（キャッシュするには CACHE_URL=redis://... を指定してください）")
+
+    # アプリのログ（起動時間・書き込みキューなど）もuvicornと同じ形式で出す
+    log_config = copy.deepcopy(LOGGING_CONFIG)
+    log_config["loggers"]["supermarket"] = {"handlers": ["default"], "level": args.log_level.upper()}
+
+    print(f"スーパーマーケット価格比較API を本番モードで起動します（ワーカー{workers}）")
+    print("スキーマは作成しません。先に python manage.py migrate を実行してください")
+    uvicorn.run(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        log_level=args.log_level,
+        log_config=log_config,
+        access_log=args.access_log,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="スーパーマーケット価格比較API の運用コマンド")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("migrate", help="スキーマを作成する").set_defaults(handler=migrate)
+    commands.add_parser("rebuild", help="導出テーブルを作り直す").set_defaults(handler=rebuild)
+
+    serve_parser = commands.add_parser("serve", help="本番用に複数ワーカーで起動する")
+    serve_parser.add_argument("--host", default="0.0.0.0")
+    serve_parser.add_argument("--port", type=int, default=8000)
+    serve_parser.add_argument("--workers", type=int, default=None, help="ワーカー数（既定はCPU数）")
+    serve_parser.add_argument("--log-level", default="info")
+    serve_parser.add_argument("--access-log", action="store_true", help="リクエストごとのアクセスログを出す")
+    serve_parser.set_defaults(handler=serve)
+
+    args = parser.parse_args(argv)
+    # 各コマンドはbackendディレクトリのモジュールを読み込む
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.getcwd())
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
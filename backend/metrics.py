@@ -0,0 +1,307 @@
+"""
+リクエスト単位の性能計測
+
+ルートごとに次を記録し、/metrics でPrometheusのテキスト形式で返す。
+    - レイテンシ（ヒストグラム）とステータス別の件数
+    - 発行したSQLの数と合計時間（database.engine のイベントで計測）
+    - ORMで読み込んだ（オブジェクトにした）行数
+    - レスポンスのシリアライズ時間（response_model の変換とJSON化）
+SERVER_TIMING=1 でレスポンスに Server-Timing ヘッダーを付ける。
+SLOW_QUERY_MS（既定200、0で無効）を超えたSQLは "supermarket.slow_query" のロガーに出す。
+集計はプロセスごとなので、複数ワーカーではワーカーごとの値になる。
+"""
+
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+
+slow_query_logger = logging.getLogger("supermarket.slow_query")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class RequestStats:
+    """1リクエスト分の計測値"""
+
+    __slots__ = ("scope", "queries", "query_seconds", "rows_loaded", "serialize_seconds", "endpoint_returned")
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.rows_loaded = 0
+        self.serialize_seconds = 0.0
+        self.endpoint_returned = None   # エンドポイントの関数が返った時刻（MetricsRoute が記録する）
+
+    def labels(self):
+        # ルーティング後は scope["route"] にルート（パスのテンプレート付き）が入る
+        route = self.scope.get("route")
+        return (self.scope["method"], route.path if route is not None else "unmatched")
+
+
+# 処理中のリクエストの計測値（スレッドプールで動くエンドポイントにもコンテキストごと引き継がれる）
+_current = contextvars.ContextVar("request_stats", default=None)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, value=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames, buckets):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._values = {}   # labels -> [バケットごとの件数..., 合計, 件数]
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            values = self._values.get(labels)
+            if values is None:
+                values = self._values[labels] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                values[index] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = sorted((labels, list(values)) for labels, values in self._values.items())
+        for labels, values in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                yield f"{self.name}_bucket{_labels(self.labelnames + ('le',), labels + (_number(bound),))} {cumulative}"
+            yield f"{self.name}_bucket{_labels(self.labelnames + ('le',), labels + ('+Inf',))} {values[-1]}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(values[-2])}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {values[-1]}"
+
+
+class Gauge:
+    """collect のたびに function() の値を返す計測値（キューの長さなど）"""
+
+    def __init__(self, name, help, function):
+        self.name = name
+        self.help = help
+        self.function = function
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        yield f"{self.name} {_number(self.function())}"
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+ROUTE_LABELS = ("method", "route")
+
+requests_total = Counter(
+    "http_requests_total", "処理したリクエストの数", ROUTE_LABELS + ("status",))
+request_duration = Histogram(
+    "http_request_duration_seconds", "リクエストの処理時間（レスポンス開始まで）", ROUTE_LABELS, LATENCY_BUCKETS)
+queries_per_request = Histogram(
+    "db_queries_per_request", "1リクエストで発行したSQLの数", ROUTE_LABELS, QUERY_COUNT_BUCKETS)
+queries_total = Counter(
+    "db_queries_total", "発行したSQLの数", ROUTE_LABELS)
+query_seconds_total = Counter(
+    "db_query_seconds_total", "SQLの実行にかかった時間の合計", ROUTE_LABELS)
+rows_loaded_total = Counter(
+    "orm_rows_loaded_total", "ORMでオブジェクトとして読み込んだ行数", ROUTE_LABELS)
+serialize_duration = Histogram(
+    "response_serialize_seconds", "レスポンスのシリアライズにかかった時間", ROUTE_LABELS, LATENCY_BUCKETS)
+
+REGISTRY = [
+    requests_total, request_duration, queries_per_request, queries_total,
+    query_seconds_total, rows_loaded_total, serialize_duration,
+]
+
+
+def register(metric):
+    """他のモジュールの計測値（collect() で行を返すもの）を /metrics に加える"""
+    REGISTRY.append(metric)
+    return metric
+
+
+def render():
+    """Prometheusのテキスト形式で全計測値を返す"""
+    return "\n".join(line for metric in REGISTRY for line in metric.collect()) + "\n"
+
+
+@contextmanager
+def serialize_timer():
+    """処理中のリクエストのシリアライズ時間として計測する"""
+    stats = _current.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if stats is not None:
+            stats.serialize_seconds += time.perf_counter() - start
+
+
+def _record_endpoint_returned():
+    stats = _current.get()
+    if stats is not None:
+        stats.endpoint_returned = time.perf_counter()
+
+
+class MetricsRoute(APIRoute):
+    """
+    エンドポイントの関数が返った時刻を記録するルート
+
+    返ってからレスポンスを送り始めるまで（response_model による変換とJSON化）を
+    MetricsMiddleware がシリアライズ時間として数える。
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        call = self.dependant.call
+        if asyncio.iscoroutinefunction(call):
+            async def timed_call(*call_args, **call_kwargs):
+                try:
+                    return await call(*call_args, **call_kwargs)
+                finally:
+                    _record_endpoint_returned()
+        else:
+            def timed_call(*call_args, **call_kwargs):
+                try:
+                    return call(*call_args, **call_kwargs)
+                finally:
+                    _record_endpoint_returned()
+        self.dependant.call = timed_call
+
+
+class MetricsMiddleware:
+    """リクエストごとに計測を始め、レスポンス開始時に記録する（ASGIミドルウェア）"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope)
+        token = _current.set(stats)
+        start = time.perf_counter()
+        status = [500]
+        recorded = False
+
+        def record(status_code):
+            nonlocal recorded
+            recorded = True
+            elapsed = time.perf_counter() - start
+            labels = stats.labels()
+            requests_total.inc(labels + (str(status_code),))
+            request_duration.observe(labels, elapsed)
+            queries_per_request.observe(labels, stats.queries)
+            queries_total.inc(labels, stats.queries)
+            query_seconds_total.inc(labels, stats.query_seconds)
+            rows_loaded_total.inc(labels, stats.rows_loaded)
+            serialize_duration.observe(labels, stats.serialize_seconds)
+            return elapsed
+
+        async def send_with_metrics(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                if stats.endpoint_returned is not None:
+                    stats.serialize_seconds += time.perf_counter() - stats.endpoint_returned
+                elapsed = record(message["status"])
+                if SERVER_TIMING:
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"server-timing", _server_timing(stats, elapsed).encode())
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            if not recorded:
+                record(status[0])
+            _current.reset(token)
+
+
+def _server_timing(stats, elapsed):
+    return (
+        f'db;dur={stats.query_seconds * 1000:.2f};desc="{stats.queries} queries", '
+        f'serialize;dur={stats.serialize_seconds * 1000:.2f}, '
+        f'total;dur={elapsed * 1000:.2f}'
+    )
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # 開始時刻は文ごとの実行コンテキストに持たせる（失敗した文の分が接続に残らない）
+    context._metrics_query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._metrics_query_start
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.query_seconds += elapsed
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        slow_query_logger.warning(
+            "%.1fms %s %s params=%.200r", elapsed * 1000,
+            " ".join(stats.labels()) if stats is not None else "-", " ".join(statement.split()), parameters,
+        )
+
+
+def _on_load(target, context):
+    stats = _current.get()
+    if stats is not None:
+        stats.rows_loaded += 1
+
+
+def install(app, engine, base):
+    """ミドルウェアとSQLAlchemyのイベントを登録する（ルートを定義する前に呼ぶ）"""
+    app.add_middleware(MetricsMiddleware)
+    # これ以降に定義するルートはエンドポイントが返った時刻を記録する
+    app.router.route_class = MetricsRoute
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(base, "load", _on_load, propagate=True)
@@ -1,7 +1,8 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, Float, DateTime, Date, ForeignKey, Text, Index, LargeBinary, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
+import units
 
 Base = declarative_base()
 
@@ -29,6 +30,13 @@ class Product(Base):
     
     prices = relationship("Price", back_populates="product")
 
+def _price_per_base_unit(context):
+    row = context.get_current_parameters()
+    return units.normalize(row["price"], row.get("unit"))[0]
+
+def _base_unit(context):
+    return units.parse_unit(context.get_current_parameters().get("unit")).base_unit
+
 class Price(Base):
     __tablename__ = "prices"
     
@@ -37,12 +45,83 @@ class Price(Base):
     supermarket_id = Column(Integer, ForeignKey("supermarkets.id"), nullable=False)
     price = Column(Float, nullable=False)
     unit = Column(String(20), default="個")
+    # unit を基準単位（100g / 100ml / 個など）に換算した価格（units.normalize、登録時に計算）
+    price_per_base_unit = Column(Float, default=_price_per_base_unit)
+    base_unit = Column(String(20), default=_base_unit)
     recorded_by = Column(String(50), nullable=False)
     recorded_at = Column(DateTime, default=datetime.utcnow, index=True)
     
     product = relationship("Product", back_populates="prices")
     supermarket = relationship("Supermarket", back_populates="prices")
 
+    __table_args__ = (
+        # 商品（＋店舗）での絞り込みと新しい順の並べ替え用
+        Index("ix_prices_product_supermarket_recorded", "product_id", "supermarket_id", recorded_at.desc()),
+        # 商品での絞り込みと登録日時順のページング用
+        Index("ix_prices_product_recorded", "product_id", "recorded_at", "id"),
+        # 店舗での絞り込みと新しい順の並べ替え用
+        Index("ix_prices_supermarket_recorded", "supermarket_id", "recorded_at"),
+    )
+
+class LatestPrice(Base):
+    """商品×店舗ごとの最新の価格（pricesから導出し、価格登録時に更新する）"""
+    __tablename__ = "latest_prices"
+    
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    supermarket_id = Column(Integer, ForeignKey("supermarkets.id"), primary_key=True)
+    price_id = Column(Integer, ForeignKey("prices.id"), nullable=False)
+    price = Column(Float, nullable=False)
+    unit = Column(String(20), default="個")
+    price_per_base_unit = Column(Float)
+    base_unit = Column(String(20))
+    recorded_at = Column(DateTime, nullable=False)
+    
+    product = relationship("Product")
+    supermarket = relationship("Supermarket")
+
+    __table_args__ = (
+        # 価格比較で商品ごと・基準単位ごとに基準単位あたりの価格の安い順に読むため
+        Index("ix_latest_prices_product_base_unit_price", "product_id", "base_unit", "price_per_base_unit"),
+    )
+
+class PriceRollup(Base):
+    """
+    商品×店舗×基準単位×期間ごとの基準単位あたりの価格の集計（pricesから導出し、価格登録時に更新する）
+
+    基準単位を主キーに加えたときにテーブル名を price_rollups から変えた（既存のデータベースでは
+    manage.py migrate で空のテーブルが作られるので、manage.py rebuild で作り直す）。
+    """
+    __tablename__ = "unit_price_rollups"
+
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    # 全店舗をまとめた集計は0（price_history.ALL_STORES）
+    supermarket_id = Column(Integer, primary_key=True)
+    bucket = Column(String(5), primary_key=True)       # day / week / month
+    base_unit = Column(String(20), primary_key=True)   # 100g / 100ml / 個 など（units.normalize）
+    bucket_start = Column(Date, primary_key=True)      # 期間の開始日（週は月曜）
+    count = Column(Integer, nullable=False)
+    total = Column(Float, nullable=False)
+    min_price = Column(Float, nullable=False)
+    max_price = Column(Float, nullable=False)
+
+class RegionalPriceStat(Base):
+    """
+    商品×地域のセル×月ごとの基準単位あたりの価格の分布（price_statsのスケッチ）
+
+    pricesから導出し、価格登録時に更新する。セルは店舗の緯度・経度を price_stats.CELL_DEGREES 度で区切ったもの。
+    """
+    __tablename__ = "regional_price_stats"
+
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    cell_lat = Column(Integer, primary_key=True)
+    cell_lon = Column(Integer, primary_key=True)
+    base_unit = Column(String(20), primary_key=True)
+    period_start = Column(Date, primary_key=True)      # 月の初日
+    count = Column(Integer, nullable=False)
+    min_price = Column(Float, nullable=False)
+    max_price = Column(Float, nullable=False)
+    sketch = Column(LargeBinary, nullable=False)
+
 class User(Base):
     __tablename__ = "users"
     
@@ -64,4 +143,59 @@ class Favorite(Base):
     
     user = relationship("User", back_populates="favorites")
     supermarket = relationship("Supermarket")
-    product = relationship("Product")
\ No newline at end of file
+    product = relationship("Product")
+
+    __table_args__ = (
+        # 値下がりした商品×店舗からお気に入りのユーザーを逆引きするため（price_alerts）
+        Index("ix_favorites_product_supermarket", "product_id", "supermarket_id"),
+        Index("ix_favorites_supermarket_product", "supermarket_id", "product_id"),
+        Index("ix_favorites_user", "user_id"),
+    )
+
+class PriceAlert(Base):
+    """お気に入りの商品・店舗の値下がり通知（価格登録時に追加する）"""
+    __tablename__ = "price_alerts"
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    supermarket_id = Column(Integer, ForeignKey("supermarkets.id"), nullable=False)
+    price_id = Column(Integer, ForeignKey("prices.id"), nullable=False)
+    price = Column(Float, nullable=False)
+    unit = Column(String(20))
+    price_per_base_unit = Column(Float, nullable=False)
+    previous_price_per_base_unit = Column(Float, nullable=False)
+    base_unit = Column(String(20))
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        # ユーザーごとの新しい通知を日時順に読むため
+        Index("ix_price_alerts_user_created", "user_id", "created_at", "id"),
+    )
+
+
+def create_schema(engine):
+    """テーブルと、既存テーブルに不足している列・インデックスを作成する"""
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
+    # create_allは既存テーブルへ後から追加したインデックスを作らないため個別に作成
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
+def add_missing_columns(engine):
+    """
+    既存テーブルに後から追加した列を ALTER TABLE で加える（create_allは列を追加しないため）
+
+    追加するのはNULL可の列だけ。既存の行の値は別途埋める（例: backfill_unit_prices.py）。
+    """
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
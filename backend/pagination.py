@@ -0,0 +1,43 @@
+"""
+キーセット（カーソル）ページング
+
+一覧の並び順のキー（idや(recorded_at, id)）をカーソルとして返し、次のページは
+「そのキーより後」を条件に読む。OFFSETのように読み飛ばす行を数えないため、
+深いページでも速度が変わらず、途中で行が追加されても重複や抜けが起きない。
+カーソルの中身はクライアントからは不透明な文字列として扱う。
+"""
+
+import base64
+import json
+from datetime import datetime
+
+from fastapi import HTTPException
+
+# 次のページのカーソルを返すレスポンスヘッダー
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(*values) -> str:
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, *types):
+    """カーソルを types の型の値に戻す。不正なカーソルは400エラーにする"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(payload, list) or len(payload) != len(types):
+            raise ValueError
+        return [
+            datetime.fromisoformat(value) if value_type is datetime else value_type(value)
+            for value, value_type in zip(payload, types)
+        ]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="カーソルが不正です")
+
+
+def next_cursor_headers(rows, limit, key):
+    """ページが埋まっていれば、最後の行のキーから次のページのカーソルをヘッダーで返す"""
+    if limit <= 0 or len(rows) < limit:
+        return {}
+    return {NEXT_CURSOR_HEADER: encode_cursor(*key(rows[-1]))}
@@ -0,0 +1,89 @@
+"""
+お気に入りの値下がり通知
+
+価格の登録時（price_ingest.on_prices_inserted）に、置き換わる前の最新価格より
+基準単位あたりで安くなった商品×店舗を値下がりとし、その商品・店舗をお気に入りに
+登録しているユーザーごとに price_alerts へ通知を追加する。
+お気に入りは商品と店舗の組、商品だけ（どの店舗でも）、店舗だけ（どの商品でも）のいずれか。
+ユーザーの逆引きは favorites のインデックスで値下がりした分だけ引くので、
+全ユーザーのお気に入りを走査しない。通知の読み出しはユーザーと日時のインデックスで行う。
+"""
+
+from collections import defaultdict
+
+from sqlalchemy import insert, select
+
+import models
+
+# IN句に渡すIDの数の上限（SQLiteのパラメータ数上限対策）
+_ID_CHUNK_SIZE = 500
+
+
+def find_drops(replaced):
+    """latest_prices.apply_prices の戻り値から、値下がりした価格と前の価格の組を返す"""
+    drops = []
+    for price, (previous, base_unit) in replaced:
+        if previous is None or price.price_per_base_unit is None or base_unit != price.base_unit:
+            continue
+        if price.price_per_base_unit < previous:
+            drops.append((price, previous))
+    return drops
+
+
+def subscribers(db, keys):
+    """
+    商品×店舗の組 -> その組をお気に入りにしているユーザーIDの集合 の辞書を返す
+
+    favorites を商品IDと店舗IDの両方から引き、組・商品だけ・店舗だけのお気に入りを合わせる。
+    """
+    favorite = models.Favorite
+    product_ids = sorted({product_id for product_id, _ in keys})
+    supermarket_ids = sorted({supermarket_id for _, supermarket_id in keys})
+    by_pair = defaultdict(set)
+    by_product = defaultdict(set)
+    by_supermarket = defaultdict(set)
+    for ids, column in ((product_ids, favorite.product_id), (supermarket_ids, favorite.supermarket_id)):
+        for i in range(0, len(ids), _ID_CHUNK_SIZE):
+            rows = db.execute(
+                select(favorite.user_id, favorite.product_id, favorite.supermarket_id)
+                .where(column.in_(ids[i:i + _ID_CHUNK_SIZE]))
+            )
+            for user_id, product_id, supermarket_id in rows:
+                if product_id is not None and supermarket_id is not None:
+                    by_pair[(product_id, supermarket_id)].add(user_id)
+                elif product_id is not None:
+                    by_product[product_id].add(user_id)
+                elif supermarket_id is not None:
+                    by_supermarket[supermarket_id].add(user_id)
+    return {
+        (product_id, supermarket_id): (
+            by_pair[(product_id, supermarket_id)] | by_product[product_id] | by_supermarket[supermarket_id]
+        )
+        for product_id, supermarket_id in keys
+    }
+
+
+def record_drops(db, replaced):
+    """値下がりを検出して通知を追加し、追加した件数を返す（コミットは呼び出し側）"""
+    drops = find_drops(replaced)
+    if not drops:
+        return 0
+    users = subscribers(db, [(price.product_id, price.supermarket_id) for price, _ in drops])
+    rows = [
+        {
+            "user_id": user_id,
+            "product_id": price.product_id,
+            "supermarket_id": price.supermarket_id,
+            "price_id": price.id,
+            "price": price.price,
+            "unit": price.unit,
+            "price_per_base_unit": price.price_per_base_unit,
+            "previous_price_per_base_unit": previous,
+            "base_unit": price.base_unit,
+        }
+        for price, previous in drops
+        for user_id in sorted(users[(price.product_id, price.supermarket_id)])
+    ]
+    if rows:
+        db.execute(insert(models.PriceAlert), rows)
+    return len(rows)
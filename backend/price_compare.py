@@ -0,0 +1,133 @@
+"""
+複数商品の価格比較
+
+商品ごとの店舗別最新価格と、最安・中央値・最高値を1本のSQLでまとめて求める。
+単位の異なる価格を比べられるよう、順位と最安・中央値・最高値は基準単位あたりの価格
+（price_per_base_unit、units.normalize）で求める。100gあたりと1個あたりのように
+基準単位が違う価格は比べられないので、基準単位ごとに分けて求める。
+"""
+
+from sqlalchemy import and_, case, func, select
+
+import models
+
+
+def compare_many(db, product_ids, supermarket_ids=None):
+    """
+    商品ID -> 比較結果 の辞書を返す（価格のない商品は含まない）
+
+    比較結果は /prices/compare/{product_id} と同じ "product", "prices"（基準単位ごとに安い順）に、
+    基準単位ごとの "count", "min_price", "median_price", "max_price", "cheapest" のリスト
+    "by_base_unit"（件数の多い順）を加えたもの。最上位の "base_unit", "min_price", "median_price",
+    "max_price", "cheapest" は件数の最も多い基準単位のもの。
+    supermarket_ids を指定するとその店舗の価格だけで比較する。
+    """
+    latest = models.LatestPrice
+    conditions = [latest.product_id.in_(product_ids)]
+    if supermarket_ids is not None:
+        conditions.append(latest.supermarket_id.in_(supermarket_ids))
+
+    # 商品×基準単位ごとに安い順の順位と件数を付ける
+    partition = (latest.product_id, latest.base_unit)
+    ranked = (
+        select(
+            latest.product_id,
+            latest.supermarket_id,
+            latest.price,
+            latest.unit,
+            latest.price_per_base_unit,
+            latest.base_unit,
+            latest.recorded_at,
+            func.row_number().over(
+                partition_by=partition, order_by=(latest.price_per_base_unit, latest.supermarket_id)
+            ).label("rank"),
+            func.count().over(partition_by=partition).label("count"),
+        )
+        .where(and_(*conditions))
+        .cte("ranked")
+    )
+
+    # 中央値は件数が奇数なら中央の1件、偶数なら中央の2件の平均（2*順位 が 件数〜件数+2 の行）
+    stats = (
+        select(
+            ranked.c.product_id,
+            ranked.c.base_unit,
+            func.min(ranked.c.price_per_base_unit).label("min_price"),
+            func.max(ranked.c.price_per_base_unit).label("max_price"),
+            func.avg(
+                case(
+                    (and_(ranked.c.rank * 2 >= ranked.c.count, ranked.c.rank * 2 <= ranked.c.count + 2),
+                     ranked.c.price_per_base_unit),
+                )
+            ).label("median_price"),
+        )
+        .group_by(ranked.c.product_id, ranked.c.base_unit)
+        .subquery("stats")
+    )
+
+    query = (
+        select(
+            ranked.c.product_id,
+            models.Product.name,
+            models.Supermarket.id,
+            models.Supermarket.name,
+            models.Supermarket.address,
+            ranked.c.price,
+            ranked.c.unit,
+            ranked.c.price_per_base_unit,
+            ranked.c.base_unit,
+            ranked.c.recorded_at,
+            ranked.c.rank,
+            ranked.c.count,
+            stats.c.min_price,
+            stats.c.median_price,
+            stats.c.max_price,
+        )
+        .select_from(ranked)
+        .join(stats, and_(
+            stats.c.product_id == ranked.c.product_id,
+            # 埋め戻し前の価格は基準単位がNULLなので、NULL同士も同じ組にする
+            stats.c.base_unit.is_not_distinct_from(ranked.c.base_unit),
+        ))
+        .join(models.Product, models.Product.id == ranked.c.product_id)
+        .join(models.Supermarket, models.Supermarket.id == ranked.c.supermarket_id)
+        .order_by(ranked.c.product_id, ranked.c.base_unit, ranked.c.rank)
+    )
+
+    results = {}
+    for (product_id, product_name, supermarket_id, supermarket_name, address, price, unit, price_per_base_unit,
+         base_unit, recorded_at, rank, count, min_price, median_price, max_price) in db.execute(query):
+        result = results.get(product_id)
+        if result is None:
+            result = results[product_id] = {
+                "product_id": product_id,
+                "product": product_name,
+                "prices": [],
+                "by_base_unit": [],
+            }
+        entry = {
+            "supermarket": supermarket_name,
+            "address": address,
+            "price": price,
+            "unit": unit,
+            "price_per_base_unit": price_per_base_unit,
+            "base_unit": base_unit,
+            "recorded_at": recorded_at,
+        }
+        if rank == 1:
+            result["by_base_unit"].append({
+                "base_unit": base_unit,
+                "count": count,
+                "min_price": min_price,
+                "median_price": median_price,
+                "max_price": max_price,
+                "cheapest": dict(entry, supermarket_id=supermarket_id),
+            })
+        result["prices"].append(entry)
+
+    for result in results.values():
+        result["by_base_unit"].sort(key=lambda stats: (-stats["count"], stats["base_unit"] or ""))
+        primary = result["by_base_unit"][0]
+        for name in ("base_unit", "min_price", "median_price", "max_price", "cheapest"):
+            result[name] = primary[name]
+    return results
@@ -0,0 +1,212 @@
+"""
+価格履歴の集計テーブル（models.PriceRollup）の更新と再構築
+
+価格を日・週（月曜始まり）・月ごとに集計し、件数・合計・最安・最高を保持する。
+単位の違う価格を混ぜないよう、基準単位ごとに基準単位あたりの価格（units.normalize）で集計する。
+店舗をまとめた集計は supermarket_id=ALL_STORES の行に持つ。
+"""
+
+from datetime import date, timedelta
+
+from sqlalchemy import Date, bindparam, case, cast, delete, func, literal, select
+
+import latest_prices
+import models
+import units
+
+BUCKETS = ("day", "week", "month")
+
+# 全店舗をまとめた集計行の supermarket_id
+ALL_STORES = 0
+
+# IN句に渡すキー数の上限（5列のキーなのでSQLiteのパラメータ数上限に合わせて小さめ）
+_CHUNK_SIZE = 150
+
+_KEY_NAMES = ("product_id", "supermarket_id", "bucket", "base_unit", "bucket_start")
+
+# 再構築時に一度に読む価格の件数
+_REBUILD_BATCH_SIZE = 10000
+
+
+def bucket_start(bucket, recorded_at):
+    """recorded_at を含む期間の開始日を返す"""
+    day = recorded_at.date() if hasattr(recorded_at, "date") else recorded_at
+    if bucket == "day":
+        return day
+    if bucket == "week":
+        return day - timedelta(days=day.weekday())
+    if bucket == "month":
+        return date(day.year, day.month, 1)
+    raise ValueError(f"未対応の集計単位です: {bucket}")
+
+
+def aggregate(prices):
+    """
+    価格を集計キーごとにまとめる
+
+    pricesは product_id, supermarket_id, price, unit, price_per_base_unit, base_unit, recorded_at を持つ
+    オブジェクトの並び。キーは (product_id, supermarket_id, bucket, base_unit, bucket_start)、
+    値は基準単位あたりの価格の [件数, 合計, 最安, 最高]。
+    """
+    totals = {}
+    for price in prices:
+        value, base_unit = units.normalized(price)
+        for bucket in BUCKETS:
+            start = bucket_start(bucket, price.recorded_at)
+            for supermarket_id in (price.supermarket_id, ALL_STORES):
+                key = (price.product_id, supermarket_id, bucket, base_unit, start)
+                total = totals.get(key)
+                if total is None:
+                    totals[key] = [1, value, value, value]
+                else:
+                    total[0] += 1
+                    total[1] += value
+                    total[2] = min(total[2], value)
+                    total[3] = max(total[3], value)
+    return totals
+
+
+def apply_prices(db, prices):
+    """
+    新しく登録した価格を集計テーブルに加える
+
+    pricesは aggregate と同じ。登録と同じトランザクションで呼び、コミットは呼び出し側で行う。
+    """
+    totals = aggregate(prices)
+    if not totals:
+        return
+
+    table = models.PriceRollup.__table__
+    key_columns = tuple(table.c[name] for name in _KEY_NAMES)
+    keys = list(totals)
+    existing = set()
+    for i in range(0, len(keys), _CHUNK_SIZE):
+        chunk = keys[i:i + _CHUNK_SIZE]
+        condition = latest_prices.keys_condition(key_columns, len(chunk))
+        existing.update(tuple(row) for row in db.execute(select(*key_columns).where(condition), latest_prices.keys_params(chunk)))
+
+    new_rows = []
+    updates = []
+    for key, (count, total, min_price, max_price) in totals.items():
+        values = {"count": count, "total": total, "min_price": min_price, "max_price": max_price}
+        if key in existing:
+            updates.append(dict({"k_" + name: value for name, value in zip(_KEY_NAMES, key)}, **{
+                "d_" + name: value for name, value in values.items()
+            }))
+        else:
+            new_rows.append(dict(zip(_KEY_NAMES, key), **values))
+
+    if new_rows:
+        db.execute(table.insert(), new_rows)
+    if updates:
+        # 読んだ値に足して書き戻すと同時に登録された分が失われるため、UPDATE文の中で加算する
+        db.execute(
+            table.update()
+            .where(table.c.product_id == bindparam("k_product_id"))
+            .where(table.c.supermarket_id == bindparam("k_supermarket_id"))
+            .where(table.c.bucket == bindparam("k_bucket"))
+            .where(table.c.base_unit == bindparam("k_base_unit"))
+            .where(table.c.bucket_start == bindparam("k_bucket_start"))
+            .values(
+                count=table.c.count + bindparam("d_count"),
+                total=table.c.total + bindparam("d_total"),
+                min_price=case((table.c.min_price > bindparam("d_min_price"), bindparam("d_min_price")),
+                               else_=table.c.min_price),
+                max_price=case((table.c.max_price < bindparam("d_max_price"), bindparam("d_max_price")),
+                               else_=table.c.max_price),
+            ),
+            updates,
+        )
+
+
+def rebuild(db):
+    """pricesの全履歴から集計テーブルを作り直す（コミットは呼び出し側）"""
+    table = models.PriceRollup.__table__
+    db.execute(delete(table))
+
+    price = models.Price
+    dialect = db.get_bind().dialect.name
+    # 基準単位あたりの価格が埋まっていない価格（埋め戻し前）があるときは、換算しながらPythonで集計する
+    not_backfilled = db.execute(select(price.id).where(price.price_per_base_unit.is_(None)).limit(1)).first()
+    if dialect not in ("sqlite", "postgresql") or not_backfilled is not None:
+        _rebuild_in_python(db)
+        return
+
+    value = price.price_per_base_unit
+    for bucket in BUCKETS:
+        start = _bucket_expression(dialect, bucket, price.recorded_at)
+        for supermarket_id in (price.supermarket_id, literal(ALL_STORES)):
+            db.execute(table.insert().from_select(
+                [*_KEY_NAMES, "count", "total", "min_price", "max_price"],
+                select(
+                    price.product_id, supermarket_id, literal(bucket), price.base_unit, start,
+                    func.count(), func.sum(value), func.min(value), func.max(value),
+                ).group_by(price.product_id, supermarket_id, price.base_unit, start),
+            ))
+
+
+def _bucket_expression(dialect, bucket, column):
+    """期間の開始日を求めるSQL式（bucket_start と同じ結果になるもの）"""
+    if dialect == "sqlite":
+        modifiers = {"day": (), "week": ("weekday 0", "-6 days"), "month": ("start of month",)}[bucket]
+        return func.date(column, *modifiers)
+    # PostgreSQLの週は月曜始まり
+    return cast(func.date_trunc(bucket, column), Date)
+
+
+def _rebuild_in_python(db):
+    # 期間の計算をSQLで書けないデータベースでは、商品ごとに読んで集計する
+    price = models.Price
+    rows = db.execute(
+        select(price.product_id, price.supermarket_id, price.price, price.unit, price.price_per_base_unit,
+               price.base_unit, price.recorded_at)
+        .order_by(price.product_id)
+        .execution_options(yield_per=_REBUILD_BATCH_SIZE)
+    )
+    product_id = None
+    prices = []
+    for row in rows:
+        if row.product_id != product_id and prices:
+            _insert_totals(db, aggregate(prices))
+            prices = []
+        product_id = row.product_id
+        prices.append(row)
+    _insert_totals(db, aggregate(prices))
+
+
+def _insert_totals(db, totals):
+    if not totals:
+        return
+    db.execute(models.PriceRollup.__table__.insert(), [
+        dict(zip(_KEY_NAMES, key), count=count, total=total, min_price=min_price, max_price=max_price)
+        for key, (count, total, min_price, max_price) in totals.items()
+    ])
+
+
+def get_history(db, product_id, bucket, supermarket_id=None, start=None, end=None):
+    """
+    商品の価格推移を基準単位ごとに期間の古い順に返す（価格は基準単位あたり）
+
+    supermarket_id を省略すると全店舗をまとめた集計を返す。start/end は期間の開始日で絞り込む。
+    """
+    rollup = models.PriceRollup
+    query = db.query(rollup).filter(
+        rollup.product_id == product_id,
+        rollup.supermarket_id == (ALL_STORES if supermarket_id is None else supermarket_id),
+        rollup.bucket == bucket,
+    )
+    if start is not None:
+        query = query.filter(rollup.bucket_start >= bucket_start(bucket, start))
+    if end is not None:
+        query = query.filter(rollup.bucket_start <= end)
+    return [
+        {
+            "bucket_start": row.bucket_start,
+            "base_unit": row.base_unit,
+            "min_price": row.min_price,
+            "avg_price": row.total / row.count,
+            "max_price": row.max_price,
+            "count": row.count,
+        }
+        for row in query.order_by(rollup.base_unit, rollup.bucket_start)
+    ]
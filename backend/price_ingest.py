@@ -0,0 +1,155 @@
+"""
+価格データの登録処理
+
+単体登録（POST /prices/）と一括登録（POST /prices/bulk）で共通の処理をまとめる。
+価格から導出するテーブルの更新は on_prices_inserted に集約する。
+"""
+
+from datetime import datetime
+
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
+
+import cache
+import latest_prices
+import models
+import price_alerts
+import price_history
+import price_stats
+
+# 1回のコミットで登録する件数
+CHUNK_SIZE = 1000
+
+# IN句に渡すIDの数の上限（SQLiteのパラメータ数上限対策）
+_ID_CHUNK_SIZE = 500
+
+
+def on_prices_inserted(db, prices):
+    """
+    価格を登録した直後に、価格から導出するテーブルを同じトランザクションで更新する
+
+    pricesは id, product_id, supermarket_id, price, unit, price_per_base_unit, base_unit,
+    recorded_by, recorded_at を持つオブジェクト（Priceや結果行）の並び。
+    最新価格より安くなった価格は、お気に入りに登録しているユーザーへの通知にする。
+    """
+    replaced = latest_prices.apply_prices(db, prices)
+    price_history.apply_prices(db, prices)
+    price_stats.apply_prices(db, prices)
+    price_alerts.record_drops(db, replaced)
+    product_ids = {price.product_id for price in prices}
+    cache.invalidate_on_commit(db, {f"compare:{product_id}" for product_id in product_ids})
+    cache.invalidate_on_commit(db, {f"history:{product_id}" for product_id in product_ids})
+
+
+def existing_ids(db, column, ids):
+    """ids のうちテーブルに存在するIDの集合を返す（テーブルごとにIN句1回、分割あり）"""
+    ids = sorted(set(ids))
+    found = set()
+    for i in range(0, len(ids), _ID_CHUNK_SIZE):
+        chunk = ids[i:i + _ID_CHUNK_SIZE]
+        found.update(row[0] for row in db.query(column).filter(column.in_(chunk)))
+    return found
+
+
+def insert_prices(db, rows):
+    """
+    価格をまとめてINSERTし、登録した行（id付き）を返す（コミットは呼び出し側）
+
+    rowsは models.Price の列名をキーにした辞書のリスト。
+    """
+    if not rows:
+        return []
+    recorded_at = datetime.utcnow()
+    for row in rows:
+        row.setdefault("recorded_at", recorded_at)
+    inserted = db.execute(
+        insert(models.Price).returning(
+            models.Price.id,
+            models.Price.product_id,
+            models.Price.supermarket_id,
+            models.Price.price,
+            models.Price.unit,
+            models.Price.price_per_base_unit,
+            models.Price.base_unit,
+            models.Price.recorded_by,
+            models.Price.recorded_at,
+            sort_by_parameter_order=True,
+        ),
+        rows,
+    ).all()
+    on_prices_inserted(db, inserted)
+    return inserted
+
+
+class BulkIngest:
+    """
+    一括登録の受け付け
+
+    add で1件ずつ受け取って検証し、ready になったら（CHUNK_SIZE件たまったら）
+    flush で参照先の存在確認・INSERT・コミットを行う。add はDBに触れないので
+    イベントループ上で呼び、flush はスレッドプールで呼ぶ。
+    失敗した行は errors に記録し、他の行の登録は続ける。
+    """
+
+    def __init__(self, db, schema):
+        self.db = db
+        self.schema = schema
+        self.received = 0
+        self.inserted = 0
+        self.errors = []
+        self._pending = []
+
+    def add(self, item):
+        index = self.received
+        self.received += 1
+        if not isinstance(item, dict):
+            self.errors.append({"index": index, "detail": "オブジェクトではありません"})
+            return
+        try:
+            price = self.schema(**item)
+        except ValidationError as e:
+            self.errors.append({"index": index, "detail": e.errors(include_url=False)})
+            return
+        self._pending.append((index, price))
+
+    @property
+    def ready(self):
+        return len(self._pending) >= CHUNK_SIZE
+
+    def add_error(self, detail):
+        """JSONとして解釈できなかった行などを記録する"""
+        self.errors.append({"index": self.received, "detail": detail})
+        self.received += 1
+
+    def flush(self):
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+
+        product_ids = existing_ids(self.db, models.Product.id, (p.product_id for _, p in pending))
+        supermarket_ids = existing_ids(self.db, models.Supermarket.id, (p.supermarket_id for _, p in pending))
+
+        rows = []
+        indexes = []
+        for index, price in pending:
+            if price.product_id not in product_ids:
+                self.errors.append({"index": index, "detail": "商品が見つかりません"})
+            elif price.supermarket_id not in supermarket_ids:
+                self.errors.append({"index": index, "detail": "スーパーマーケットが見つかりません"})
+            else:
+                rows.append(price.dict())
+                indexes.append(index)
+
+        try:
+            insert_prices(self.db, rows)
+            self.db.commit()
+        except SQLAlchemyError:
+            self.db.rollback()
+            self.errors.extend({"index": index, "detail": "登録に失敗しました"} for index in indexes)
+            return
+        self.inserted += len(rows)
+
+    def result(self):
+        self.errors.sort(key=lambda error: error["index"])
+        return {"received": self.received, "inserted": self.inserted, "errors": self.errors}
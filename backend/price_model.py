@@ -0,0 +1,78 @@
+"""
+ダミー価格の価格モデル
+
+商品ごとの基本価格と、店舗のチェーンごとの価格調整係数を定義する。
+add_dummy_data.py と generate_data.py で共用する。
+"""
+
+# 基本価格（円）
+BASE_PRICES = {
+    "卵": 200,
+    "牛乳": 180,
+    "食パン": 150,
+    "米": 400,  # 1kg当たり
+    "鶏肉": 300,  # 100g当たり
+    "豚肉": 350,  # 100g当たり
+    "玉ねぎ": 250,  # 1袋
+    "じゃがいも": 300,  # 1袋
+    "バナナ": 150,
+    "キャベツ": 200,
+    "人参": 180,
+    "りんご": 400
+}
+
+# 基本価格が定義されていない商品の価格
+DEFAULT_BASE_PRICE = 200
+
+# ドンキホーテで価格が普通の日用品
+DAILY_GOODS = ["卵", "牛乳", "食パン"]
+
+# 店舗名に含まれるチェーン名 -> (日用品の係数, その他の係数)。係数は (最小, 最大)
+CHAIN_FACTORS = {
+    # 業務スーパー：安め、大容量
+    "業務スーパー": ((0.7, 0.9), (0.7, 0.9)),
+    # ビッグエー：安め、ディスカウント
+    "ビッグ・エー": ((0.75, 0.92), (0.75, 0.92)),
+    # ドンキ：商品によってバラつき（日用品は普通、その他はバラつき大）
+    "ドンキホーテ": ((0.8, 1.1), (0.85, 1.3)),
+    # イオン：中程度、PB商品あり
+    "イオン": ((0.85, 1.05), (0.85, 1.05)),
+    # 西友：安め〜中程度
+    "西友": ((0.8, 1.0), (0.8, 1.0)),
+    # ライフ：中程度、品質重視
+    "ライフ": ((0.9, 1.15), (0.9, 1.15)),
+    # まいばすけっと：中程度、便利性重視
+    "まいばすけっと": ((0.88, 1.08), (0.88, 1.08)),
+}
+
+# どのチェーンにも当たらない店舗の係数
+DEFAULT_FACTORS = (0.9, 1.1)
+
+
+def chain_of(supermarket_name):
+    """店舗名からチェーン名を返す（CHAIN_FACTORSにないチェーンはNone）"""
+    for chain in CHAIN_FACTORS:
+        if chain in supermarket_name:
+            return chain
+    return None
+
+
+def price_factors(supermarket_name, product_name):
+    """店舗と商品に対する価格調整係数 (最小, 最大) を返す"""
+    chain = chain_of(supermarket_name)
+    if chain is None:
+        return DEFAULT_FACTORS
+    daily, others = CHAIN_FACTORS[chain]
+    return daily if product_name in DAILY_GOODS else others
+
+
+def get_price_range(supermarket_name, product_name, base_price=None):
+    """店舗と商品の特徴に基づいて価格範囲を返す"""
+    if base_price is None:
+        base_price = BASE_PRICES.get(product_name, DEFAULT_BASE_PRICE)
+    min_factor, max_factor = price_factors(supermarket_name, product_name)
+
+    min_price = int(base_price * min_factor)
+    max_price = int(base_price * max_factor)
+
+    return min_price, max_price
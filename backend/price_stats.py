@@ -0,0 +1,306 @@
+"""
+地域ごとの価格の分布（「この辺りでこの値段は安いか」）
+
+店舗の緯度・経度を CELL_DEGREES 度のセルに区切り、商品×セル×基準単位×月ごとに
+基準単位あたりの価格の分布をスケッチ（Sketch）で持つ（models.RegionalPriceStat）。
+スケッチは足し合わせられるので、価格の登録時はその分を加え、問い合わせでは
+指定した地点の周りのセルと直近の月を足し合わせて最安・四分位・中央値・最高を求める。
+pricesは読まない。
+
+スケッチは値を対数の幅（相対誤差 RELATIVE_ACCURACY）のバケットに数える方式（DDSketch）。
+分位点の相対誤差は RELATIVE_ACCURACY 以内、最安・最高・件数は正確な値になる。
+"""
+
+import math
+import struct
+from collections import defaultdict
+from datetime import date
+
+from sqlalchemy import bindparam, delete, select
+
+import geo
+import latest_prices
+import models
+import price_history
+import units
+
+# セルの大きさ（度）。緯度方向で約5.5km
+CELL_DEGREES = 0.05
+
+# 分位点の相対誤差
+RELATIVE_ACCURACY = 0.005
+
+QUANTILES = (("p25", 0.25), ("median", 0.5), ("p75", 0.75))
+
+# IN句に渡すIDの数の上限（SQLiteのパラメータ数上限対策）
+_ID_CHUNK_SIZE = 500
+
+# 一度に読むキーの数（5列のキーなのでSQLiteのパラメータ数上限に合わせて小さめ）
+_CHUNK_SIZE = 150
+
+# 再構築時に一度に読む価格の件数
+_REBUILD_BATCH_SIZE = 10000
+
+_GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+_HEADER = struct.Struct("<II")   # 0以下の値の件数, バケット数
+
+
+class Sketch:
+    """
+    値の分布のスケッチ
+
+    値 x (> 0) はバケット ceil(log_γ x) に数える（γ = (1+α)/(1-α)、α は相対誤差）。
+    バケットの件数を足すだけで2つのスケッチを合わせられる。
+    """
+
+    __slots__ = ("buckets", "zero_count", "count", "min", "max")
+
+    def __init__(self, buckets=None, zero_count=0, count=0, minimum=math.inf, maximum=-math.inf):
+        self.buckets = buckets if buckets is not None else {}
+        self.zero_count = zero_count
+        self.count = count
+        self.min = minimum
+        self.max = maximum
+
+    def add(self, value):
+        if not math.isfinite(value):
+            # inf・NaNはバケットに数えられず、最安・最高も壊れるので数えない
+            return
+        if value > 0:
+            key = math.ceil(math.log(value) / _LOG_GAMMA)
+            self.buckets[key] = self.buckets.get(key, 0) + 1
+        else:
+            self.zero_count += 1
+        self.count += 1
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        """other を足し込む"""
+        buckets = self.buckets
+        for key, count in other.buckets.items():
+            buckets[key] = buckets.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q):
+        """q分位点（0 <= q <= 1）。空のときは None"""
+        if self.count == 0:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return self.min
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                # バケット (γ^(k-1), γ^k] の中で相対誤差が最小になる値
+                value = 2 * _GAMMA ** key / (_GAMMA + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def to_bytes(self):
+        keys = sorted(self.buckets)
+        return _HEADER.pack(self.zero_count, len(keys)) + struct.pack(
+            f"<{len(keys)}i{len(keys)}I", *keys, *(self.buckets[key] for key in keys)
+        )
+
+    @classmethod
+    def from_row(cls, count, min_price, max_price, data):
+        """RegionalPriceStat の count, min_price, max_price, sketch から作る"""
+        zero_count, size = _HEADER.unpack_from(data)
+        values = struct.unpack_from(f"<{size}i{size}I", data, _HEADER.size)
+        return cls(dict(zip(values[:size], values[size:])), zero_count, count, min_price, max_price)
+
+
+def cell_of(latitude, longitude):
+    return math.floor(latitude / CELL_DEGREES), math.floor(longitude / CELL_DEGREES)
+
+
+def aggregate(items):
+    """
+    価格をキーごとのスケッチにまとめる
+
+    itemsは (product_id, latitude, longitude, recorded_at, price_per_base_unit, base_unit) の並び。
+    キーは (product_id, cell_lat, cell_lon, base_unit, period_start)。
+    """
+    sketches = defaultdict(Sketch)
+    for product_id, latitude, longitude, recorded_at, price_per_base_unit, base_unit in items:
+        cell_lat, cell_lon = cell_of(latitude, longitude)
+        period_start = price_history.bucket_start("month", recorded_at)
+        sketches[(product_id, cell_lat, cell_lon, base_unit, period_start)].add(price_per_base_unit)
+    return sketches
+
+
+def apply_prices(db, prices):
+    """
+    新しく登録した価格をスケッチに加える
+
+    pricesは product_id, supermarket_id, price, unit, price_per_base_unit, base_unit, recorded_at を持つ
+    オブジェクトの並び。登録と同じトランザクションで呼び、コミットは呼び出し側で行う。
+    """
+    if not prices:
+        return
+    supermarket = models.Supermarket
+    store_ids = sorted({price.supermarket_id for price in prices})
+    locations = {}
+    for i in range(0, len(store_ids), _ID_CHUNK_SIZE):
+        rows = db.execute(
+            select(supermarket.id, supermarket.latitude, supermarket.longitude)
+            .where(supermarket.id.in_(store_ids[i:i + _ID_CHUNK_SIZE]))
+        )
+        locations.update((id, (latitude, longitude)) for id, latitude, longitude in rows)
+
+    items = []
+    for price in prices:
+        location = locations.get(price.supermarket_id)
+        if location is not None:
+            items.append((price.product_id, *location, price.recorded_at, *units.normalized(price)))
+    sketches = aggregate(items)
+    if not sketches:
+        return
+
+    table = models.RegionalPriceStat.__table__
+    key_columns = (table.c.product_id, table.c.cell_lat, table.c.cell_lon, table.c.base_unit, table.c.period_start)
+    keys = list(sketches)
+    existing = set()
+    for i in range(0, len(keys), _CHUNK_SIZE):
+        chunk = keys[i:i + _CHUNK_SIZE]
+        # スケッチの足し算はSQLで書けないので読んで書き戻す。同時に登録された分が失われないよう行をロックする
+        # （SQLiteでは価格のINSERTで書き込みロックを取っているので、ここから先は他の登録と重ならない）
+        rows = db.execute(
+            select(*key_columns, table.c.count, table.c.min_price, table.c.max_price, table.c.sketch)
+            .where(latest_prices.keys_condition(key_columns, len(chunk)))
+            .with_for_update(),
+            latest_prices.keys_params(chunk),
+        )
+        for row in rows:
+            key = tuple(row[:5])
+            sketches[key].merge(Sketch.from_row(*row[5:]))
+            existing.add(key)
+
+    key_names = ("product_id", "cell_lat", "cell_lon", "base_unit", "period_start")
+    new_rows = []
+    updates = []
+    for key, sketch in sketches.items():
+        values = {"count": sketch.count, "min_price": sketch.min, "max_price": sketch.max, "sketch": sketch.to_bytes()}
+        if key in existing:
+            updates.append(dict({"k_" + name: value for name, value in zip(key_names, key)}, **values))
+        else:
+            new_rows.append(dict(zip(key_names, key), **values))
+
+    if new_rows:
+        db.execute(table.insert(), new_rows)
+    if updates:
+        db.execute(
+            table.update()
+            .where(table.c.product_id == bindparam("k_product_id"))
+            .where(table.c.cell_lat == bindparam("k_cell_lat"))
+            .where(table.c.cell_lon == bindparam("k_cell_lon"))
+            .where(table.c.base_unit == bindparam("k_base_unit"))
+            .where(table.c.period_start == bindparam("k_period_start")),
+            updates,
+        )
+
+
+def rebuild(db):
+    """pricesの全履歴からスケッチを作り直す（コミットは呼び出し側）"""
+    table = models.RegionalPriceStat.__table__
+    db.execute(delete(table))
+
+    price = models.Price
+    supermarket = models.Supermarket
+    # ORMの行を作らないよう接続で直接読む
+    rows = db.connection().execute(
+        select(
+            price.product_id, supermarket.latitude, supermarket.longitude, price.recorded_at,
+            price.price, price.unit, price.price_per_base_unit, price.base_unit,
+        )
+        .join(supermarket, supermarket.id == price.supermarket_id)
+        .order_by(price.product_id)
+        .execution_options(yield_per=_REBUILD_BATCH_SIZE)
+    )
+    # 商品ごとにスケッチを作る（メモリに載せるのは1商品分だけ）。書き込みは複数商品分をまとめて行う
+    product_id = None
+    items = []
+    pending = []
+    for row in rows:
+        if row.product_id != product_id and items:
+            pending.extend(_stat_rows(aggregate(items)))
+            items = []
+            if len(pending) >= _REBUILD_BATCH_SIZE:
+                db.execute(table.insert(), pending)
+                pending = []
+        product_id = row.product_id
+        items.append((row.product_id, row.latitude, row.longitude, row.recorded_at, *units.normalized(row)))
+    pending.extend(_stat_rows(aggregate(items)))
+    if pending:
+        db.execute(table.insert(), pending)
+
+
+def _stat_rows(sketches):
+    return [
+        {
+            "product_id": product_id, "cell_lat": cell_lat, "cell_lon": cell_lon, "base_unit": base_unit,
+            "period_start": period_start, "count": sketch.count, "min_price": sketch.min, "max_price": sketch.max,
+            "sketch": sketch.to_bytes(),
+        }
+        for (product_id, cell_lat, cell_lon, base_unit, period_start), sketch in sketches.items()
+    ]
+
+
+def months_ago(today, months):
+    """today を含む月から数えて months か月分の期間の最初の月の初日"""
+    index = today.year * 12 + today.month - 1 - (months - 1)
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def get_stats(db, product_id, latitude, longitude, radius_km, months, today=None):
+    """
+    地点から半径 radius_km の範囲にかかるセルの、直近 months か月の価格の分布を返す
+
+    基準単位ごとに件数の多い順。セル単位で足し合わせるので、範囲の境界付近のセルの
+    店舗（半径の外側、最大でセルの対角線分）も含まれる。
+    """
+    stat = models.RegionalPriceStat
+    since = months_ago(today or date.today(), months)
+    sketches = defaultdict(Sketch)
+    cells = set()
+    seen = set()
+    for lat_min, lat_max, lon_min, lon_max in geo.bounding_boxes(latitude, longitude, radius_km):
+        query = db.query(
+            stat.cell_lat, stat.cell_lon, stat.base_unit, stat.period_start,
+            stat.count, stat.min_price, stat.max_price, stat.sketch,
+        ).filter(
+            stat.product_id == product_id,
+            stat.cell_lat.between(math.floor(lat_min / CELL_DEGREES), math.floor(lat_max / CELL_DEGREES)),
+            stat.period_start >= since,
+        )
+        if lon_min is not None:
+            query = query.filter(
+                stat.cell_lon.between(math.floor(lon_min / CELL_DEGREES), math.floor(lon_max / CELL_DEGREES))
+            )
+        for cell_lat, cell_lon, base_unit, period_start, *values in query:
+            # 日付変更線で分けた範囲が同じセルを含む場合に二重に数えない
+            key = (cell_lat, cell_lon, base_unit, period_start)
+            if key in seen:
+                continue
+            seen.add(key)
+            cells.add((cell_lat, cell_lon))
+            sketches[base_unit].merge(Sketch.from_row(*values))
+
+    stats = []
+    for base_unit, sketch in sorted(sketches.items(), key=lambda item: (-item[1].count, item[0])):
+        entry = {"base_unit": base_unit, "count": sketch.count, "min": sketch.min}
+        for name, q in QUANTILES:
+            entry[name] = round(sketch.quantile(q), 2)
+        entry["max"] = sketch.max
+        stats.append(entry)
+    return {"cells": len(cells), "since": since, "stats": stats}
@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+最新価格テーブル（latest_prices）を価格履歴から作り直すスクリプト
+
+既存のデータベースに初めて導入するときや、pricesを直接書き換えたあとに実行する。
+"""
+
+import database
+import latest_prices
+import models
+
+models.create_schema(database.engine)
+
+db = database.SessionLocal()
+try:
+    latest_prices.rebuild(db)
+    db.commit()
+    count = db.query(models.LatestPrice).count()
+finally:
+    db.close()
+
+print("最新価格テーブルの再構築が完了しました！")
+print(f"商品×店舗: {count}件")
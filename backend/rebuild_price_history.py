@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+価格履歴の集計テーブル（unit_price_rollups）を価格履歴から作り直すスクリプト
+
+既存のデータベースに初めて導入するときや、pricesを直接書き換えたあとに実行する。
+"""
+
+import database
+import models
+import price_history
+
+models.create_schema(database.engine)
+
+db = database.SessionLocal()
+try:
+    price_history.rebuild(db)
+    db.commit()
+    count = db.query(models.PriceRollup).count()
+finally:
+    db.close()
+
+print("価格履歴の集計テーブルの再構築が完了しました！")
+print(f"集計行: {count}件")
@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+地域ごとの価格の分布（regional_price_stats）を価格履歴から作り直すスクリプト
+
+既存のデータベースに初めて導入するときや、pricesを直接書き換えたあと、
+price_stats.CELL_DEGREES（セルの大きさ）を変えたあとに実行する。
+"""
+
+import database
+import models
+import price_stats
+
+models.create_schema(database.engine)
+
+db = database.SessionLocal()
+try:
+    price_stats.rebuild(db)
+    db.commit()
+    count = db.query(models.RegionalPriceStat).count()
+finally:
+    db.close()
+
+print("地域ごとの価格の分布の再構築が完了しました！")
+print(f"商品×セル×月: {count}件")
@@ -0,0 +1,140 @@
+"""
+商品名の全文検索インデックス（SQLite FTS5 による n-gram 索引）
+
+日本語の商品名は空白で区切れないため、正規化した商品名を1文字（unigram）と
+2文字（bigram）に分解してFTS5に登録する。2文字以上の検索語は bigram の
+フレーズ検索、1文字の検索語は unigram の検索で、どちらも部分一致と同じ結果になる。
+FTS5が使えないデータベースではLIKEによる部分一致にフォールバックする。
+"""
+
+import unicodedata
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+import models
+
+FTS_TABLE = "products_fts"
+
+# 関連度順に並べるヒットの上限（これを超えるヒットはID順で打ち切る）。ページはこの中だけをたどる
+RANK_WINDOW = 1000
+
+_INSERT_BATCH = 1000
+
+
+def normalize(value: str) -> str:
+    """全角・半角や大文字・小文字の違いを吸収する"""
+    return unicodedata.normalize("NFKC", value).lower()
+
+
+def _token(gram: str) -> str:
+    # FTS5のトークナイザで分割されないよう英数字の並びに変換する
+    return "g" + gram.encode("utf-8").hex()
+
+
+def _grams(value: str, size: int):
+    return [_token(value[i:i + size]) for i in range(len(value) - size + 1)]
+
+
+def _document(name: str):
+    name = normalize(name)
+    return " ".join(_grams(name, 1)), " ".join(_grams(name, 2))
+
+
+def is_available(db) -> bool:
+    return db.get_bind().dialect.name == "sqlite"
+
+
+def create(engine):
+    """FTS5の仮想テーブルを作成し、未登録の商品を索引に追加する"""
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+            "USING fts5(unigrams, bigrams, content='')"
+        )
+    with Session(engine) as db:
+        sync(db)
+        db.commit()
+
+
+def add_products(db, products):
+    """商品を索引に追加する（商品の登録と同じトランザクションで呼ぶ）"""
+    if not is_available(db):
+        return
+    rows = []
+    for product in products:
+        unigrams, bigrams = _document(product.name)
+        rows.append({"rowid": product.id, "unigrams": unigrams, "bigrams": bigrams})
+    if rows:
+        db.execute(
+            text(f"INSERT INTO {FTS_TABLE} (rowid, unigrams, bigrams) VALUES (:rowid, :unigrams, :bigrams)"),
+            rows,
+        )
+
+
+def sync(db):
+    """
+    索引を商品テーブルに追いつかせる
+
+    商品は追加のみなので、索引済みの最大IDより後の商品だけを追加する。
+    商品テーブルが作り直されていた場合は索引を作り直す。
+    """
+    indexed_id = db.execute(
+        text(f"SELECT rowid FROM {FTS_TABLE} ORDER BY rowid DESC LIMIT 1")
+    ).scalar() or 0
+    latest_id = db.query(models.Product.id).order_by(models.Product.id.desc()).limit(1).scalar() or 0
+    if latest_id < indexed_id:
+        db.execute(text(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('delete-all')"))
+        indexed_id = 0
+
+    while True:
+        products = (
+            db.query(models.Product.id, models.Product.name)
+            .filter(models.Product.id > indexed_id)
+            .order_by(models.Product.id)
+            .limit(_INSERT_BATCH)
+            .all()
+        )
+        if not products:
+            break
+        add_products(db, products)
+        indexed_id = products[-1].id
+
+
+def rebuild(db):
+    """索引を全件作り直す（コミットは呼び出し側）"""
+    db.execute(text(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('delete-all')"))
+    sync(db)
+
+
+def search(db, q: str, limit: int, offset: int):
+    """
+    商品名にqを含む商品のIDを関連度順に返す
+
+    関連度（bm25）で並べるのはID順で先頭 RANK_WINDOW 件のヒットまでに限り、ヒット数が多い検索語でも
+    処理量が商品数に比例しないようにする。並べる範囲は offset によらず同じなので、ページをたどると
+    範囲内の各ヒットがちょうど1回ずつ返る。範囲を超える offset・limit は範囲の終わりまでに切り詰める。
+    """
+    q = normalize(q)
+    if not q:
+        return None
+    if len(q) == 1:
+        match = f"unigrams : {_token(q)}"
+    else:
+        match = 'bigrams : "' + " ".join(_grams(q, 2)) + '"'
+
+    offset = max(offset, 0)
+    limit = min(limit, RANK_WINDOW - offset)
+    if limit <= 0:
+        return []
+    rows = db.execute(
+        text(
+            f"SELECT rowid FROM ("
+            f"  SELECT rowid, rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match LIMIT :window"
+            f") ORDER BY rank, rowid LIMIT :limit OFFSET :offset"
+        ),
+        {"match": match, "window": RANK_WINDOW, "limit": limit, "offset": offset},
+    )
+    return [row[0] for row in rows]
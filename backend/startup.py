@@ -0,0 +1,116 @@
+"""
+起動処理（スキーマの作成・ワーカーのウォームアップ）と起動時間の計測
+
+AUTO_MIGRATE=1（既定）のときは main の読み込み時にテーブル・インデックス・全文検索の索引を
+作成する（開発用）。本番の起動（manage.py serve）では AUTO_MIGRATE=0 にし、スキーマの作成は
+manage.py migrate で一度だけ行う（ワーカーごとにDDLやスキーマの確認をしない）。
+
+ワーカーはリクエストを受け付ける前に warm_up で店舗の座標・地図のクラスタ・商品と店舗のID集合を
+読み込んでおく。起動からウォームアップの完了まで（cold start）と、最初のリクエストに
+応答するまでの時間を記録し、ログ・/metrics・GET /system/startup で確認できる。
+起動時刻はランチャーが SERVER_LAUNCHED_AT（UNIX時刻）で渡す。ない場合はこのプロセスの起動時刻。
+"""
+
+import logging
+import os
+import time
+
+import database
+import geo
+import metrics
+import models
+import search_index
+import viewport
+import write_queue
+
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "1") == "1"
+
+
+def _process_started_at():
+    """このプロセスの起動時刻（UNIX時刻）。/proc がない環境ではこのモジュールの読み込み時刻"""
+    try:
+        with open("/proc/self/stat") as stat:
+            # 22番目の項目が起動してからの時間（クロック刻み）。2番目のコマンド名は空白を含みうるので ")" の後から数える
+            start_ticks = int(stat.read().rsplit(")", 1)[1].split()[19])
+        elapsed = time.clock_gettime(time.CLOCK_BOOTTIME) - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return time.time()
+    return time.time() - elapsed
+
+
+LAUNCHED_AT = float(os.getenv("SERVER_LAUNCHED_AT") or _process_started_at())
+
+logger = logging.getLogger("supermarket.startup")
+
+
+class Timings:
+    """このワーカーの起動時間（秒、起動時刻から）"""
+
+    def __init__(self):
+        self.warm_up = None
+        self.ready = None
+        self.first_request = None
+
+    def as_dict(self):
+        return {
+            "pid": os.getpid(),
+            "auto_migrate": AUTO_MIGRATE,
+            "warm_up_seconds": self.warm_up,
+            "cold_start_seconds": self.ready,
+            "first_request_seconds": self.first_request,
+        }
+
+
+timings = Timings()
+
+metrics.register(metrics.Gauge(
+    "startup_cold_start_seconds", "起動からリクエストを受け付けられるようになるまでの時間",
+    lambda: timings.ready if timings.ready is not None else float("nan")))
+metrics.register(metrics.Gauge(
+    "startup_first_request_seconds", "起動から最初のリクエストに応答するまでの時間",
+    lambda: timings.first_request if timings.first_request is not None else float("nan")))
+
+
+def migrate(engine):
+    """テーブル・不足している列とインデックス・全文検索の索引を作成する"""
+    models.create_schema(engine)
+    search_index.create(engine)
+
+
+def warm_up():
+    """リクエストを受け付ける前に、メモリ上のインデックスとDBの接続を用意する"""
+    started = time.perf_counter()
+    db = database.SessionLocal()
+    try:
+        geo.get_store_index(db)
+        viewport.get_cluster_index(db)
+        if write_queue.WRITE_BEHIND:
+            write_queue.write_queue.product_ids.refresh(db)
+            write_queue.write_queue.supermarket_ids.refresh(db)
+    finally:
+        db.close()
+    timings.warm_up = time.perf_counter() - started
+    timings.ready = time.time() - LAUNCHED_AT
+    logger.info("ワーカー %d: 起動から%.2f秒で受け付け開始（ウォームアップ %.3f秒）",
+                os.getpid(), timings.ready, timings.warm_up)
+
+
+class FirstRequestTimer:
+    """最初のリクエストへの応答を送り終えた時刻を記録する（ASGIミドルウェア）"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or timings.first_request is not None:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_and_record(message):
+            await send(message)
+            if (message["type"] == "http.response.body" and not message.get("more_body")
+                    and timings.first_request is None):
+                timings.first_request = time.time() - LAUNCHED_AT
+                logger.info("ワーカー %d: 起動から%.2f秒で最初のリクエストに応答", os.getpid(), timings.first_request)
+
+        await self.app(scope, receive, send_and_record)
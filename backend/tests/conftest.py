@@ -0,0 +1,46 @@
+"""
+テスト共通の設定
+
+一時ディレクトリのSQLiteデータベースを使う。main は読み込み時にデータベースへ接続するので、
+環境変数はここで main を読み込む前に設定する。各テストは自分で作ったデータのIDで検証する。
+"""
+
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BACKEND_DIR)
+
+_data_dir = tempfile.mkdtemp(prefix="supermarket-test-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_data_dir, 'test.db')}"
+os.environ.setdefault("CACHE_URL", "memory")
+
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+import cache  # noqa: E402
+import database  # noqa: E402
+import main  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def db():
+    session = database.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.backend.clear()
+    yield
+    cache.backend.clear()
@@ -0,0 +1,23 @@
+import pytest
+
+import backfill_unit_prices
+import models
+import units
+
+
+@pytest.mark.parametrize("unit", ["個", "500g", "1.5L", "0g"])
+def test_backfill_matches_normalize(client, db, unit):
+    product = client.post("/products/", json={"name": f"埋め戻し{unit}", "category": "backfill"}).json()
+    supermarket = client.post("/supermarkets/", json={
+        "name": f"埋め戻し{unit}の店", "address": "東京都", "latitude": 35.0, "longitude": 139.0,
+    }).json()
+    # 列を追加する前の価格と同じく、基準単位あたりの価格を空にして直接投入する
+    price_id = db.execute(models.Price.__table__.insert().values(
+        product_id=product["id"], supermarket_id=supermarket["id"], price=298, unit=unit, recorded_by="test",
+        price_per_base_unit=None, base_unit=None,
+    )).inserted_primary_key[0]
+    db.commit()
+
+    backfill_unit_prices.backfill_prices(db, chunk_size=1000)
+    price = db.get(models.Price, price_id)
+    assert (price.price_per_base_unit, price.base_unit) == pytest.approx(units.normalize(298, unit))
@@ -0,0 +1,43 @@
+import pytest
+
+import basket
+
+
+def test_price_vectors_discard_load_invalidated_meanwhile(db):
+    vectors = basket.PriceVectors()
+    loads = []
+
+    def load_then_invalidate(session, product_ids):
+        loads.append(list(product_ids))
+        loaded = basket.PriceVectors._load(session, product_ids)
+        if len(loads) == 1:
+            # 読み込みの最中に価格が登録された
+            vectors.invalidate(product_ids)
+        return loaded
+
+    vectors._load = load_then_invalidate
+    vectors.get_many(db, [1, 2])
+    vectors.get_many(db, [1, 2])
+    vectors.get_many(db, [1, 2])
+    # 1回目の読み込みは保存されないので2回目に読み直し、その結果は保存される
+    assert loads == [[1, 2], [1, 2]]
+
+
+@pytest.mark.parametrize("override", [
+    {"max_stores": 0},
+    {"max_stores": 501},
+    {"radius": 0},
+    {"radius": 51},
+    {"distance_penalty": -1},
+    {"latitude": 91},
+    {"product_ids": list(range(1, 202))},
+])
+def test_optimize_rejects_out_of_range_values(client, override):
+    body = dict({"product_ids": [1], "latitude": 35.68, "longitude": 139.76}, **override)
+    assert client.post("/basket/optimize", json=body).status_code == 422
+
+
+def test_optimize_accepts_bounds(client):
+    body = {"product_ids": list(range(1, 201)), "latitude": 35.68, "longitude": 139.76,
+            "radius": 50, "distance_penalty": 0, "max_stores": 500}
+    assert client.post("/basket/optimize", json=body).status_code == 200
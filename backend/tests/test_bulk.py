@@ -0,0 +1,22 @@
+import json
+
+
+def test_ndjson_lines_split_across_chunks(client):
+    product = client.post("/products/", json={"name": "NDJSON確認", "category": "ndjson"}).json()
+    supermarket = client.post("/supermarkets/", json={
+        "name": "NDJSON確認の店", "address": "東京都", "latitude": 35.0, "longitude": 139.0,
+    }).json()
+    def row(price):
+        return json.dumps({"product_id": product["id"], "supermarket_id": supermarket["id"], "price": price,
+                           "recorded_by": "test"})
+
+    body = "\n".join([row(100), "{壊れた行", "", row(120) + "  ", row(90)]).encode()
+
+    def chunks():
+        # 行の途中で区切れる細かいチャンクで送る
+        for i in range(0, len(body), 7):
+            yield body[i:i + 7]
+
+    result = client.post("/prices/bulk", content=chunks(), headers={"content-type": "application/x-ndjson"}).json()
+    assert result["inserted"] == 3
+    assert [error["index"] for error in result["errors"]] == [1]
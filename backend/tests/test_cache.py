@@ -0,0 +1,28 @@
+from starlette.requests import Request
+
+import cache
+
+
+def make_request(path, query_string):
+    return Request({"type": "http", "method": "GET", "path": path, "query_string": query_string, "headers": []})
+
+
+def test_cache_key_distinguishes_encoded_separators():
+    # デコードすると同じ文字列になる2つのクエリ
+    injected = make_request("/products/", b"category=foo%26limit%3D1")
+    legitimate = make_request("/products/", b"category=foo&limit=1")
+    assert cache.cache_key(injected) != cache.cache_key(legitimate)
+
+
+def test_cache_key_ignores_parameter_order():
+    assert cache.cache_key(make_request("/products/", b"a=1&b=2")) == cache.cache_key(make_request("/products/", b"b=2&a=1"))
+
+
+def test_encoded_query_does_not_poison_other_entry(client):
+    for name in ("キャッシュ確認A", "キャッシュ確認B"):
+        client.post("/products/", json={"name": name, "category": "cachekey"})
+
+    injected = client.get("/products/", params={"category": "cachekey&limit=1"})
+    assert injected.json() == []
+    legitimate = client.get("/products/", params={"category": "cachekey", "limit": 1})
+    assert [product["name"] for product in legitimate.json()] == ["キャッシュ確認A"]
@@ -0,0 +1,36 @@
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# 別のスレッドで作ったテーブル・行が、他のスレッドから見えること
+IN_MEMORY_SCRIPT = """
+import threading
+import database
+import models
+
+models.create_schema(database.engine)
+
+def insert():
+    db = database.SessionLocal()
+    db.add(models.Product(name="インメモリ確認", category="memory"))
+    db.commit()
+    db.close()
+
+thread = threading.Thread(target=insert)
+thread.start()
+thread.join()
+db = database.SessionLocal()
+print(db.query(models.Product).filter(models.Product.category == "memory").count())
+"""
+
+
+def test_in_memory_database_is_shared_across_threads():
+    # database は読み込み時にURLを決めるので、別のプロセスで確認する
+    result = subprocess.run(
+        [sys.executable, "-c", IN_MEMORY_SCRIPT], cwd=BACKEND_DIR, capture_output=True, text=True,
+        env=dict(os.environ, DATABASE_URL="sqlite://"),
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "1"
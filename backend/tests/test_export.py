@@ -0,0 +1,28 @@
+import csv
+import io
+import json
+
+
+def create_price(client, unit):
+    product = client.post("/products/", json={"name": f"書き出し{unit}", "category": "export"}).json()
+    supermarket = client.post("/supermarkets/", json={
+        "name": f"書き出し{unit}の店", "address": "東京都", "latitude": 35.0, "longitude": 139.0,
+    }).json()
+    return client.post("/prices/", json={"product_id": product["id"], "supermarket_id": supermarket["id"],
+                                         "price": 298, "unit": unit, "recorded_by": "test"}).json()
+
+
+def test_csv_export_includes_normalized_price(client):
+    price = create_price(client, "500g")
+    response = client.get("/export/prices", params={"format": "csv"})
+    assert response.status_code == 200
+    rows = {row["id"]: row for row in csv.DictReader(io.StringIO(response.text))}
+    row = rows[str(price["id"])]
+    assert (row["unit"], float(row["price_per_base_unit"]), row["base_unit"]) == ("500g", 59.6, "100g")
+
+
+def test_ndjson_export_includes_normalized_price(client):
+    price = create_price(client, "2個")
+    response = client.get("/export/prices", params={"format": "ndjson"})
+    rows = {row["id"]: row for row in map(json.loads, response.text.splitlines())}
+    assert (rows[price["id"]]["price_per_base_unit"], rows[price["id"]]["base_unit"]) == (149.0, "個")
@@ -0,0 +1,24 @@
+import re
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+import database
+import metrics
+
+
+def test_serialize_time_includes_response_model(client, monkeypatch):
+    monkeypatch.setattr(metrics, "SERVER_TIMING", True)
+    # ORMオブジェクトを返し、response_model による変換とJSON化はFastAPIが行うエンドポイント
+    response = client.post("/products/", json={"name": "計測確認", "category": "metrics"})
+    serialize = re.search(r"serialize;dur=([0-9.]+)", response.headers["server-timing"])
+    assert float(serialize.group(1)) > 0
+
+
+def test_failed_statement_does_not_affect_later_timings():
+    with database.engine.connect() as connection:
+        with pytest.raises(OperationalError):
+            connection.exec_driver_sql("SELECT * FROM no_such_table")
+        connection.rollback()
+        assert connection.exec_driver_sql("SELECT 1").scalar() == 1
+        assert "query_start" not in connection.info
@@ -0,0 +1,38 @@
+def create_prices(client, product_name, prices):
+    product = client.post("/products/", json={"name": product_name, "category": "unitcompare"}).json()
+    for index, (price, unit) in enumerate(prices):
+        supermarket = client.post("/supermarkets/", json={
+            "name": f"{product_name}の店{index}", "address": "東京都", "latitude": 35.0, "longitude": 139.0,
+        }).json()
+        response = client.post("/prices/", json={
+            "product_id": product["id"], "supermarket_id": supermarket["id"],
+            "price": price, "unit": unit, "recorded_by": "test",
+        })
+        assert response.status_code == 200
+    return product["id"]
+
+
+def test_compare_does_not_rank_across_base_units(client):
+    product_id = create_prices(client, "単位混在A", [(150, "個"), (98, "100g"), (200, "500g"), (60, "個")])
+
+    prices = client.get(f"/prices/compare/{product_id}").json()["prices"]
+    # 基準単位ごとにまとまり、その中で安い順
+    assert [(p["base_unit"], p["price_per_base_unit"]) for p in prices] == [
+        ("100g", 40.0), ("100g", 98.0), ("個", 60.0), ("個", 150.0),
+    ]
+
+
+def test_compare_batch_aggregates_per_base_unit(client):
+    product_id = create_prices(client, "単位混在B", [(150, "個"), (98, "100g"), (200, "500g")])
+
+    result, = client.get("/prices/compare", params={"product_ids": str(product_id)}).json()["results"]
+    by_base_unit = {stats["base_unit"]: stats for stats in result["by_base_unit"]}
+    assert set(by_base_unit) == {"100g", "個"}
+    assert (by_base_unit["100g"]["min_price"], by_base_unit["100g"]["median_price"],
+            by_base_unit["100g"]["max_price"]) == (40.0, 69.0, 98.0)
+    assert by_base_unit["100g"]["count"] == 2
+    assert by_base_unit["100g"]["cheapest"]["price"] == 200
+    assert (by_base_unit["個"]["min_price"], by_base_unit["個"]["median_price"],
+            by_base_unit["個"]["max_price"]) == (150.0, 150.0, 150.0)
+    # 最上位は件数の多い基準単位のもので、100gあたりと1個あたりの価格を混ぜない
+    assert (result["base_unit"], result["min_price"], result["max_price"]) == ("100g", 40.0, 98.0)
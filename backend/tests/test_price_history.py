@@ -0,0 +1,40 @@
+import pytest
+
+import cache
+import models
+import price_history
+
+
+def history(client, product_id):
+    # 集計テーブルを直接作り直すので、キャッシュを通さずに読む
+    cache.backend.clear()
+    response = client.get(f"/products/{product_id}/history", params={"bucket": "month"})
+    return [(row["base_unit"], row["count"], row["min_price"], row["avg_price"], row["max_price"])
+            for row in response.json()["history"]]
+
+
+def test_history_is_aggregated_per_base_unit(client, db):
+    product = client.post("/products/", json={"name": "単位混在の履歴", "category": "history"}).json()
+    supermarket = client.post("/supermarkets/", json={
+        "name": "単位混在の履歴の店", "address": "東京都", "latitude": 35.0, "longitude": 139.0,
+    }).json()
+    for price, unit in [(200, "1l"), (180, "1000ml"), (150, "500ml"), (90, "個")]:
+        client.post("/prices/", json={"product_id": product["id"], "supermarket_id": supermarket["id"],
+                                      "price": price, "unit": unit, "recorded_by": "test"})
+
+    expected = [("100ml", 3, 18.0, pytest.approx(68 / 3), 30.0), ("個", 1, 90.0, 90.0, 90.0)]
+    assert history(client, product["id"]) == expected
+
+    # 再構築（埋め戻し前の価格があるときのPythonでの集計も）で同じ集計になる
+    price_history.rebuild(db)
+    db.commit()
+    assert history(client, product["id"]) == expected
+    db.execute(models.Price.__table__.insert().values(
+        product_id=product["id"], supermarket_id=supermarket["id"], price=100, unit="500ml", recorded_by="test",
+        price_per_base_unit=None, base_unit=None,
+    ))
+    price_history.rebuild(db)
+    db.commit()
+    assert history(client, product["id"]) == [
+        ("100ml", 4, 18.0, pytest.approx(88 / 4), 30.0), ("個", 1, 90.0, 90.0, 90.0),
+    ]
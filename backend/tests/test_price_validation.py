@@ -0,0 +1,38 @@
+import math
+
+import pytest
+
+import price_stats
+
+
+@pytest.fixture
+def product_and_supermarket(client):
+    product = client.post("/products/", json={"name": "価格検証", "category": "validation"}).json()
+    supermarket = client.post("/supermarkets/", json={
+        "name": "価格検証の店", "address": "東京都", "latitude": 35.0, "longitude": 139.0,
+    }).json()
+    return product["id"], supermarket["id"]
+
+
+@pytest.mark.parametrize("price", ["1e400", "-1e400", "NaN", "0", "-10"])
+def test_create_price_rejects_non_finite_and_non_positive(client, product_and_supermarket, price):
+    product_id, supermarket_id = product_and_supermarket
+    body = f'{{"product_id": {product_id}, "supermarket_id": {supermarket_id}, "price": {price}, "recorded_by": "test"}}'
+    response = client.post("/prices/", content=body, headers={"content-type": "application/json"})
+    assert response.status_code == 422
+
+
+def test_bulk_rejects_non_finite_rows(client, product_and_supermarket):
+    product_id, supermarket_id = product_and_supermarket
+    row = '{{"product_id": {}, "supermarket_id": {}, "price": {}, "recorded_by": "test"}}'
+    body = "[" + ", ".join(row.format(product_id, supermarket_id, price) for price in ("1e400", "NaN", "120")) + "]"
+    result = client.post("/prices/bulk", content=body, headers={"content-type": "application/json"}).json()
+    assert result["inserted"] == 1
+    assert [error["index"] for error in result["errors"]] == [0, 1]
+
+
+def test_sketch_ignores_non_finite_values():
+    sketch = price_stats.Sketch()
+    for value in (100.0, math.inf, math.nan, 200.0):
+        sketch.add(value)
+    assert (sketch.count, sketch.min, sketch.max) == (2, 100.0, 200.0)
@@ -0,0 +1,51 @@
+"""一覧・比較のSQLの発行回数が件数によらず一定である（行ごとにクエリを発行しない）ことを確認する"""
+
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+import database
+
+
+@contextmanager
+def count_statements():
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(database.engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(database.engine, "before_cursor_execute", record)
+
+
+def create_product_with_prices(client, name, size):
+    product = client.post("/products/", json={"name": name, "category": "querycount"}).json()
+    rows = []
+    for index in range(size):
+        supermarket = client.post("/supermarkets/", json={
+            "name": f"{name}の店{index}", "address": "東京都", "latitude": 35.0, "longitude": 139.0,
+        }).json()
+        rows.append({"product_id": product["id"], "supermarket_id": supermarket["id"],
+                     "price": 100 + index, "unit": "個", "recorded_by": "test"})
+    assert client.post("/prices/bulk", json=rows).json()["inserted"] == size
+    return product["id"]
+
+
+@pytest.mark.parametrize("path, prices", [
+    ("/prices/?product_id={}", lambda body: body),
+    ("/prices/compare/{}", lambda body: body["prices"]),
+    ("/prices/compare?product_ids={}", lambda body: body["results"][0]["prices"]),
+])
+def test_statement_count_does_not_grow_with_rows(client, path, prices):
+    counts = []
+    for size in (2, 40):
+        product_id = create_product_with_prices(client, f"クエリ数{path}{size}", size)
+        with count_statements() as statements:
+            response = client.get(path.format(product_id))
+        assert len(prices(response.json())) == size
+        counts.append(len(statements))
+    assert counts[0] == counts[1] > 0
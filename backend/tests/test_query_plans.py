@@ -0,0 +1,142 @@
+"""
+クエリプランの回帰テスト
+
+データを投入してから各エンドポイントを呼び出し、発行されたSELECT文の数と、
+それぞれに EXPLAIN QUERY PLAN をかけた結果を確認する。テーブルのフルスキャン
+（"SCAN テーブル名"。インデックス順に全件読む "SCAN テーブル名 USING [COVERING] INDEX ..." を含む）
+があれば失敗する。CTEやサブクエリの一時結果のスキャンは対象外。
+"""
+
+import re
+
+import pytest
+from sqlalchemy import event
+
+import database
+import latest_prices
+import models
+import price_history
+import price_stats
+import search_index
+import startup
+
+# 意図的にフルスキャンを許容する呼び出し（条件なしの先頭ページ読み）
+ALLOWED_SCANS = {
+    ("GET /supermarkets/", "supermarkets"),
+    ("GET /products/", "products"),
+    ("GET /prices/", "prices"),
+}
+
+# (メソッド, URL, 本文, SELECT文の数)。{product}, {supermarket}, {user} は投入したデータのID
+REQUESTS = [
+    ("GET", "/supermarkets/", None, 1),
+    ("GET", "/supermarkets/{supermarket}", None, 1),
+    ("GET", "/supermarkets-nearby?latitude=35.68&longitude=139.76&radius=5", None, 2),
+    ("GET", "/products/", None, 1),
+    ("GET", "/products/?category=野菜", None, 1),
+    ("GET", "/products/search?q=乳", None, 2),
+    # 商品が200件しかないので、ヒットが表の半分を超える「商品1」では主キーで読むより全件読むほうが速いと判断される
+    ("GET", "/products/search?q=商品12", None, 2),
+    ("GET", "/prices/", None, 1),
+    ("GET", "/prices/?product_id={product}", None, 1),
+    ("GET", "/prices/?supermarket_id={supermarket}", None, 1),
+    ("GET", "/prices/?product_id={product}&supermarket_id={supermarket}", None, 1),
+    ("GET", "/prices/?product_id={product}&cursor=WyIyMDAwLTAxLTAxVDAwOjAwOjAwIiwgMV0", None, 1),
+    ("GET", "/prices/?supermarket_id={supermarket}&cursor=WyIyMDAwLTAxLTAxVDAwOjAwOjAwIiwgMV0", None, 1),
+    ("GET", "/products/?category=野菜&cursor=WzEwXQ", None, 1),
+    ("GET", "/prices/compare/{product}", None, 1),
+    ("GET", "/products/{product}/history?bucket=week", None, 2),
+    ("GET", "/products/{product}/history?bucket=day&supermarket_id={supermarket}&start=2000-01-01", None, 2),
+    ("GET", "/products/{product}/stats?latitude=35.68&longitude=139.76&radius=5", None, 2),
+    ("GET", "/products/{product}/stats?latitude=35.68&longitude=139.76&radius=5&months=120", None, 2),
+    ("GET", "/prices/compare?product_ids={product},{product2},{product3}", None, 1),
+    ("GET", "/prices/compare?product_ids={product},{product2},{product3}&latitude=35.68&longitude=139.76&radius=5",
+     None, 2),
+    ("GET", "/export/prices?since=2000-01-01T00:00:00", None, 1),
+    ("POST", "/prices/", {"price": 198}, 9),
+    # 値下がり（お気に入りのユーザーへの通知を作る）
+    ("POST", "/prices/", {"price": 50}, 11),
+    ("GET", "/users/{user}/alerts?since=2000-01-01T00:00:00", None, 2),
+    ("GET", "/users/{user}/favorites", None, 1),
+]
+
+_SCAN = re.compile(r"^SCAN (\w+)(?: USING (?:COVERING )?INDEX \w+)?$")
+
+
+@pytest.fixture(scope="module")
+def ids(client):
+    """プランが実データに近くなるよう、ある程度の件数を投入する"""
+    db = database.SessionLocal()
+    try:
+        supermarkets = [
+            models.Supermarket(name=f"店舗{i}", address="東京都", latitude=35.5 + i * 0.002, longitude=139.6 + i * 0.002)
+            for i in range(200)
+        ]
+        categories = ["野菜", "乳製品", "肉類", "果物"]
+        products = [models.Product(name=f"商品{i}", category=categories[i % len(categories)]) for i in range(200)]
+        users = [models.User(username=f"plan-user{i}", email=f"plan-user{i}@example.com") for i in range(100)]
+        db.add_all(supermarkets + products + users)
+        db.flush()
+        first_supermarket, first_product, first_user = supermarkets[0].id, products[0].id, users[0].id
+        db.execute(models.Price.__table__.insert(), [
+            {"product_id": first_product + i % 200, "supermarket_id": first_supermarket + (i * 7) % 200,
+             "price": 100 + i % 50, "unit": "個", "recorded_by": "seed"}
+            for i in range(20000)
+        ])
+        db.execute(models.Favorite.__table__.insert(), [
+            {"user_id": first_user + i % 100, "product_id": first_product + i % 200 if i % 3 else None,
+             "supermarket_id": first_supermarket + (i * 7) % 200 if i % 3 != 1 else None}
+            for i in range(1000)
+        ])
+        latest_prices.rebuild(db)
+        price_history.rebuild(db)
+        price_stats.rebuild(db)
+        search_index.sync(db)
+        db.commit()
+    finally:
+        db.close()
+    with database.engine.connect() as connection:
+        connection.exec_driver_sql("ANALYZE")
+    # 店舗のインデックスなどを読み込んだ状態（受け付け中のワーカーと同じ）で数える
+    startup.warm_up()
+    return {"product": first_product, "product2": first_product + 1, "product3": first_product + 2,
+            "supermarket": first_supermarket, "user": first_user}
+
+
+def explain(connection, statement, parameters):
+    rows = connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).fetchall()
+    return [row[-1] for row in rows]
+
+
+@pytest.mark.parametrize("method, url, body, expected_selects", REQUESTS)
+def test_query_plan(client, ids, method, url, body, expected_selects):
+    url = url.format(**ids)
+    if body is not None:
+        body = dict(body, product_id=ids["product"], supermarket_id=ids["supermarket"], unit="個",
+                    recorded_by="checker")
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("SELECT", "WITH")):
+            captured.append((statement, parameters))
+
+    label = f"{method} {url}"
+    event.listen(database.engine, "before_cursor_execute", capture)
+    try:
+        response = client.request(method, url, json=body)
+    finally:
+        event.remove(database.engine, "before_cursor_execute", capture)
+    assert response.status_code < 400, response.text
+
+    scans = []
+    with database.engine.connect() as connection:
+        for statement, parameters in captured:
+            for detail in explain(connection, statement, parameters):
+                match = _SCAN.match(detail)
+                # CTEやサブクエリの一時結果のスキャンは対象外
+                if not match or match.group(1) not in models.Base.metadata.tables:
+                    continue
+                if (label, match.group(1)) not in ALLOWED_SCANS:
+                    scans.append(f"{detail}: {' '.join(statement.split())}")
+    assert scans == []
+    assert len(captured) == expected_selects
@@ -0,0 +1,43 @@
+import models
+import search_index
+
+
+def add_products(db, prefix, count):
+    # 関連度がばらつくよう商品名の長さを変える
+    products = [
+        models.Product(name=prefix + "あ" * (index % 7) + str(index), category="searchpaging")
+        for index in range(count)
+    ]
+    db.add_all(products)
+    db.flush()
+    search_index.add_products(db, products)
+    db.commit()
+    return products
+
+
+def page_through(client, q, page_size, pages):
+    found = []
+    for offset in range(0, page_size * pages, page_size):
+        found += [product["id"] for product in
+                  client.get("/products/search", params={"q": q, "limit": page_size, "offset": offset}).json()]
+    return found
+
+
+def test_search_pages_return_every_hit_in_window_once(client, db, monkeypatch):
+    monkeypatch.setattr(search_index, "RANK_WINDOW", 1000)
+    products = add_products(db, "頁送確認", 3000)
+
+    found = page_through(client, "頁送確認", 100, 30)
+    # 並べるのはID順で先頭 RANK_WINDOW 件のヒットだけで、その各ヒットがちょうど1回ずつ返る
+    assert len(found) == 1000
+    assert sorted(found) == sorted(product.id for product in products[:1000])
+
+
+def test_search_ranks_at_most_window_hits(client, db, monkeypatch):
+    monkeypatch.setattr(search_index, "RANK_WINDOW", 50)
+    add_products(db, "範囲確認", 500)
+
+    assert len(search_index.search(db, "範囲確認", 100, 0)) == 50
+    assert len(search_index.search(db, "範囲確認", 30, 40)) == 10
+    assert search_index.search(db, "範囲確認", 30, 50) == []
+    assert len(page_through(client, "範囲確認", 20, 25)) == 50
@@ -0,0 +1,35 @@
+import pytest
+
+import viewport
+
+
+def test_tile_span_counts_tiles_at_zoom():
+    width, height = viewport.tile_span(-180, -85, 180, 85, 14)
+    assert width == 1 << 14
+    assert height > 16000
+    # 日付変更線をまたぐ範囲は東回りの幅
+    assert viewport.tile_span(179, 0, -179, 1, 0)[0] == pytest.approx(2 / 360)
+
+
+@pytest.mark.parametrize("bbox, zoom, status", [
+    ("-180,-85,180,85", 14, 400),
+    ("-180,-85,180,85", 2, 200),
+    ("139.6,35.6,139.8,35.8", 12, 200),
+    ("139.0,35.0,141.0,37.0", 14, 400),
+])
+def test_viewport_rejects_oversized_bbox(client, bbox, zoom, status):
+    response = client.get("/supermarkets/viewport", params={"bbox": bbox, "zoom": zoom})
+    assert response.status_code == status
+
+
+def test_clusters_have_only_counts_and_centroids():
+    index = viewport.ClusterIndex([1, 2, 3], ["イオン A店", "西友 B店", "店C"], [35.0, 35.0001, 36.0],
+                                  [139.0, 139.0001, 140.0])
+    clusters, supermarkets = index.query(138.5, 34.5, 140.5, 36.5, 8)
+    assert clusters == [{"count": 2, "latitude": 35.00005, "longitude": 139.00005}]
+    assert [supermarket["id"] for supermarket in supermarkets] == [3]
+    # 店舗の追加でも同じ集計になる
+    extended = viewport.ClusterIndex([1], ["イオン A店"], [35.0], [139.0]).extend(
+        [2, 3], ["西友 B店", "店C"], [35.0001, 36.0], [139.0001, 140.0])
+    assert extended.query(138.5, 34.5, 140.5, 36.5, 8) == (clusters, supermarkets)
+
@@ -0,0 +1,122 @@
+import pytest
+
+import database
+import models
+import write_queue
+
+
+@pytest.fixture
+def ids(client):
+    product = client.post("/products/", json={"name": "書き込みキュー確認", "category": "writequeue"}).json()
+    supermarkets = [
+        client.post("/supermarkets/", json={
+            "name": f"書き込みキュー確認の店{index}", "address": "東京都", "latitude": 35.0, "longitude": 139.0,
+        }).json()["id"]
+        for index in range(2)
+    ]
+    return product["id"], supermarkets
+
+
+def make_queue(**options):
+    # 書き込みスレッドは起動せず、テストから flush を呼ぶ
+    return write_queue.WriteQueue(database.SessionLocal, **options)
+
+
+def row(product_id, supermarket_id, price, recorded_by="test"):
+    return {"product_id": product_id, "supermarket_id": supermarket_id, "price": price, "unit": "個",
+            "recorded_by": recorded_by}
+
+
+def flush(queue):
+    queue.flush(list(queue._pending.values()))
+
+
+def stored_price(db, price_id):
+    return db.get(models.Price, price_id).price
+
+
+def test_coalesce_replaces_queued_and_skips_duplicate_after_flush(ids, db):
+    product_id, (store, other_store) = ids
+    queue = make_queue()
+    first, coalesced = queue.submit(row(product_id, store, 200))
+    assert not coalesced
+    # 書き出し前の同じ登録は後の価格で置き換える
+    assert queue.submit(row(product_id, store, 180)) == (first, True)
+    # 店舗・登録者が違えば別の登録
+    assert queue.submit(row(product_id, other_store, 180))[1] is False
+    assert queue.submit(row(product_id, store, 180, recorded_by="other"))[1] is False
+    assert queue.depth() == 3
+
+    flush(queue)
+    assert queue.depth() == 0
+    assert stored_price(db, queue.status(first)["price_id"]) == 180
+    # 登録済みと同じ価格は二重送信としてまとめ、違う価格は新しく受け付ける
+    assert queue.submit(row(product_id, store, 180)) == (first, True)
+    second, coalesced = queue.submit(row(product_id, store, 170))
+    assert second != first and not coalesced
+
+
+def test_submit_raises_queue_full(ids):
+    product_id, (store, other_store) = ids
+    queue = make_queue(max_depth=1)
+    queue.submit(row(product_id, store, 200))
+    with pytest.raises(write_queue.QueueFull):
+        queue.submit(row(product_id, other_store, 200))
+    # まとめられる登録はキューが一杯でも受け付ける
+    assert queue.submit(row(product_id, store, 190))[1] is True
+
+
+def test_status_lifecycle(ids, db):
+    product_id, (store, _) = ids
+    queue = make_queue(coalesce_seconds=0)
+    accepted_id, _ = queue.submit(row(product_id, store, 200))
+    assert queue.status(accepted_id) == {"accepted_id": accepted_id, "status": "queued", "price_id": None}
+
+    flush(queue)
+    status = queue.status(accepted_id)
+    assert status["status"] == "stored"
+    assert stored_price(db, status["price_id"]) == 200
+    assert queue.status("unknown") is None
+
+    # まとめる期間を過ぎて書き出しも終わったものは、次の受け付けで忘れる
+    queue.submit(row(product_id, store, 190))
+    assert queue.status(accepted_id) is None
+
+
+def test_failed_insert_is_reported(ids):
+    product_id, (store, _) = ids
+    queue = make_queue()
+    accepted_id, _ = queue.submit(dict(row(product_id, store, 200), product_id=None))
+    flush(queue)
+    assert queue.status(accepted_id)["status"] == "failed"
+    assert queue.depth() == 0
+
+
+@pytest.fixture
+def write_behind(monkeypatch):
+    queue = make_queue(max_depth=1)
+    monkeypatch.setattr(write_queue, "WRITE_BEHIND", True)
+    monkeypatch.setattr(write_queue, "write_queue", queue)
+    return queue
+
+
+def test_post_price_returns_accepted_and_503_when_full(client, ids, write_behind):
+    product_id, (store, other_store) = ids
+    response = client.post("/prices/", json=row(product_id, store, 200))
+    assert response.status_code == 202
+    body = response.json()
+    assert body == {"accepted_id": body["accepted_id"], "status": "queued", "price_id": None, "coalesced": False}
+    assert client.get(f"/prices/accepted/{body['accepted_id']}").json()["status"] == "queued"
+
+    full = client.post("/prices/", json=row(product_id, other_store, 200))
+    assert full.status_code == 503
+    assert full.headers["retry-after"] == "1"
+
+    flush(write_behind)
+    assert client.get(f"/prices/accepted/{body['accepted_id']}").json()["status"] == "stored"
+    assert client.get("/prices/accepted/unknown").status_code == 404
+
+
+def test_openapi_documents_accepted_response(client):
+    responses = client.get("/openapi.json").json()["paths"]["/prices/"]["post"]["responses"]
+    assert responses["202"]["content"]["application/json"]["schema"]["$ref"].endswith("/AcceptedPriceResponse")
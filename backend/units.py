@@ -0,0 +1,91 @@
+"""
+価格の単位の正規化
+
+Price.unit は自由入力（"個", "100g", "1kg", "袋", "500ml×2本", "1パック(10個入)" など）なので、
+単位の異なる価格を比べられるよう、基準単位あたりの価格（price_per_base_unit）に換算する。
+基準単位は重さなら100g、容量なら100ml、数えるものはその助数詞（"個", "袋" など）1つ。
+解釈できない単位はその文字列を基準単位とし、価格はそのまま使う。
+"""
+
+import re
+import unicodedata
+from collections import namedtuple
+from functools import lru_cache
+
+MASS_BASE = "100g"
+VOLUME_BASE = "100ml"
+DEFAULT_COUNTER = "個"
+
+# 単位 -> グラム / ミリリットル
+MASS_UNITS = {"mg": 0.001, "g": 1, "グラム": 1, "kg": 1000, "キロ": 1000, "キログラム": 1000}
+VOLUME_UNITS = {"ml": 1, "cc": 1, "ミリリットル": 1, "dl": 100, "l": 1000, "リットル": 1000}
+
+# 助数詞。入れ物（パック・袋など）より中身の数え方を基準単位に優先する
+ITEM_COUNTERS = ("個", "本", "枚", "玉", "尾", "切れ", "切", "株", "丁", "斤", "房", "束", "缶", "食", "杯", "粒", "匹", "羽")
+CONTAINER_COUNTERS = ("パック", "袋", "箱", "ケース", "セット", "カップ", "瓶", "ネット", "p")
+
+# "あたり" "入り" などの付け足しの語
+_NOISE = re.compile(r"(当たり|当り|あたり|入り|入|につき|per|/|税込|税抜|約)")
+_PART = re.compile(r"^(\d+(?:\.\d+)?)?([^\d.]*)$")
+
+Unit = namedtuple("Unit", ["quantity", "base_unit"])
+
+
+@lru_cache(maxsize=4096)
+def parse_unit(unit):
+    """単位の文字列を (基準単位でいくつ分か, 基準単位) にする"""
+    text = unicodedata.normalize("NFKC", unit or "").lower()
+    text = _NOISE.sub("", text).replace(" ", "")
+    if not text:
+        return Unit(1.0, DEFAULT_COUNTER)
+
+    # "500ml×2本" や "1パック(10個入)" は掛け合わせる
+    parts = [part for part in re.split(r"[×x*()（）]", text) if part]
+    quantity = 1.0
+    mass = volume = None
+    items = []
+    containers = []
+    for part in parts:
+        match = _PART.match(part)
+        if match is None:
+            return Unit(1.0, unit.strip())
+        number, word = match.groups()
+        quantity *= float(number) if number else 1.0
+        if word in MASS_UNITS:
+            mass = (mass or 1.0) * MASS_UNITS[word]
+        elif word in VOLUME_UNITS:
+            volume = (volume or 1.0) * VOLUME_UNITS[word]
+        elif word in ITEM_COUNTERS:
+            items.append(word)
+        elif word in CONTAINER_COUNTERS:
+            containers.append(word)
+        elif word:
+            return Unit(1.0, unit.strip())
+
+    if mass is not None and volume is None:
+        return Unit(quantity * mass / 100, MASS_BASE)
+    if volume is not None and mass is None:
+        return Unit(quantity * volume / 100, VOLUME_BASE)
+    if mass is None and volume is None:
+        counter = (items or containers or [DEFAULT_COUNTER])[0]
+        return Unit(quantity, "パック" if counter == "p" else counter)
+    return Unit(1.0, unit.strip())
+
+
+def normalize(price, unit):
+    """価格と単位から (基準単位あたりの価格, 基準単位) を返す"""
+    quantity, base_unit = parse_unit(unit)
+    if quantity <= 0:
+        return price, base_unit
+    return price / quantity, base_unit
+
+
+def normalized(row):
+    """
+    price, unit, price_per_base_unit, base_unit を持つ価格の行の (基準単位あたりの価格, 基準単位)
+
+    基準単位あたりの価格が埋まっていない行（埋め戻し前の価格）はその場で換算する。
+    """
+    if row.price_per_base_unit is None:
+        return normalize(row.price, row.unit)
+    return row.price_per_base_unit, row.base_unit
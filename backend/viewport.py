@@ -0,0 +1,247 @@
+"""
+地図の表示範囲（ビューポート）の店舗マーカーとクラスタ
+
+店舗をWebメルカトルのタイル座標で複数の解像度のグリッドに集計しておき、
+ズームが小さいときはセルごとのクラスタ（店舗数・重心）を、
+ズームが大きいときは個々の店舗を返す。表示範囲内のセルは二分探索で取り出すので、
+店舗数が増えてもリクエストごとに全店舗を走査しない。
+
+クラスタのセルはズーム z のタイルを 4×4 に分けた大きさ（レベル z+2、約64px四方）。
+"""
+
+import math
+import threading
+
+import numpy as np
+from sqlalchemy import func
+
+import models
+
+# これ以上のズームでは個々の店舗を返す
+INDIVIDUAL_ZOOM = 15
+
+# クラスタのセルのレベルはズーム+2（タイル1枚を4×4に分ける）
+CELL_LEVEL_OFFSET = 2
+MAX_CELL_LEVEL = INDIVIDUAL_ZOOM - 1 + CELL_LEVEL_OFFSET
+
+# 個々の店舗を返すときの上限
+MAX_MARKERS = 2000
+
+# 表示範囲の幅・高さの上限（そのズームのタイル数）。4Kの画面でも横15枚程度なので十分大きい。
+# 世界全体をズーム14で指定するような範囲ではセルの列を数万回たどることになるので受け付けない
+MAX_VIEWPORT_TILES = 64
+
+# Webメルカトルで扱える緯度の範囲
+MAX_LATITUDE = 85.05112878
+
+
+def tile_xy(latitudes, longitudes, level):
+    """緯度・経度をレベル level のタイル座標（整数）にする"""
+    scale = 1 << level
+    lat = np.radians(np.clip(latitudes, -MAX_LATITUDE, MAX_LATITUDE))
+    x = (np.asarray(longitudes, dtype=np.float64) + 180.0) / 360.0 * scale
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / math.pi) / 2.0 * scale
+    return (
+        np.clip(x.astype(np.int64), 0, scale - 1),
+        np.clip(y.astype(np.int64), 0, scale - 1),
+    )
+
+
+def tile_span(lon_min, lat_min, lon_max, lat_max, zoom):
+    """表示範囲の (幅, 高さ) をズーム zoom のタイル数で返す（lon_min > lon_max は日付変更線をまたぐ範囲）"""
+    width = lon_max - lon_min if lon_min <= lon_max else 360.0 - (lon_min - lon_max)
+    _, (y_top, y_bottom) = tile_xy(np.array([lat_max, lat_min]), np.zeros(2), zoom)
+    return width / 360.0 * (1 << zoom), int(y_bottom - y_top) + 1
+
+
+class _Level:
+    """1つのレベルのセル集計（キー x*2^level+y の昇順）"""
+
+    __slots__ = ("level", "keys", "counts", "lat_sums", "lon_sums", "first_positions")
+
+    def __init__(self, level, keys, counts, lat_sums, lon_sums, first_positions):
+        self.level = level
+        self.keys = keys
+        self.counts = counts
+        self.lat_sums = lat_sums
+        self.lon_sums = lon_sums
+        self.first_positions = first_positions  # セル内でIDが最小の店舗の位置（1店舗だけのセル用）
+
+    @classmethod
+    def build(cls, level, latitudes, longitudes, positions, ids):
+        """店舗から集計を作る。positions は店舗の配列での位置"""
+        x, y = tile_xy(latitudes, longitudes, level)
+        return cls.aggregate(level, (x << level) | y, np.ones(len(x), dtype=np.int64),
+                             np.asarray(latitudes, dtype=np.float64), np.asarray(longitudes, dtype=np.float64),
+                             positions, ids)
+
+    @classmethod
+    def aggregate(cls, level, keys, counts, lat_sums, lon_sums, positions, ids):
+        cells, inverse = np.unique(keys, return_inverse=True)
+        size = len(cells)
+        first = np.full(size, np.iinfo(np.int64).max, dtype=np.int64)
+        np.minimum.at(first, inverse, ids[positions])
+        # IDが最小の店舗の位置を求める（IDは一意なので位置に戻せる）
+        first_positions = np.empty(size, dtype=np.int64)
+        is_first = ids[positions] == first[inverse]
+        first_positions[inverse[is_first]] = positions[is_first]
+        return cls(
+            level, cells,
+            np.bincount(inverse, weights=counts, minlength=size).astype(np.int64),
+            np.bincount(inverse, weights=lat_sums, minlength=size),
+            np.bincount(inverse, weights=lon_sums, minlength=size),
+            first_positions,
+        )
+
+    def merge(self, other, ids):
+        """別の集計（追加された店舗分）を足した集計を返す"""
+        return _Level.aggregate(
+            self.level,
+            np.concatenate([self.keys, other.keys]),
+            np.concatenate([self.counts, other.counts]),
+            np.concatenate([self.lat_sums, other.lat_sums]),
+            np.concatenate([self.lon_sums, other.lon_sums]),
+            np.concatenate([self.first_positions, other.first_positions]),
+            ids,
+        )
+
+    def cells_in(self, x_min, x_max, y_min, y_max):
+        """タイル座標の範囲に入るセルの添字を返す"""
+        blocks = []
+        for x in range(x_min, x_max + 1):
+            start = np.searchsorted(self.keys, (x << self.level) | y_min, side="left")
+            stop = np.searchsorted(self.keys, (x << self.level) | y_max, side="right")
+            if stop > start:
+                blocks.append(np.arange(start, stop))
+        return np.concatenate(blocks) if blocks else np.empty(0, dtype=np.int64)
+
+
+class ClusterIndex:
+    """
+    店舗の座標・名前と、レベルごとのセル集計
+
+    インスタンスは不変で、店舗の追加時は extend で新しいインデックスを作る。
+    """
+
+    def __init__(self, ids=(), names=(), latitudes=(), longitudes=(), levels=None):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.names = list(names)
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.max_id = int(self.ids.max()) if len(self.ids) else 0
+        if levels is None:
+            positions = np.arange(len(self.ids), dtype=np.int64)
+            levels = [
+                _Level.build(level, self.latitudes, self.longitudes, positions, self.ids)
+                for level in range(MAX_CELL_LEVEL + 1)
+            ]
+        self.levels = levels
+        # 個々の店舗を返すときの絞り込み用に経度順の並びも持つ
+        self.lon_order = np.argsort(self.longitudes, kind="stable")
+        self.sorted_longitudes = self.longitudes[self.lon_order]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def extend(self, ids, names, latitudes, longitudes):
+        """店舗を追加した新しいインデックスを返す（各レベルは追加分の集計を足すだけ）"""
+        offset = len(self.ids)
+        ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])
+        names = self.names + list(names)
+        latitudes = np.concatenate([self.latitudes, np.asarray(latitudes, dtype=np.float64)])
+        longitudes = np.concatenate([self.longitudes, np.asarray(longitudes, dtype=np.float64)])
+        positions = np.arange(offset, len(ids), dtype=np.int64)
+        levels = [
+            level.merge(
+                _Level.build(level.level, latitudes[offset:], longitudes[offset:], positions, ids), ids
+            )
+            for level in self.levels
+        ]
+        return ClusterIndex(ids, names, latitudes, longitudes, levels)
+
+    def query(self, lon_min, lat_min, lon_max, lat_max, zoom):
+        """
+        表示範囲のマーカーを返す
+
+        戻り値は (クラスタの辞書のリスト, 店舗の辞書のリスト)。
+        経度の範囲が日付変更線をまたぐ場合は lon_min > lon_max で指定する。
+        """
+        ranges = [(lon_min, lon_max)] if lon_min <= lon_max else [(lon_min, 180.0), (-180.0, lon_max)]
+        if zoom >= INDIVIDUAL_ZOOM:
+            positions = np.concatenate([self._stores_in(lat_min, lat_max, west, east) for west, east in ranges])
+            return [], self._stores(positions[:MAX_MARKERS])
+
+        level = self.levels[min(zoom + CELL_LEVEL_OFFSET, MAX_CELL_LEVEL)]
+        clusters = []
+        singles = []
+        for west, east in ranges:
+            x_min, y_max = tile_xy(np.array([lat_min]), np.array([west]), level.level)
+            x_max, y_min = tile_xy(np.array([lat_max]), np.array([east]), level.level)
+            cells = level.cells_in(int(x_min[0]), int(x_max[0]), int(y_min[0]), int(y_max[0]))
+            counts = level.counts[cells]
+            singles.append(level.first_positions[cells[counts == 1]])
+            for cell in cells[counts > 1].tolist():
+                count = int(level.counts[cell])
+                clusters.append({
+                    "count": count,
+                    "latitude": round(float(level.lat_sums[cell]) / count, 6),
+                    "longitude": round(float(level.lon_sums[cell]) / count, 6),
+                })
+        clusters.sort(key=lambda cluster: (-cluster["count"], cluster["latitude"], cluster["longitude"]))
+        return clusters, self._stores(np.concatenate(singles))
+
+    def _stores_in(self, lat_min, lat_max, west, east):
+        start = np.searchsorted(self.sorted_longitudes, west, side="left")
+        stop = np.searchsorted(self.sorted_longitudes, east, side="right")
+        positions = self.lon_order[start:stop]
+        latitudes = self.latitudes[positions]
+        return positions[(latitudes >= lat_min) & (latitudes <= lat_max)]
+
+    def _stores(self, positions):
+        positions = positions[np.argsort(self.ids[positions], kind="stable")]
+        return [
+            {
+                "id": int(self.ids[position]),
+                "name": self.names[position],
+                "latitude": float(self.latitudes[position]),
+                "longitude": float(self.longitudes[position]),
+            }
+            for position in positions.tolist()
+        ]
+
+
+_cluster_index = ClusterIndex()
+_cluster_index_lock = threading.Lock()
+
+
+def get_cluster_index(db) -> ClusterIndex:
+    """
+    店舗テーブルと同期したClusterIndexを返す
+
+    店舗は追加のみなので、最大IDが進んでいれば差分だけ読み込んで拡張する。
+    他のワーカープロセスで追加された店舗もここで取り込まれる。
+    """
+    global _cluster_index
+    latest_id = db.query(func.max(models.Supermarket.id)).scalar() or 0
+    with _cluster_index_lock:
+        index = _cluster_index
+        if latest_id == index.max_id:
+            return index
+
+        query = db.query(
+            models.Supermarket.id, models.Supermarket.name, models.Supermarket.latitude, models.Supermarket.longitude
+        ).order_by(models.Supermarket.id)
+        if latest_id > index.max_id:
+            rows = query.filter(models.Supermarket.id > index.max_id).all()
+            index = index.extend(*_columns(rows))
+        else:
+            # 店舗が削除された（DBが作り直された）場合は全件から作り直す
+            index = ClusterIndex(*_columns(query.all()))
+        _cluster_index = index
+        return index
+
+
+def _columns(rows):
+    if not rows:
+        return (), (), (), ()
+    return tuple(zip(*rows))
@@ -0,0 +1,262 @@
+"""
+価格登録の書き込みキュー（ライトビハインド）
+
+WRITE_BEHIND=1 のとき、POST /prices/ は商品・店舗IDをメモリ上のID集合で確認して
+キューに入れ、受付ID（accepted_id）をすぐに返す。バックグラウンドのスレッドが
+WRITE_QUEUE_FLUSH_MS ごと、または WRITE_QUEUE_BATCH 件たまるごとに
+1つのトランザクションでまとめて登録する（SQLiteの書き込みロックを取る回数が減る）。
+
+同じ recorded_by・商品・店舗の登録が WRITE_QUEUE_COALESCE_SECONDS 以内に重なった場合は
+まとめる（coalesce）。
+    - まだキューにある登録は、後から来た価格で置き換える
+    - 登録済みのものと価格・単位が同じなら、二重送信とみなして登録しない
+キューが WRITE_QUEUE_MAX 件に達したら受け付けない（呼び出し側は503を返す）。
+
+キューはプロセスごとなので、複数ワーカーではワーカーごとにキューと書き込みスレッドを持つ。
+プロセスが強制終了された場合、キューに残っていた登録は失われる。
+"""
+
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+import database
+import metrics
+import models
+import price_ingest
+
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "0") == "1"
+FLUSH_MS = float(os.getenv("WRITE_QUEUE_FLUSH_MS", "50"))
+BATCH_SIZE = int(os.getenv("WRITE_QUEUE_BATCH", "500"))
+MAX_DEPTH = int(os.getenv("WRITE_QUEUE_MAX", "10000"))
+COALESCE_SECONDS = float(os.getenv("WRITE_QUEUE_COALESCE_SECONDS", "60"))
+
+logger = logging.getLogger("supermarket.write_queue")
+
+FLUSH_ROWS_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+submissions_total = metrics.register(metrics.Counter(
+    "write_queue_submissions_total", "書き込みキューへの登録（accepted / coalesced / rejected）", ("result",)))
+flush_duration = metrics.register(metrics.Histogram(
+    "write_queue_flush_seconds", "キューの書き出し1回にかかった時間", (), metrics.LATENCY_BUCKETS))
+flush_rows = metrics.register(metrics.Histogram(
+    "write_queue_flush_rows", "キューの書き出し1回で登録した件数", (), FLUSH_ROWS_BUCKETS))
+write_delay = metrics.register(metrics.Histogram(
+    "write_queue_delay_seconds", "受け付けてから登録されるまでの時間", (), metrics.LATENCY_BUCKETS))
+failed_rows_total = metrics.register(metrics.Counter(
+    "write_queue_failed_rows_total", "書き出しに失敗して登録できなかった件数", ()))
+
+
+class QueueFull(Exception):
+    """キューが上限に達している"""
+
+
+class KnownIds:
+    """
+    テーブルに存在するIDの集合
+
+    商品・店舗は追加のみなので、集合にないIDが来たときだけ最大IDより後を読み足す。
+    """
+
+    def __init__(self, column):
+        self.column = column
+        self._ids = set()
+        self._max_id = 0
+        self._lock = threading.Lock()
+
+    def contains(self, db, id):
+        if id in self._ids:
+            return True
+        with self._lock:
+            if id > self._max_id:
+                self._load(db)
+            return id in self._ids
+
+    def refresh(self, db):
+        """最大IDより後のIDを読み足す（起動時のウォームアップ用）"""
+        with self._lock:
+            self._load(db)
+
+    def _load(self, db):
+        new_ids = [row[0] for row in db.query(self.column).filter(self.column > self._max_id)]
+        if new_ids:
+            self._ids = self._ids | set(new_ids)
+            self._max_id = max(self._max_id, max(new_ids))
+
+
+class _Entry:
+    __slots__ = ("accepted_id", "row", "key", "accepted_at", "flushing", "price_id", "failed")
+
+    def __init__(self, accepted_id, row, key, accepted_at):
+        self.accepted_id = accepted_id
+        self.row = row
+        self.key = key
+        self.accepted_at = accepted_at
+        self.flushing = False   # 書き出し中（もう置き換えられない）
+        self.price_id = None
+        self.failed = False
+
+    @property
+    def status(self):
+        if self.failed:
+            return "failed"
+        return "queued" if self.price_id is None else "stored"
+
+
+class WriteQueue:
+    """受け付けた価格をためておき、別スレッドでまとめて登録する"""
+
+    def __init__(self, session_factory, flush_ms=FLUSH_MS, batch_size=BATCH_SIZE,
+                 max_depth=MAX_DEPTH, coalesce_seconds=COALESCE_SECONDS):
+        self.session_factory = session_factory
+        self.flush_interval = flush_ms / 1000
+        self.batch_size = batch_size
+        self.max_depth = max_depth
+        self.coalesce_seconds = coalesce_seconds
+        self.product_ids = KnownIds(models.Product.id)
+        self.supermarket_ids = KnownIds(models.Supermarket.id)
+        self._pending = OrderedDict()   # accepted_id -> _Entry（受け付け順）
+        self._recent = OrderedDict()    # (recorded_by, product_id, supermarket_id) -> _Entry（まとめる期間内のもの）
+        self._entries = OrderedDict()   # accepted_id -> _Entry（状態の問い合わせ用、期間内のもの）
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+    def depth(self):
+        return len(self._pending)
+
+    def submit(self, row):
+        """
+        価格（models.Price の列名をキーにした辞書）を受け付け、(受付ID, まとめたか) を返す
+
+        商品・店舗の存在確認は呼び出し側で済ませておく。
+        """
+        key = (row["recorded_by"], row["product_id"], row["supermarket_id"])
+        now = time.monotonic()
+        row = dict(row, recorded_at=datetime.utcnow())
+        with self._condition:
+            self._expire(now)
+            entry = self._recent.get(key)
+            if entry is not None and not entry.failed:
+                if not entry.flushing:
+                    # 書き出し前なら後から来た価格で置き換える
+                    entry.row = row
+                    submissions_total.inc(("coalesced",))
+                    return entry.accepted_id, True
+                if (entry.row["price"], entry.row["unit"]) == (row["price"], row["unit"]):
+                    submissions_total.inc(("coalesced",))
+                    return entry.accepted_id, True
+
+            if len(self._pending) >= self.max_depth:
+                submissions_total.inc(("rejected",))
+                raise QueueFull()
+
+            entry = _Entry(uuid.uuid4().hex, row, key, now)
+            self._pending[entry.accepted_id] = entry
+            self._recent.pop(key, None)
+            self._recent[key] = entry
+            self._entries[entry.accepted_id] = entry
+            submissions_total.inc(("accepted",))
+            if len(self._pending) in (1, self.batch_size):
+                # 空のキューに入ったとき（書き出しの時刻が決まる）とバッチ分たまったときに起こす
+                self._condition.notify()
+            return entry.accepted_id, False
+
+    def status(self, accepted_id):
+        """受付IDの状態（queued / stored / failed と登録された価格ID）。期間を過ぎたものはNone"""
+        with self._condition:
+            entry = self._entries.get(accepted_id)
+            if entry is None:
+                return None
+            return {"accepted_id": accepted_id, "status": entry.status, "price_id": entry.price_id}
+
+    def _expire(self, now):
+        # まとめる期間を過ぎ、書き出しも終わったものを忘れる（受け付け順に並んでいる）
+        while self._entries:
+            entry = next(iter(self._entries.values()))
+            if now - entry.accepted_at < self.coalesce_seconds or entry.accepted_id in self._pending:
+                break
+            self._entries.popitem(last=False)
+            if self._recent.get(entry.key) is entry:
+                del self._recent[entry.key]
+
+    def start(self):
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="write-queue", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """書き込みスレッドを止める（キューに残っている分は書き出してから止まる）"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopping and len(self._pending) < self.batch_size:
+                    if self._pending:
+                        # 最も古い登録が flush_interval 待ったら書き出す
+                        oldest = next(iter(self._pending.values())).accepted_at
+                        timeout = oldest + self.flush_interval - time.monotonic()
+                        if timeout <= 0:
+                            break
+                    else:
+                        timeout = None
+                    self._condition.wait(timeout)
+                if self._stopping and not self._pending:
+                    return
+                batch = [self._pending[accepted_id] for accepted_id in list(self._pending)[:self.batch_size]]
+            self.flush(batch)
+
+    def flush(self, batch):
+        """batch を1トランザクションで登録する（失敗したら1件ずつ登録し直す）"""
+        start = time.perf_counter()
+        # ここから先は置き換えられないよう、行を確定する
+        with self._condition:
+            for entry in batch:
+                entry.flushing = True
+            rows = [entry.row for entry in batch]
+        try:
+            self._insert(batch, rows)
+        except Exception:
+            logger.exception("%d件の書き出しに失敗しました。1件ずつ登録し直します", len(batch))
+            for entry, row in zip(batch, rows):
+                try:
+                    self._insert([entry], [row])
+                except Exception:
+                    logger.exception("登録できませんでした: %r", row)
+                    failed_rows_total.inc(())
+                    with self._condition:
+                        entry.failed = True
+                        self._pending.pop(entry.accepted_id, None)
+        flush_duration.observe((), time.perf_counter() - start)
+        flush_rows.observe((), len(batch))
+
+    def _insert(self, batch, rows):
+        db = self.session_factory()
+        try:
+            inserted = price_ingest.insert_prices(db, rows)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        now = time.monotonic()
+        with self._condition:
+            for entry, price in zip(batch, inserted):
+                entry.price_id = price.id
+                self._pending.pop(entry.accepted_id, None)
+                write_delay.observe((), now - entry.accepted_at)
+
+
+write_queue = WriteQueue(database.SessionLocal)
+metrics.register(metrics.Gauge("write_queue_depth", "書き込みキューにたまっている件数", write_queue.depth))
@@ -2,32 +2,50 @@
 # -*- coding: utf-8 -*-
 """
 スーパーマーケット価格比較アプリ - サーバー起動スクリプト
+
+使い方:
+    python start_server.py                 # 開発用（1プロセス、自動リロード、起動時にスキーマを作成）
+    python start_server.py --prod          # 本番用（CPU数のワーカー、事前に backend/manage.py migrate が必要）
+    python start_server.py --prod --workers 4
 """
 
-import uvicorn
+import argparse
 import os
 import sys
 
 # バックエンドディレクトリに移動
-backend_dir = os.path.join(os.path.dirname(__file__), 'backend')
+backend_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend')
 sys.path.insert(0, backend_dir)
 os.chdir(backend_dir)
 
-# メインアプリケーションをインポート
-import main
-
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="スーパーマーケット価格比較API サーバーの起動")
+    parser.add_argument("--prod", action="store_true", help="本番用に複数ワーカーで起動する（backend/manage.py serve）")
+    parser.add_argument("--workers", type=int, default=None, help="--prod のワーカー数（既定はCPU数）")
+    parser.add_argument("--port", type=int, default=8001)
+    args = parser.parse_args()
+
+    if args.prod:
+        import manage
+        serve_args = ["serve", "--port", str(args.port)]
+        if args.workers:
+            serve_args += ["--workers", str(args.workers)]
+        manage.main(serve_args)
+        sys.exit()
+
+    import uvicorn
+
     print("スーパーマーケット価格比較API サーバーを起動中...")
-    print("サーバーURL: http://192.168.200.38:8001")
-    print("API ドキュメント: http://192.168.200.38:8001/docs")
+    print(f"サーバーURL: http://192.168.200.38:{args.port}")
+    print(f"API ドキュメント: http://192.168.200.38:{args.port}/docs")
     print("停止するには Ctrl+C を押してください")
     print("-" * 50)
-    
-    # サーバー起動
+
+    # サーバー起動（自動リロードにはアプリをモジュール名で渡す）
     uvicorn.run(
-        main.app, 
-        host="0.0.0.0", 
-        port=8001, 
+        "main:app",
+        host="0.0.0.0",
+        port=args.port,
         reload=True,
         log_level="info"
-    )
\ No newline at end of file
+    )